@@ -6,16 +6,19 @@
 
 
 import numpy as np
-from matplotlib import pyplot as plt
+from tube_lti import frequency_response
+from tube_network import Class_TubeNetwork
 
 
 # Check version
 #  Python 3.10.4, 64bit on Win32 (Windows 10)
 #  numpy 1.21.6
+#  scipy 1.8.0
 
 
-class Class_T_ThreeTube(object):
-    def __init__(self, L1, L2, L3, A1, A2, A3, rg0=0.95, rl0=0.9 ,sampling_rate=48000):
+class Class_T_ThreeTube(Class_TubeNetwork):
+    def __init__(self, L1, L2, L3, A1, A2, A3, rg0=0.95, rl0=0.9 ,sampling_rate=48000, delay='integer', dtype=np.float64):
+        super().__init__(sampling_rate=sampling_rate, delay=delay, dtype=dtype)
         # initalize Tube length and Tube area
         self.L1= L1 # set list of 1st tube's length by unit is [cm]
         self.A1= A1 # set list of 1st tube's area by unit is [cm^2]
@@ -23,65 +26,90 @@ class Class_T_ThreeTube(object):
         self.A2= A2 # set list of 2nd tube's area by unit is [cm^2]
         self.L3= L3 # set list of 3rd tube's length by unit is [cm]
         self.A3= A3 # set list of 3rd tube's area by unit is [cm^2]
-        C0=35000.0  # speed of sound in air, round 35000 cm/second
         self.sr= sampling_rate
-        self.tu1=self.L1 / C0   # delay time in 1st tube
-        self.tu2=self.L2 / C0   # delay time in 2nd tube
-        self.tu3=self.L3 / C0   # delay time in 3rd tube
-        self.r12=((self.A3+self.A2) - self.A1)/(self.A3+self.A2+self.A1)  # reflection coefficient between 1st tube and others
-        self.r21=(self.A2 - (self.A3+self.A1))/(self.A3+self.A2+self.A1)  # reflection coefficient between 2nd tube and others
-        self.r31=(self.A3 - (self.A2+self.A1))/(self.A3+self.A2+self.A1)  # reflection coefficient between 3rd tube and others
-
+        self.coefficients()
 
         self.rg0=rg0 # rg is reflection coefficient between glottis and 1st tube
         self.rl0=rl0 # reflection coefficient between 2nd tube and mouth
         self.rl3=-0.97 #set certain a value, beside ideal value is -1
         
         self.att_norm=1.0 # attenuation constant per one step ahead
+        self.wall_loss=0.0 # wall loss filter of every tube, 0 is no frequency dependent loss, up to 0.25
+        self.lip_radiation=0.0 # radiation filter at mouth, 0 is constant reflection rl0, up to 1
         
         self.num_of_tube=3
         
-    def fone(self, xw):
-        # calculate one point of frequecny response
-        yi= 0.5 * ( 1.0 + self.rg0 ) * ( 1.0 + self.r21)  * ( 1.0 + self.rl0 ) * np.exp( -1.0j * ( self.tu1 + self.tu2 ) * xw) 
-        yb1= 1.0 + self.r12 * self.rg0 *  np.exp( -2.0j * self.tu1 * xw ) 
-        yb1= yb1 + self.r21  * self.rl0 *  np.exp( -2.0j * self.tu2 * xw ) 
-        yb1= yb1 + self.rg0 * self.rl0 * (1.0 - self.r12 + self.r21) * np.exp( -2.0j * ( self.tu1 + self.tu2 ) * xw)
-        yc1= self.rl3  * ( 1.0 + self.r31)
-        yc1= yc1 * (1.0 + self.rg0 *  np.exp( -2.0j * self.tu1 * xw ))
-        yc1= yc1 * (1.0 - self.rl0 * np.exp( -2.0j * self.tu2 * xw ))
-        yc1= yc1 * np.exp( -2.0j *  self.tu3 * xw) #np.exp( -1.0j *  self.tu3 * xw)
-        yd1= 1.0 - self.rl3 * np.exp( -2.0j * self.tu3 * xw ) 
-        """
-        if yd1 == 0.0:
-            val=0.  # because yc/yd is infinity when yd = 0
-        else:
-            yc1= yc1 / yd1
-            val= yi / ( yb1 + yc1)
-        """
-        yc1= yc1 / yd1
-        val= yi / ( yb1 + yc1)
-        return np.sqrt(val.real ** 2 + val.imag ** 2)
+        self.work=None   # work buffers of compute_response()
         
-    def H0(self, freq_low=100, freq_high=5000, Band_num=256):
-        # get Log scale frequecny response, from freq_low to freq_high, Band_num points
-        amp=[]
-        freq=[]
-        bands= np.zeros(Band_num+1)
-        fcl=freq_low * 1.0    # convert to float
-        fch=freq_high * 1.0   # convert to float
-        delta1=np.power(fch/fcl, 1.0 / (Band_num)) # Log Scale
-        bands[0]=fcl
-        #print ("i,band = 0", bands[0])
-        for i in range(1, Band_num+1):
-            bands[i]= bands[i-1] * delta1
-            #print ("i,band =", i, bands[i]) 
-        for f in bands:
-            amp.append(self.fone(f * 2.0 * np.pi))
-        return   np.log10(amp) * 20, bands # = amp value, freq list
+    def coefficients(self,):
+        # delay times and reflection coefficients from current tube lengths and areas,
+        # a tube changed after __init__ (e.g. tube.A3=0) is taken in by build() and compute_response()
+        C0=35000.0  # speed of sound in air, round 35000 cm/second
+        self.tu1=self.L1 / C0   # delay time in 1st tube
+        self.tu2=self.L2 / C0   # delay time in 2nd tube
+        self.tu3=self.L3 / C0   # delay time in 3rd tube
+        self.r12=((self.A3+self.A2) - self.A1)/(self.A3+self.A2+self.A1)  # reflection coefficient between 1st tube and others
+        self.r21=(self.A2 - (self.A3+self.A1))/(self.A3+self.A2+self.A1)  # reflection coefficient between 2nd tube and others
+        self.r31=(self.A3 - (self.A2+self.A1))/(self.A3+self.A2+self.A1)  # reflection coefficient between 3rd tube and others
+
+    def compute_response(self, freqs, out, db=True):
+        # frequecny response at freqs [Hz] into out, by closed form of T three tube, dB value if db is True
+        # this is used by response() of Class_TubeNetwork, that keeps the result in cache
+        #
+        #   yi = 0.5 * (1 + rg0) * (1 + r21) * (1 + rl0) * exp(-j (tu1 + tu2) xw)
+        #   yb1= 1 + r12 rg0 E1 + r21 rl0 E2 + rg0 rl0 (1 - r12 + r21) E1 E2
+        #   yc1= rl3 (1 + r31) (1 + rg0 E1) (1 - rl0 E2) E3 / (1 - rl3 E3)
+        #   val= yi / (yb1 + yc1)
+        # where Ek = gk ** 2 exp(-2j tuk xw) and gk = att_norm ** (tuk sr) is the attenuation of one pass
+        # through tube k, as the delay lines of process().  yi is multiplied by g1 g2 and
+        # |exp(-j (tu1 + tu2) xw)| is 1, so only |yi| is used.
+        # with wall_loss or lip_radiation, it is the scattering solution of Class_TubeNetwork.
+        if self.wall_loss or self.lip_radiation:
+            return super().compute_response(freqs, out, db)
+        self.coefficients()
+        if self.work is None or self.work[0].shape != freqs.shape:
+            self.work= [np.empty(freqs.shape, dtype=complex) for i in range(5)]
+        E1, E2, E3, T1, T2 = self.work  # work buffers, reused by next call of same shape
+        loga= np.log(self.att_norm) * self.sr  # log of attenuation per second
+        np.multiply(freqs, -4.0j * np.pi * self.tu1, out=E1)
+        E1 += 2.0 * self.tu1 * loga
+        np.exp(E1, out=E1)
+        np.multiply(freqs, -4.0j * np.pi * self.tu2, out=E2)
+        E2 += 2.0 * self.tu2 * loga
+        np.exp(E2, out=E2)
+        np.multiply(freqs, -4.0j * np.pi * self.tu3, out=E3)
+        E3 += 2.0 * self.tu3 * loga
+        np.exp(E3, out=E3)
+        # yb1 = (1 + r12 rg0 E1) + E2 (r21 rl0 + rg0 rl0 (1 - r12 + r21) E1)
+        np.multiply(E1, self.rg0 * self.rl0 * (1.0 - self.r12 + self.r21), out=T1)
+        T1 += self.r21 * self.rl0
+        T1 *= E2
+        np.multiply(E1, self.r12 * self.rg0, out=T2)
+        T2 += 1.0
+        T1 += T2
+        # yc1
+        np.multiply(E1, self.rg0, out=T2)
+        T2 += 1.0
+        np.multiply(E2, -1.0 * self.rl0, out=E1)
+        E1 += 1.0
+        T2 *= E1
+        T2 *= E3
+        T2 *= self.rl3  * ( 1.0 + self.r31)
+        np.multiply(E3, -1.0 * self.rl3, out=E1)
+        E1 += 1.0
+        T2 /= E1
+        # val
+        T1 += T2
+        np.abs(T1, out=out)
+        yi= 0.5 * ( 1.0 + self.rg0 ) * ( 1.0 + self.r21)  * ( 1.0 + self.rl0 ) * np.exp((self.tu1 + self.tu2) * loga)
+        np.divide(abs(yi), out, out=out)
+        if db:
+            np.log10(out, out=out)
+            out *= 20
+        return out
         
-    def process(self, yg ):
-        # process reflection transmission of resonance tube: yg is input, y2tm is output
+    def build(self,):
+        # set up the network of tubes from current model parameters
         # three T tube
         #
         #
@@ -101,53 +129,31 @@ class Class_T_ThreeTube(object):
         #                                yc2
         #
         #
-        M1= round( self.tu1 * self.sr ) + 1  # for precision, higher sampling_rate is better
-        M2= round( self.tu2 * self.sr ) + 1  # for precision, higher sampling_rate is better
-        M3= round( self.tu3 * self.sr ) + 1  # for precision, higher sampling_rate is better
-        M1= int(M1)
-        M2= int(M2)
-        M3= int(M3)
-        ya1=np.zeros(M1)
-        ya2=np.zeros(M1)
-        yb1=np.zeros(M2)
-        yb2=np.zeros(M2)
-        yc1=np.zeros(M3)
-        yc2=np.zeros(M3)
-        y2tm=np.zeros(len(yg))
+        self.coefficients()
+        self.clear()
+        t1= self.add_tube(self.L1, self.A1, self.att_norm, self.wall_loss)
+        t2= self.add_tube(self.L2, self.A2, self.att_norm, self.wall_loss)
+        t3= self.add_tube(self.L3, self.A3, self.att_norm, self.wall_loss)
+        self.add_glottis((t1, 0), self.rg0)
+        self.add_junction([(t1, 1), (t2, 0), (t3, 0)])  # r12, r21, r31
+        self.add_lip((t2, 1), self.rl0, self.lip_radiation)
+        self.add_closed((t3, 1), self.rl3)
+        self.num_of_tube=3
         
-        for tc0 in range(len(yg)):
-            for i in range((M1-1),0,-1): # process one step
-                ya1[i]=ya1[i-1] * self.att_norm
-                ya2[i]=ya2[i-1] * self.att_norm
-            for i in range((M2-1),0,-1): # process one step
-                yb1[i]=yb1[i-1] * self.att_norm
-                yb2[i]=yb2[i-1] * self.att_norm
-            for i in range((M3-1),0,-1): # process one step
-                yc1[i]=yc1[i-1] * self.att_norm
-                yc2[i]=yc2[i-1] * self.att_norm
-            # calculate reflection
-            #  tube1 input
-            ya1[0]= ((1. + self.rg0 ) / 2.) * yg[tc0] + self.rg0 * ya2[-1]
-            ya2[0]= -1. * self.r12 * ya1[-1] + ( 1. - self.r12 ) * yb2[-1] + ( 1.  - self.r12) * yc2[-1]
-            #  tube2  output
-            yb1[0]= ( 1 + self.r21 ) * ya1[-1] + self.r21 * yb2[-1] + ( 1. + self.r21) * yc2[-1]
-            yb2[0]=  -1. * self.rl0  * yb1[-1]
-            y2tm[tc0]= (1 + self.rl0) * yb1[-1]
-            
-            #  tube 3 closed
-            yc1[0]= ( 1. + self.r31 ) * ya1[-1] + self.r31 * yc2[-1] + ( 1. + self.r31 ) * yb2[-1]
-            yc2[0]=  -1. * self.rl3  * yc1[-1]
-            
-            
-        return y2tm
-
-
     def check1(self,):
         # check if sum of output, ya1, yb2, and yc2 is 1
+        self.coefficients()
         a1= -1. * self.r12  +  ( 1 + self.r21 ) + ( 1. + self.r31 )
         b2= ( 1. - self.r12 )   +  self.r21 + ( 1. + self.r31 )
         c2= ( 1. - self.r12 )   +  ( 1. + self.r21)  +  self.r31 
         print('check1',a1,b2,c2)
+        
+    def check2(self, freq_low=100, freq_high=6000):
+        # check closed form fone against the solution of junction scattering equations
+        xw= np.linspace(freq_low, freq_high, 1000) * 2.0 * np.pi
+        val= frequency_response(*self.scattering(), self.sr, xw)
+        err= np.log10(self.fone(xw) / np.abs(val)) * 20
+        print('check2 max difference [dB]', np.max(np.abs(err)))
 
 
 
@@ -176,6 +182,18 @@ if __name__ == '__main__':
     tube  =  Class_T_ThreeTube(L1_a, L2_a, L3_o, A1_a, A2_a, A3_o, sampling_rate=48000)
     
     tube.check1()
+    tube.check2()
+    
+    # diphthong /a/ -> /o/ in one second: tube3 opens from 0 to A3_o
+    yout= tube.process(np.random.randn(48000) * 0.01, trajectory={'A3': [(0.0, 0.0), (1.0, A3_o)]})
+    print('diphthong output max', np.max(np.abs(yout)))
+    
+    # wall loss and radiation at mouth: higher formants get wider bandwidths
+    for wall_loss, lip_radiation in [(0.0, 0.0), (0.02, 0.5)]:
+        tube.wall_loss= wall_loss
+        tube.lip_radiation= lip_radiation
+        formants, bands = tube.formants()
+        print('wall_loss', wall_loss, 'lip_radiation', lip_radiation, 'bandwidths', np.round(bands[:4], 1))
     
     
     
\ No newline at end of file
@@ -0,0 +1,231 @@
+#coding:utf-8
+
+#
+# Kelly-Lochbaum many-section tube model of an area function
+#
+# The vocal tract is a chain of sections of same length, given by an area function from
+# glottis to lips.  All forward waves and all backward waves are kept in two arrays, and the
+# junctions between sections are updated all at once by vector operations.
+# Side tubes can be attached at chain junctions: a closed side branch like tube3 of the
+# T three tube model, or a tube from one junction to another like the loop of the one-loop
+# four tube model.
+#
+# Chain junction j is between section j-1 and section j (j = 1 ... N-1).  At a junction,
+# with sum_in the sum of all incoming waves, the wave going out into tube k is
+#     2 * A[k] / sum(A) * sum_in - incoming wave from tube k
+# which is same as the scattering of Class_TubeNetwork.
+#
+
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from tube_network import Class_TubeNetwork, C0
+
+
+# Check version
+#  Python 3.10.4, 64bit on Win32 (Windows 10)
+#  numpy 1.21.6
+
+
+class Class_KL_AreaTube(Class_TubeNetwork):
+    def __init__(self, areas, length=17.0, rg0=0.95, rl0=0.9, resample=True, sampling_rate=48000, dtype=np.float64):
+        # areas: area function from glottis to lips by unit is [cm^2], length: total length [cm]
+        # resample: if True, area function is resampled to sections of one sample delay, that
+        #           keeps total length. if False, each area is one section and the delay of a
+        #           section is rounded to integer samples, so process() renders a total length of
+        #           num_of_section times the rounded delay, that is not exact, while response() and
+        #           formants() use the exact length.  A section under 1 sample is ValueError, as its
+        #           delay would be off by more than the section itself.
+        super().__init__(sampling_rate=sampling_rate, dtype=dtype)
+        areas= np.asarray(areas, dtype=float)
+        if resample:
+            N= max(1, int(round( length / C0 * self.sr )))
+            x0= (np.arange(len(areas)) + 0.5) / len(areas)
+            x1= (np.arange(N) + 0.5) / N
+            areas= np.interp(x1, x0, areas)
+        elif length / len(areas) / C0 * self.sr < 1.0 - 1e-9:
+            raise ValueError('section of %.3g samples is under 1 sample, use resample=True or higher sampling_rate'
+                             % (length / len(areas) / C0 * self.sr))
+        self.areas= areas
+        self.length= length
+        self.num_of_section= len(areas)
+        self.Ls= length / self.num_of_section  # section length [cm]
+        self.rg0=rg0 # rg is reflection coefficient between glottis and 1st section
+        self.rl0=rl0 # reflection coefficient between last section and mouth
+        self.att_norm=1.0 # attenuation constant per one step ahead
+        self.sides=[]  # side tubes: [L, A, junction at end 0, junction at end 1 or None, rl of closed end]
+
+    def junction_at(self, x):
+        # index of chain junction nearest to the position x [cm] from glottis
+        return int(min(max(round(x / self.Ls), 1), self.num_of_section - 1))
+
+    def add_branch(self, j, L, A, rl3=-0.97):
+        # attach a closed side tube at chain junction j, like tube3 of T three tube model
+        self.sides.append([L, A, j, None, rl3])
+
+    def add_loop(self, j0, j1, L, A):
+        # attach a tube from chain junction j0 to chain junction j1, like tube3 of one-loop model
+        self.sides.append([L, A, j0, j1, 0.0])
+
+    def build(self,):
+        # equivalent network of tubes, used by frequency response and IIR filter
+        self.clear()
+        N= self.num_of_section
+        for i in range(N):
+            self.add_tube(self.Ls, self.areas[i], self.att_norm)
+        ports= {j: [(j-1, 1), (j, 0)] for j in range(1, N)}
+        for L, A, j0, j1, rl in self.sides:
+            s= self.add_tube(L, A, self.att_norm)
+            ports[j0].append((s, 0))
+            if j1 is None:
+                self.add_closed((s, 1), rl)
+            else:
+                ports[j1].append((s, 1))
+        self.add_glottis((0, 0), self.rg0)
+        for j in range(1, N):
+            self.add_junction(ports[j])
+        self.add_lip((N-1, 1), self.rl0)
+
+    def compile(self,):
+        # scattering coefficients of chain junctions and side tubes for the vectorized kernel
+        # sections are one sample when resampled, so delay lines are integer only
+        if self.delay != 'integer':
+            raise ValueError('Class_KL_AreaTube supports integer delay only')
+        cp= super().compile()
+        N= self.num_of_section
+        S= len(self.sides)
+        D= cp['D']
+        sumA= self.areas[:-1] + self.areas[1:]  # total area at each chain junction
+        for L, A, j0, j1, rl in self.sides:
+            sumA[j0-1] += A
+            if j1 is not None:
+                sumA[j1-1] += A
+        d= int(D[0])          # delay of chain sections
+        ds= D[2*N::2]         # delay of side tubes
+        g= self.att_norm ** d  # attenuation at read tap of chain
+        ar= 2.0 * self.areas[1:] / sumA     # into section j
+        al= 2.0 * self.areas[:-1] / sumA    # into section j-1
+        # junction j = 0 ... N, glottis is 0 and lips is N:
+        #   [F[j], Bk[j-1]] written = C[:, :, j] @ [F[j-1], Bk[j]] read
+        # F[-1] is the input yg, F[N] is the output y2tm, Bk[-1] and Bk[N] are dummy
+        C= np.zeros((2, 2, N+1))
+        C[:, :, 1:N]= g * np.array([[ar, ar - 1.], [al - 1., al]])
+        C[0, 0, 0]= ( 1. + self.rg0 ) / 2.
+        C[0, 1, 0]= g * self.rg0
+        C[0, 0, N]= g * (1 + self.rl0)
+        C[1, 0, N]= g * -1. * self.rl0
+        cp['C']= C
+        cp['d']= d
+        cp['B']= int(min([d] + list(ds)))  # steps processed at once
+        # side tubes: incoming waves rs = [arriving at end 0, arriving at end 1] of each side tube,
+        # summed up per junction into the third row of the read view (sin = rs @ Ci) that is
+        # scattered into the chain by C[:, 2], and side written [SF, SB] = [F[j-1], Bk[j], sin] @ Co + rs @ Cr
+        # where Co is applied to the read view as a part of the row
+        gs= np.concatenate([self.att_norm ** ds, self.att_norm ** ds])
+        Ci= np.zeros((2*S, N+1))  # junction of each incoming side wave
+        Co= np.zeros((3, N+1, 2*S))  # scattering from junction total into side tubes, per row of read view
+        Cr= np.zeros((2*S, 2*S))
+        for s, (L, A, j0, j1, rl) in enumerate(self.sides):
+            Ci[s, j0]= gs[s]
+            Co[:, j0, s]= 2.0 * A / sumA[j0-1]
+            Cr[s, s]= -1. * gs[s]
+            if j1 is None:
+                Cr[S+s, S+s]= -1. * rl * gs[S+s]
+            else:
+                Ci[S+s, j1]= gs[S+s]
+                Co[:, j1, S+s]= 2.0 * A / sumA[j1-1]
+                Cr[S+s, S+s]= -1. * gs[S+s]
+        if S:
+            Co[:2] *= g
+            # as rows of the wave buffer, the read view is columns 0 ... 3N+6
+            Cw= np.zeros((3*N + 7, 2*S))
+            for k in range(3):
+                Cw[k*(N+3):k*(N+3)+N+1]= Co[k]
+            Co= Cw
+            C3= np.zeros((2, 3, N+1))
+            C3[:, :2]= C
+            C3[0, 2, 1:N]= ar
+            C3[1, 2, 1:N]= al
+            cp['C']= C3
+        cp['C']= cp['C'].astype(self.dtype)
+        cp['Ci']= Ci.astype(self.dtype)
+        cp['Co']= Co.astype(self.dtype)
+        cp['Cr']= Cr.astype(self.dtype)
+        # read index of side waves relative to row t, SB then SF columns of the wave buffer
+        K= self.num_of_column()
+        cols= np.concatenate([K - S + np.arange(S), K - 2*S + np.arange(S)])
+        cp['soff']= (np.arange(cp['B'])[:, None] - np.concatenate([ds, ds])[None, :]) * K + cols
+        return cp
+
+    def num_of_column(self,):
+        # columns of wave buffer are yg, F (forward of sections), y2tm, dummy, Bk (backward of sections),
+        # dummy, and if side tubes exist: 2 pad, sin (incoming side waves per junction), SF, SB
+        N= self.num_of_section
+        S= len(self.sides)
+        return 3*N + 7 + 2*S if S else 2*N + 4
+
+    def new_state(self,):
+        # zeroed waves and position in them
+        cp= self.compiled
+        K= self.num_of_column()
+        return {'W': np.zeros((cp['P'] + cp['R'], K), dtype=self.dtype), 't': np.array([cp['P']])}
+
+    def process_traced(self, yg, trace):
+        # waves of the vectorized kernel are not laid out as the delay lines of Class_TubeNetwork
+        raise ValueError('trace is not supported by Class_KL_AreaTube')
+
+    def process_loop(self, yg, y2tm, state):
+        # vectorized Kelly-Lochbaum kernel
+        # W[t, 1+i] is the forward wave that enters section i at step t, W[t, N+3+i] is the backward wave,
+        # side tubes follow, forward is from end 0 to end 1.
+        # With this column order, the read waves [F[j-1], Bk[j]] and the written waves [F[j], Bk[j-1]]
+        # of all junctions, glottis and lips included, are two (2, N+1) strided views of a row,
+        # so every junction is updated by one einsum.
+        # A wave written at step t is read at step t+d, so B = min delay steps are done at once.
+        cp= self.compiled
+        W= state['W']
+        H, K = W.shape
+        N= self.num_of_section
+        S= len(self.sides)
+        P= cp['P']
+        d= cp['d']
+        B= cp['B']
+        C= cp['C']
+        it= W.itemsize
+        Xv= as_strided(W, shape=(H, 3 if S else 2, N+1), strides=(K*it, (N+3)*it, it))  # read view
+        Wv= as_strided(W[:, 1:], shape=(H, 2, N+1), strides=(K*it, (N+1)*it, it)) # write view
+        flat= W.reshape(-1)
+        idx, rs, ws = self.loop_buffers((B, 2*S), 2*S, W.dtype)  # side waves read, and scattered back
+        t= int(state['t'][0])
+        for n in range(0, len(yg), B):
+            m= min(B, len(yg) - n)
+            if t + B > H:
+                W[:P]= W[t-P:t]
+                t= P
+            W[t-d:t-d+m, 0]= yg[n:n+m]  # input is read as F[-1] of this step
+            Z= Xv[t-d:t-d+m]
+            if S:
+                np.add(cp['soff'], t * K, out=idx)
+                np.take(flat, idx, out=rs, mode='clip')
+                np.matmul(rs[:m], cp['Ci'], out=Z[:, 2])
+                np.matmul(W[t-d:t-d+m, :3*N+7], cp['Co'], out=W[t:t+m, K-2*S:])
+                np.matmul(rs[:m], cp['Cr'], out=ws[:m])
+                W[t:t+m, K-2*S:] += ws[:m]
+            np.einsum('mkj,ikj->mij', Z, C, out=Wv[t:t+m])
+            y2tm[n:n+m]= W[t:t+m, N+1]
+            t += m
+        state['t'][0]= t
+        return y2tm
+
+
+
+
+if __name__ == '__main__':
+
+    # two tube /a/ of Rabiner and Schafer as an area function, with a closed side branch
+    areas= np.concatenate([np.full(45, 1.0), np.full(40, 7.0)])
+    tube= Class_KL_AreaTube(areas, length=17.0, sampling_rate=48000*4)
+    tube.add_branch(tube.junction_at(9.0), 5.6, 3.0)
+    print('sections', tube.num_of_section)
+    yout= tube.process(np.random.randn(4800) * 0.01)
+    print('output max', np.max(np.abs(yout)))
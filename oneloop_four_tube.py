@@ -6,16 +6,18 @@
 
 
 import numpy as np
-from matplotlib import pyplot as plt
+from tube_network import Class_TubeNetwork
 
 
 # Check version
 #  Python 3.10.4, 64bit on Win32 (Windows 10)
 #  numpy 1.21.6
+#  scipy 1.8.0
 
 
-class Class_1loop_FourTube(object):
-    def __init__(self, L1, L2, L3, L4, A1, A2, A3, A4, rg0=0.95, rl0=0.9 ,sampling_rate=48000):
+class Class_1loop_FourTube(Class_TubeNetwork):
+    def __init__(self, L1, L2, L3, L4, A1, A2, A3, A4, rg0=0.95, rl0=0.9 ,sampling_rate=48000, delay='integer', dtype=np.float64):
+        super().__init__(sampling_rate=sampling_rate, delay=delay, dtype=dtype)
         # initalize Tube length and Tube area
         self.L1= L1 # set list of 1st tube's length by unit is [cm]
         self.A1= A1 # set list of 1st tube's area by unit is [cm^2]
@@ -25,13 +27,27 @@ class Class_1loop_FourTube(object):
         self.A3= A3 # set list of 3rd tube's area by unit is [cm^2]
         self.L4= L4 # set list of 4th tube's length by unit is [cm]
         self.A4= A4 # set list of 4th tube's area by unit is [cm^2]
-        C0=35000.0  # speed of sound in air, round 35000 cm/second
         self.sr= sampling_rate
+        self.coefficients()
+        
+        self.rg0=rg0 # rg is reflection coefficient between glottis and 1st tube
+        self.rl0=rl0 # reflection coefficient between 4th tube and mouth
+        
+        self.att_norm=1.0 # attenuation constant per one step ahead  out of loop
+        self.att_loop=0.998 #1.0 # attenuation constant per one step ahead  in loop
+        self.wall_loss=0.0 # wall loss filter of every tube, 0 is no frequency dependent loss, up to 0.25
+        self.lip_radiation=0.0 # radiation filter at mouth, 0 is constant reflection rl0, up to 1
+        
+        self.num_of_tube=4
+        
+    def coefficients(self,):
+        # delay times and reflection coefficients from current tube lengths and areas,
+        # a tube changed after __init__ is taken in by build()
+        C0=35000.0  # speed of sound in air, round 35000 cm/second
         self.tu1=self.L1 / C0   # delay time in 1st tube
         self.tu2=self.L2 / C0   # delay time in 2nd tube
         self.tu3=self.L3 / C0   # delay time in 3rd tube
         self.tu4=self.L4 / C0   # delay time in 4th tube
-        
         # loop-in portion
         self.r12=((self.A3+self.A2) - self.A1)/(self.A3+self.A2+self.A1)  # reflection coefficient between 1st tube and others
         self.r21=(self.A2 - (self.A3+self.A1))/(self.A3+self.A2+self.A1)  # reflection coefficient between 2nd tube and others
@@ -40,24 +56,9 @@ class Class_1loop_FourTube(object):
         self.r23=((self.A4+self.A3) - self.A2)/(self.A4+self.A3+self.A2)  # reflection coefficient between 2nd tube and others
         self.r32=((self.A4+self.A2) - self.A3)/(self.A4+self.A3+self.A2)  # reflection coefficient between 3rd tube and others
         self.r42=(self.A4 - (self.A3+self.A2))/(self.A4+self.A3+self.A2)  # reflection coefficient between 4th tube and others
-        
-        
-        self.rg0=rg0 # rg is reflection coefficient between glottis and 1st tube
-        self.rl0=rl0 # reflection coefficient between 4th tube and mouth
-        
-        self.att_norm=1.0 # attenuation constant per one step ahead  out of loop
-        self.att_loop=0.998 #1.0 # attenuation constant per one step ahead  in loop
-        
-        self.num_of_tube=4
-        
-    def fone(self, xw):
-        pass
-        
-    def H0(self, freq_low=100, freq_high=5000, Band_num=256):
-        pass
-        
-    def process(self, yg ):
-        # process reflection transmission of resonance tube: yg is input, y2tm is output
+
+    def build(self,):
+        # set up the network of tubes from current model parameters
         # one-loop consists of tube2 and tube3
         #
         #
@@ -74,57 +75,21 @@ class Class_1loop_FourTube(object):
         #                               
         #
         #
-        M1= round( self.tu1 * self.sr ) + 1  # for precision, higher sampling_rate is better
-        M2= round( self.tu2 * self.sr ) + 1  # for precision, higher sampling_rate is better
-        M3= round( self.tu3 * self.sr ) + 1  # for precision, higher sampling_rate is better
-        M4= round( self.tu4 * self.sr ) + 1  # for precision, higher sampling_rate is better
-        M1= int(M1)
-        M2= int(M2)
-        M3= int(M3)
-        M4= int(M4)
-        ya1=np.zeros(M1)
-        ya2=np.zeros(M1)
-        yb1=np.zeros(M2)
-        yb2=np.zeros(M2)
-        yc1=np.zeros(M3)
-        yc2=np.zeros(M3)
-        yd1=np.zeros(M4)
-        yd2=np.zeros(M4)
-        y2tm=np.zeros(len(yg))
+        self.coefficients()
+        self.clear()
+        t1= self.add_tube(self.L1, self.A1, self.att_norm, self.wall_loss)
+        t2= self.add_tube(self.L2, self.A2, self.att_loop, self.wall_loss)
+        t3= self.add_tube(self.L3, self.A3, self.att_loop, self.wall_loss)
+        t4= self.add_tube(self.L4, self.A4, self.att_norm, self.wall_loss)
+        self.add_glottis((t1, 0), self.rg0)
+        self.add_junction([(t1, 1), (t2, 0), (t3, 0)])  # loop-in portion: r12, r21, r31
+        self.add_junction([(t2, 1), (t3, 1), (t4, 0)])  # loop-out portion: r23, r32, r42
+        self.add_lip((t4, 1), self.rl0, self.lip_radiation)
+        self.num_of_tube=4
         
-        for tc0 in range(len(yg)):
-            for i in range((M1-1),0,-1): # process one step
-                ya1[i]=ya1[i-1] * self.att_norm
-                ya2[i]=ya2[i-1] * self.att_norm
-            for i in range((M2-1),0,-1): # process one step
-                yb1[i]=yb1[i-1] * self.att_loop
-                yb2[i]=yb2[i-1] * self.att_loop
-            for i in range((M3-1),0,-1): # process one step
-                yc1[i]=yc1[i-1] * self.att_loop
-                yc2[i]=yc2[i-1] * self.att_loop
-            for i in range((M4-1),0,-1): # process one step
-                yd1[i]=yd1[i-1] * self.att_norm
-                yd2[i]=yd2[i-1] * self.att_norm
-            # calculate reflection
-            #  tube1 input
-            ya1[0]= ((1. + self.rg0 ) / 2.) * yg[tc0] + self.rg0 * ya2[-1]
-            ya2[0]= -1. * self.r12 * ya1[-1] + ( 1. - self.r12 ) * yb2[-1] + ( 1.  - self.r12) * yc2[-1]
-            #  tube2  loop 1/2
-            yb1[0]= ( 1 + self.r21 ) * ya1[-1] + self.r21 * yb2[-1] + ( 1. + self.r21) * yc2[-1]
-            yb2[0]=  -1. * self.r23  * yb1[-1] + ( 1. - self.r23 ) * yc1[-1] + ( 1.  - self.r23) * yd2[-1]
-            #  tube3  loop 2/2
-            yc1[0]= ( 1. + self.r31 ) * ya1[-1] + ( 1. + self.r31 ) * yb2[-1] + self.r31 * yc2[-1]
-            yc2[0]= ( 1. - self.r32 ) * yb1[-1] +  -1. * self.r32  * yc1[-1] + ( 1.  - self.r32) * yd2[-1]
-            #  tube 4 output
-            yd1[0]=  ( 1. + self.r42 ) * yb1[-1] + ( 1. + self.r42 ) * yc1[-1] + self.r42 * yd2[-1]
-            yd2[0]=  -1. * self.rl0  * yd1[-1]
-            y2tm[tc0]= (1 + self.rl0) * yd1[-1]
-            
-        return y2tm
-
-
     def check1(self,):
         # check if sum of output, ya1, yb2, and yc2 is 1
+        self.coefficients()
         a1= -1. * self.r12  +  ( 1 + self.r21 ) + ( 1. + self.r31 )
         b2= ( 1. - self.r12 )   +  self.r21 + ( 1. + self.r31 )
         c2= ( 1. - self.r12 )   +  ( 1. + self.r21)  +  self.r31 
@@ -0,0 +1,59 @@
+#coding:utf-8
+
+#
+# Tests of T three tube model, run by python -m pytest
+#
+
+
+import numpy as np
+from T_three_tube import Class_T_ThreeTube
+from tube_network import Class_TubeNetwork
+from tube_lti import frequency_response
+from test_tube_network import baseline_T
+
+
+# Check version
+#  Python 3.10.4, 64bit on Win32 (Windows 10)
+#  numpy 1.21.6
+
+
+def test_response_after_change_of_tube():
+    # closed form response takes in tube lengths and areas changed after __init__,
+    # and the shared cache does not keep a response of old coefficients under the new key
+    freqs= np.array([500., 1500., 2500., 3500.])
+    tube= Class_T_ThreeTube(9.0, 8.0, 5.6, 1.0, 7.0, 3.0)
+    tube.response(freqs)
+    tube.A3= 0.0
+    tube.L1= 12.0
+    amp= tube.response(freqs)
+    ref= Class_TubeNetwork.compute_response(tube, freqs, np.empty(freqs.shape))  # scattering solution
+    assert np.allclose(amp, ref, atol=1e-9)
+    fresh= Class_T_ThreeTube(12.0, 8.0, 5.6, 1.0, 7.0, 0.0)
+    assert np.allclose(fresh.response(freqs), ref, atol=1e-9)
+    fresh.cache= None
+    assert np.allclose(fresh.response(freqs), ref, atol=1e-9)
+
+
+def test_kernel_as_shift_register_loop():
+    # the vectorised kernel (one history buffer, attenuation att ** (M-1) at the read tap, min(D) steps
+    # at once) is same as the per sample shift register loop, over many moves of the history buffer,
+    # and at sampling rates where the delays round differently
+    yg= np.random.default_rng(2).standard_normal(6000)
+    for sr in (44100, 48000, 96000):
+        tube= Class_T_ThreeTube(9.0, 8.0, 5.6, 1.0, 7.0, 3.0, sampling_rate=sr)
+        for att in (0.995, 1.0):
+            tube.att_norm= att
+            ref= baseline_T(tube, yg)
+            assert np.max(np.abs(tube.process(yg) - ref)) < 1e-14 * np.max(np.abs(ref))
+
+
+def test_closed_form_with_attenuation():
+    # closed form response and fone() include att_norm of every pass through a tube, as the
+    # scattering solution of frequency_response()
+    freqs= np.linspace(100, 6000, 2000)
+    for att in (0.999, 0.99):
+        tube= Class_T_ThreeTube(9.0, 8.0, 5.6, 1.0, 7.0, 3.0)
+        tube.att_norm= att
+        ref= np.abs(frequency_response(*tube.scattering(), tube.sr, freqs * 2.0 * np.pi))
+        assert np.max(np.abs(tube.response(freqs) - 20 * np.log10(ref))) < 1e-9
+        assert np.allclose(tube.fone(freqs * 2.0 * np.pi), ref, rtol=1e-9)
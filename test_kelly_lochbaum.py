@@ -0,0 +1,56 @@
+#coding:utf-8
+
+#
+# Tests of Class_KL_AreaTube vectorized kernel, run by python -m pytest
+#
+
+
+import numpy as np
+from kelly_lochbaum import Class_KL_AreaTube
+from tube_network import Class_TubeNetwork, C0
+from test_tube_network import peaks_3db
+
+
+# Check version
+#  Python 3.10.4, 64bit on Win32 (Windows 10)
+#  numpy 1.21.6
+
+
+def test_einsum_kernel_as_network():
+    # the einsum kernel is same as the delay line kernel of Class_TubeNetwork on the built network,
+    # without side tubes, with a closed branch, and with a loop and a branch, with attenuation
+    x= np.random.default_rng(6).standard_normal(3000)
+    areas= np.concatenate([np.full(20, 1.0), np.full(16, 7.0)])
+    for branches, loops in (([], []), ([(9.0, 5.6, 3.0)], []), ([(12.0, 3.0, 2.0)], [(4.0, 10.0, 5.0, 1.0)])):
+        tube= Class_KL_AreaTube(areas, length=17.0, sampling_rate=96000)
+        for x0, L, A in branches:
+            tube.add_branch(tube.junction_at(x0), L, A)
+        for x0, x1, L, A in loops:
+            tube.add_loop(tube.junction_at(x0), tube.junction_at(x1), L, A)
+        tube.att_norm= 0.999
+        y= tube.process(x)
+        ref= np.zeros(len(x))
+        Class_TubeNetwork.process_loop(tube, x, ref, Class_TubeNetwork.new_state(tube))
+        assert np.max(np.abs(y - ref)) < 1e-12 * np.max(np.abs(ref))
+        tube.reset()
+        yb= np.concatenate([tube.process_block(x[n:n+300]) for n in range(0, len(x), 300)])
+        assert np.max(np.abs(yb - ref)) < 1e-12 * np.max(np.abs(ref))
+
+
+def test_uniform_tube_formants():
+    # a uniform tube closed at glottis and open at lips resonates at odd quarter-wave frequencies,
+    # with bandwidth -ln(rg0 rl0) C0 / (2 pi L) of every one that is the -3 dB width of response()
+    L= 17.0
+    for sections, resample in ((10, False), (4, True)):
+        tube= Class_KL_AreaTube(np.full(sections, 3.0), length=L, resample=resample)
+        freqs, bands = tube.formants(100, 6000)
+        k= np.arange(1, len(freqs) + 1)
+        assert len(freqs) == 6
+        assert np.allclose(freqs, (2 * k - 1) * C0 / (4.0 * L), rtol=1e-9)
+        assert np.allclose(bands, -1.0 * np.log(tube.rg0 * tube.rl0) * C0 / (2.0 * np.pi * L), rtol=1e-9)
+        for f0, band in zip(freqs, bands):
+            f= f0 + np.arange(-1.0, 1.0, 0.001) * band  # fine grid about the formant
+            peaks, widths = peaks_3db(f, tube.response(f))
+            assert len(peaks) == 1
+            assert abs(peaks[0] - f0) <= 0.001 * band
+            assert abs(widths[0] - band) < 0.01 * band
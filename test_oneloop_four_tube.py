@@ -0,0 +1,42 @@
+#coding:utf-8
+
+#
+# Tests of one loop four tube model, run by python -m pytest
+#
+
+
+import numpy as np
+from tube_network import C0
+from tube_analysis import measure_h1, h1_error
+from oneloop_four_tube import Class_1loop_FourTube
+
+
+# Check version
+#  Python 3.10.4, 64bit on Win32 (Windows 10)
+#  numpy 1.21.6
+#  scipy 1.8.0
+
+
+def test_fone_as_impulse_response():
+    # with lengths of whole samples, the integer delay model is exact, and fone() is the magnitude of
+    # the spectrum of the impulse response of process(), with attenuation in the tubes and the loop
+    c= C0 / 48000  # length of one sample [cm]
+    tube= Class_1loop_FourTube(6 * c, 14 * c, 15 * c, 2 * c, 1, 3, 3, 1)
+    tube.att_norm= 0.999
+    tube.att_loop= 0.998
+    n= 1 << 16
+    H= np.abs(np.fft.rfft(tube.impulse_response(length=n)))
+    f= np.fft.rfftfreq(n, 1 / tube.sr)
+    sel= (f >= 100) & (f <= 6000)
+    fone= tube.fone(2.0 * np.pi * f[sel])
+    assert np.max(np.abs(H[sel] - fone)) < 1e-9 * np.max(fone)
+    assert np.max(np.abs(20 * np.log10(H[sel]) - tube.response(f[sel]))) < 1e-9
+
+
+def test_fone_as_measured():
+    # response to white noise measured by Welch H1, with fractional delay, is near fone() of exact length
+    tube= Class_1loop_FourTube(4.0, 10, 11, 1.0, 1, 3, 3, 1, sampling_rate=48000, delay='lagrange')
+    error= h1_error(tube, *measure_h1(tube, length=0.5, nperseg=4096)[:2])
+    assert error['rms'] < 0.25 and error['max'] < 2.0
+    error= h1_error(tube, *measure_h1(tube, length=2, nperseg=16384)[:2])
+    assert error['rms'] < 0.1 and error['max'] < 1.0
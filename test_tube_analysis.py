@@ -0,0 +1,44 @@
+#coding:utf-8
+
+#
+# Tests of the analysis without plot, run by python -m pytest
+#
+
+
+import numpy as np
+from scipy import signal
+from tube_analysis import measure_h1, h1_error
+from T_three_tube import Class_T_ThreeTube
+
+
+# Check version
+#  Python 3.10.4, 64bit on Win32 (Windows 10)
+#  numpy 1.21.6
+#  scipy 1.8.0
+
+
+def test_measure_h1_as_csd():
+    # streamed Welch H1 is same as cross spectrum over auto spectrum of scipy on the whole rendered signal
+    tube= Class_T_ThreeTube(9.0, 8.0, 5.6, 1.0, 7.0, 3.0)
+    nperseg, hop = 4096, 2048
+    rng= np.random.default_rng(0)  # same noise as measure_h1(): warmup, then one hop at a time
+    x= np.concatenate([rng.standard_normal(nperseg) * 0.01]
+                      + [rng.standard_normal(hop) * 0.01 for n in range(hop, int(tube.sr * 0.5) + 1, hop)])
+    y= tube.process(x)
+    f, Pxy = signal.csd(x[nperseg:], y[nperseg:], fs=tube.sr, window='hann', nperseg=nperseg, noverlap=hop, detrend=False)
+    f, Pxx = signal.welch(x[nperseg:], fs=tube.sr, window='hann', nperseg=nperseg, noverlap=hop, detrend=False)
+    y_freq, yf, nseg = measure_h1(tube, length=0.5, nperseg=nperseg)
+    assert nseg == 10
+    assert np.allclose(y_freq, f)
+    assert np.max(np.abs(yf - 20 * np.log10(np.abs(Pxy / Pxx)))) < 1e-9
+
+
+def test_h1_error_against_fone():
+    # Welch H1 of 0.5 second is within a few tenths of dB of fone() with fractional delay, and longer
+    # segments, of less smoothing of the peaks by the window, are closer
+    for A3 in (3.0, 0.0):
+        tube= Class_T_ThreeTube(9.0, 8.0, 5.6, 1.0, 7.0, A3, sampling_rate=48000, delay='lagrange')
+        error= h1_error(tube, *measure_h1(tube, length=0.5, nperseg=4096)[:2])
+        assert error['rms'] < 0.35 and error['max'] < 3.0
+        error_long= h1_error(tube, *measure_h1(tube, length=2, nperseg=16384)[:2])
+        assert error_long['rms'] < 0.6 * error['rms'] and error_long['max'] < 2.0
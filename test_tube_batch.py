@@ -0,0 +1,52 @@
+#coding:utf-8
+
+#
+# Tests of Class_Tube_Batch, run by python -m pytest
+#
+
+
+import numpy as np
+from tube_batch import Class_Tube_Batch
+from oneloop_four_tube import Class_1loop_FourTube
+from T_three_tube import Class_T_ThreeTube
+
+
+# Check version
+#  Python 3.10.4, 64bit on Win32 (Windows 10)
+#  numpy 1.21.6
+
+
+def test_batch_as_serial():
+    # every configuration of a batch, models of different size together, is same as its own process(),
+    # for one input to all and for an input per configuration
+    rng= np.random.default_rng(9)
+    tubes= [Class_T_ThreeTube(9.0, 8.0, L3, 1.0, 7.0, 3.0) for L3 in (4.0, 5.6)]
+    tubes+= [Class_1loop_FourTube(4.0, 10, L3, 1.0, 1, 3, 3, 1) for L3 in (11, 12)]
+    tubes[1].att_norm= 0.999
+    batch= Class_Tube_Batch(tubes)
+    x= rng.standard_normal(3000)
+    y= batch.process(x)
+    xs= rng.standard_normal((len(tubes), 3000))
+    ys= batch.process(xs)
+    for i, tube in enumerate(tubes):
+        ref= tube.process(x)
+        assert np.max(np.abs(y[i] - ref)) < 1e-12 * np.max(np.abs(ref))
+        ref= tube.process(xs[i])
+        assert np.max(np.abs(ys[i] - ref)) < 1e-12 * np.max(np.abs(ref))
+
+
+def test_from_params_dtype():
+    # dtype of from_params() is given to the batch and its tubes, float32 is near float64
+    a_ratio= np.linspace(1.0, 2.0, 5)
+    params= dict(L1=4.0, L2=10, L3=12, L4=1.0, A1=1, A2=3, A3=3 * a_ratio, A4=1)
+    x= np.random.default_rng(10).standard_normal(3000)
+    batch= Class_Tube_Batch.from_params(Class_1loop_FourTube, dtype=np.float32, **params)
+    assert batch.dtype == np.float32
+    assert all(tube.dtype == np.float32 for tube in batch.tubes)
+    y= batch.process(x)
+    assert y.dtype == np.float32
+    ref= Class_Tube_Batch.from_params(Class_1loop_FourTube, **params).process(x)
+    assert ref.dtype == np.float64
+    assert np.max(np.abs(y - ref)) < 1e-4 * np.max(np.abs(ref))
+    for i, tube in enumerate(batch.tubes):
+        assert np.max(np.abs(y[i] - tube.process(x))) < 1e-4 * np.max(np.abs(ref[i]))
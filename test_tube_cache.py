@@ -0,0 +1,39 @@
+#coding:utf-8
+
+#
+# Tests of the LRU cache, run by python -m pytest
+#
+
+
+import tracemalloc
+import numpy as np
+from tube_cache import Class_LRU_Cache, grid_key
+from T_three_tube import Class_T_ThreeTube
+
+
+# Check version
+#  Python 3.10.4, 64bit on Win32 (Windows 10)
+#  numpy 1.21.6
+
+
+def test_max_bytes_against_measured_memory():
+    # many small responses under keys of model parameters, as a sweep puts them:
+    # memory really kept by the cache is within max_bytes
+    tube= Class_T_ThreeTube(9.0, 8.0, 5.6, 1.0, 7.0, 3.0)
+    freqs= np.linspace(100, 200, 5)
+    max_bytes= 1024 * 1024
+    tracemalloc.start()
+    try:
+        m0= tracemalloc.get_traced_memory()[0]
+        cache= Class_LRU_Cache(max_bytes)
+        for i in range(5000):
+            tube.L1= 9.0 + i * 1e-3
+            tube.build()
+            cache.put((tube.model_key(), 'response', True, grid_key(freqs)), np.zeros(freqs.shape))
+        used= tracemalloc.get_traced_memory()[0] - m0
+    finally:
+        tracemalloc.stop()
+    assert cache.nbytes <= max_bytes
+    assert len(cache.data) < 5000
+    assert used <= max_bytes
+    assert used >= 0.5 * cache.nbytes  # size is not far over-counted
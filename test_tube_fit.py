@@ -0,0 +1,51 @@
+#coding:utf-8
+
+#
+# Tests of Class_Tube_Fit, run by python -m pytest
+#
+
+
+import numpy as np
+from tube_fit import Class_Tube_Fit
+from oneloop_four_tube import Class_1loop_FourTube
+from T_three_tube import Class_T_ThreeTube
+
+
+# Check version
+#  Python 3.10.4, 64bit on Win32 (Windows 10)
+#  numpy 1.21.6
+#  scipy 1.8.0
+
+
+def test_gradient_as_finite_difference():
+    # analytic derivative of the poles by lengths and areas is same as central difference of tracked poles,
+    # without and with wall loss and radiation filter
+    for tube in (Class_T_ThreeTube(9.0, 8.0, 5.6, 1.0, 7.0, 3.0), Class_1loop_FourTube(4.0, 10, 11, 1.0, 1, 3, 3, 1)):
+        for wall_loss, lip_radiation in ((0.0, 0.0), (0.02, 0.5)):
+            tube.wall_loss= wall_loss
+            tube.lip_radiation= lip_radiation
+            fit= Class_Tube_Fit(tube, n_formant=4)
+            theta= fit.theta0[None]
+            desc= fit.scattering(theta)
+            poles= fit.detect(desc)
+            assert not np.any(np.isnan(poles))
+            grad= fit.gradient(desc, poles)[0]
+            fd= np.zeros_like(grad)
+            for p in range(len(fit.names)):
+                d= np.zeros_like(theta)
+                d[0, p]= 1e-6 * theta[0, p]
+                fd[:, p]= (fit.track(fit.scattering(theta + d), poles) - fit.track(fit.scattering(theta - d), poles))[0] / (2.0 * d[0, p])
+            assert np.max(np.abs(grad - fd)) < 1e-6 * np.max(np.abs(fd))
+
+
+def test_fit_recovers_lengths():
+    # formants of known tube lengths are fitted back to the lengths
+    tube= Class_T_ThreeTube(9.0, 8.0, 5.6, 1.0, 7.0, 3.0)
+    fit= Class_Tube_Fit(tube, names=['L1', 'L2', 'L3'], bounds={'L1': (5, 12), 'L2': (5, 12), 'L3': (2, 8)})
+    true= np.array([[8.0, 9.0, 4.5], [10.0, 7.0, 6.5], [9.0, 8.0, 5.6], [6.0, 11.0, 3.0]])
+    targets= fit.formants(true)[0]
+    result= fit.fit(targets, starts=32)
+    assert result['names'] == ['L1', 'L2', 'L3']
+    assert np.all(result['error'] < 1e-4)
+    assert np.all(np.abs(result['formants'] / targets - 1.0) < 1e-3)
+    assert np.all(np.abs(result['params'] / true - 1.0) < 1e-2)
@@ -0,0 +1,329 @@
+#coding:utf-8
+
+#
+# Tests of Class_TubeNetwork engines and response API, run by python -m pytest
+#
+
+
+import tracemalloc
+import numpy as np
+from scipy import interpolate
+from oneloop_four_tube import Class_1loop_FourTube
+from T_three_tube import Class_T_ThreeTube
+from kelly_lochbaum import Class_KL_AreaTube
+import tube_network
+
+
+# Check version
+#  Python 3.10.4, 64bit on Win32 (Windows 10)
+#  numpy 1.21.6
+
+
+def baseline_T(tube, yg):
+    # per sample shift register kernel of the first Class_T_ThreeTube, from its own L, A, rg0, rl0, rl3
+    C0=35000.0
+    A1, A2, A3 = tube.A1, tube.A2, tube.A3
+    r12=((A3+A2) - A1)/(A3+A2+A1)
+    r21=(A2 - (A3+A1))/(A3+A2+A1)
+    r31=(A3 - (A2+A1))/(A3+A2+A1)
+    M1, M2, M3 = [int(round(L / C0 * tube.sr)) + 1 for L in (tube.L1, tube.L2, tube.L3)]
+    ya1, ya2, yb1, yb2, yc1, yc2 = [np.zeros(M) for M in (M1, M1, M2, M2, M3, M3)]
+    y2tm=np.zeros(len(yg))
+    att= tube.att_norm
+    for tc0 in range(len(yg)):
+        for y in (ya1, ya2, yb1, yb2, yc1, yc2):
+            y[1:]= y[:-1] * att
+        ya1[0]= ((1. + tube.rg0 ) / 2.) * yg[tc0] + tube.rg0 * ya2[-1]
+        ya2[0]= -1. * r12 * ya1[-1] + ( 1. - r12 ) * yb2[-1] + ( 1.  - r12) * yc2[-1]
+        yb1[0]= ( 1 + r21 ) * ya1[-1] + r21 * yb2[-1] + ( 1. + r21) * yc2[-1]
+        yb2[0]=  -1. * tube.rl0  * yb1[-1]
+        y2tm[tc0]= (1 + tube.rl0) * yb1[-1]
+        yc1[0]= ( 1. + r31 ) * ya1[-1] + r31 * yc2[-1] + ( 1. + r31 ) * yb2[-1]
+        yc2[0]=  -1. * tube.rl3  * yc1[-1]
+    return y2tm
+
+
+def baseline_1loop(tube, yg):
+    # per sample shift register kernel of the first Class_1loop_FourTube
+    C0=35000.0
+    A1, A2, A3, A4 = tube.A1, tube.A2, tube.A3, tube.A4
+    r12=((A3+A2) - A1)/(A3+A2+A1)
+    r21=(A2 - (A3+A1))/(A3+A2+A1)
+    r31=(A3 - (A2+A1))/(A3+A2+A1)
+    r23=((A4+A3) - A2)/(A4+A3+A2)
+    r32=((A4+A2) - A3)/(A4+A3+A2)
+    r42=(A4 - (A3+A2))/(A4+A3+A2)
+    M1, M2, M3, M4 = [int(round(L / C0 * tube.sr)) + 1 for L in (tube.L1, tube.L2, tube.L3, tube.L4)]
+    ya1, ya2, yb1, yb2, yc1, yc2, yd1, yd2 = [np.zeros(M) for M in (M1, M1, M2, M2, M3, M3, M4, M4)]
+    y2tm=np.zeros(len(yg))
+    for tc0 in range(len(yg)):
+        for y, att in ((ya1, tube.att_norm), (ya2, tube.att_norm), (yb1, tube.att_loop), (yb2, tube.att_loop),
+                       (yc1, tube.att_loop), (yc2, tube.att_loop), (yd1, tube.att_norm), (yd2, tube.att_norm)):
+            y[1:]= y[:-1] * att
+        ya1[0]= ((1. + tube.rg0 ) / 2.) * yg[tc0] + tube.rg0 * ya2[-1]
+        ya2[0]= -1. * r12 * ya1[-1] + ( 1. - r12 ) * yb2[-1] + ( 1.  - r12) * yc2[-1]
+        yb1[0]= ( 1 + r21 ) * ya1[-1] + r21 * yb2[-1] + ( 1. + r21) * yc2[-1]
+        yb2[0]=  -1. * r23  * yb1[-1] + ( 1. - r23 ) * yc1[-1] + ( 1.  - r23) * yd2[-1]
+        yc1[0]= ( 1. + r31 ) * ya1[-1] + ( 1. + r31 ) * yb2[-1] + r31 * yc2[-1]
+        yc2[0]= ( 1. - r32 ) * yb1[-1] +  -1. * r32  * yc1[-1] + ( 1.  - r32) * yd2[-1]
+        yd1[0]=  ( 1. + r42 ) * yb1[-1] + ( 1. + r42 ) * yc1[-1] + r42 * yd2[-1]
+        yd2[0]=  -1. * tube.rl0  * yd1[-1]
+        y2tm[tc0]= (1 + tube.rl0) * yd1[-1]
+    return y2tm
+
+
+def peaks_3db(freqs, amp):
+    # peak frequencies of amp [dB] on a fine grid freqs, and their widths between the -3 dB points
+    m= np.flatnonzero((amp[1:-1] > amp[:-2]) & (amp[1:-1] > amp[2:])) + 1
+    widths= []
+    for i in m:
+        lo= i
+        while lo > 0 and amp[lo] > amp[i] - 3.0:
+            lo -= 1
+        hi= i
+        while hi < len(amp) - 1 and amp[hi] > amp[i] - 3.0:
+            hi += 1
+        widths.append(freqs[hi] - freqs[lo])
+    return freqs[m], np.array(widths)
+
+
+def test_response_adaptive_lossless_notch():
+    # one-loop with lossless loop has a notch at 1621 Hz, narrower than the coarse grid, and peaks
+    # narrower than 1 Hz that a dense grid misses
+    tube= Class_1loop_FourTube(4.0, 10, 12, 1.0, 1, 3, 4.5, 1)
+    tube.att_loop= 1.0
+    tube.cache= None
+    amp, freqs = tube.response_adaptive(100, 6000)
+    fref= np.linspace(100, 6000, 5900 * 20 + 1)
+    ref= tube.compute_response(fref, np.empty(fref.shape))
+    err= np.abs(interpolate.CubicSpline(freqs, amp)(fref) - ref)
+    dense= np.linspace(100, 6000, 5901)
+    err_dense= np.abs(np.interp(fref, dense, tube.compute_response(dense, np.empty(dense.shape))) - ref)
+    notch= (fref > 1600) & (fref < 1640)
+    assert np.min(ref[notch]) < -50.
+    assert np.max(err[notch]) < 0.01
+    assert np.max(err) < 0.01 * np.max(err_dense)
+    assert len(freqs) < len(dense) / 4
+
+
+def test_response_adaptive_targets():
+    # with the default tol, the spline of the adaptive grid is closer to the response than linear
+    # interpolation of a 1 Hz grid, by 10 times less points at least
+    fref= np.linspace(100, 6000, 5900 * 20 + 1)
+    dense= np.linspace(100, 6000, 5901)
+    tubes= [Class_T_ThreeTube(9.0, 8.0, 5.6, 1.0, 7.0, A3) for A3 in (3.0, 0.0)]
+    tubes.append(Class_1loop_FourTube(4.0, 10, 11, 1.0, 1, 3, 3, 1))
+    tubes.append(Class_T_ThreeTube(9.0, 8.0, 5.6, 1.0, 7.0, 3.0))
+    tubes[-1].wall_loss= 0.02
+    tubes[-1].lip_radiation= 0.5
+    for tube in tubes:
+        tube.cache= None
+        ref= tube.compute_response(fref, np.empty(fref.shape))
+        err_dense= np.abs(np.interp(fref, dense, tube.compute_response(dense, np.empty(dense.shape))) - ref)
+        amp, freqs = tube.response_adaptive(100, 6000)
+        err= np.abs(interpolate.CubicSpline(freqs, amp)(fref) - ref)
+        assert np.max(err) <= np.max(err_dense)
+        assert np.sqrt(np.mean(err ** 2)) <= np.sqrt(np.mean(err_dense ** 2))
+        assert len(freqs) * 10 <= len(dense)
+        assert np.max(np.abs(np.interp(fref, freqs, amp) - ref)) < 0.15  # as a plot
+
+
+def test_response_out_is_not_cached():
+    # response into a buffer of the caller, over many model parameters, does not fill the cache
+    from tube_cache import Class_LRU_Cache
+    tube= Class_1loop_FourTube(4.0, 10, 10, 1.0, 1, 3, 3, 1)
+    tube.cache= Class_LRU_Cache()
+    f= np.linspace(100, 5000, 491)
+    buf= np.empty(f.shape)
+    for i in range(20):
+        tube.L2= 10 + i * 0.01
+        assert tube.response(f, out=buf) is buf
+    assert len(tube.cache.data) == 0
+    assert np.allclose(buf, tube.compute_response(f, np.empty(f.shape)))
+    val= tube.response(f)
+    assert len(tube.cache.data) == 1
+    val[:]= 0.
+    assert np.allclose(tube.response(f), buf)
+
+
+def test_process_dynamic_constant_is_static():
+    # constant trajectory renders as the static model of lagrange delay, also at 192 kHz where a
+    # step runs over the end of a control frame
+    for sr in (48000, 192000):
+        tube= Class_T_ThreeTube(9.0, 8.0, 5.6, 1.0, 7.0, 3.0, sampling_rate=sr)
+        tube.delay= 'lagrange'
+        x= np.random.default_rng(0).standard_normal(sr // 4)
+        ys= tube.process(x)
+        yd= tube.process(x, trajectory={'L3': np.full(len(x), 5.6)})
+        assert np.max(np.abs(yd - ys)) < 1e-12 * np.max(np.abs(ys))
+
+
+def test_process_dynamic_many_waves(monkeypatch):
+    # a model of many waves is rendered with sparse update matrices of a few frames at a time: same
+    # output as the dense ones, and memory far less than the dense matrices of all frames
+    areas= np.interp(np.linspace(0, 1, 20), [0, 0.5, 1], [1.0, 7.0, 3.0])
+    tube= Class_KL_AreaTube(areas, length=17.0, sampling_rate=300000)
+    K= 2 * tube.num_of_section
+    assert K > tube_network.SPARSE_MIN_WAVES
+    x= np.random.default_rng(14).standard_normal(3000)
+    trajectory= {'rl0': np.linspace(0.9, 0.7, len(x)), 'rg0': [(0, 0.95), (0.01, 0.9)]}
+    tube.compile()
+    tracemalloc.start()
+    y= tube.process(x, trajectory=trajectory)
+    peak= tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    F= -(-len(x) // 64)
+    assert peak < 0.25 * F * (4 * K + 1) * (K + 1) * 8  # dense update matrices of 4 taps, all frames
+    monkeypatch.setattr(tube_network, 'SPARSE_MIN_WAVES', 10 ** 6)
+    yd= tube.process(x, trajectory=trajectory)
+    assert np.max(np.abs(y - yd)) < 1e-12 * np.max(np.abs(yd))
+
+
+def test_trajectory_tables_as_build():
+    # tables of the affine map of the parameters are same as the model built at each frame
+    tube= Class_1loop_FourTube(4.0, 10, 10, 1.0, 1, 3, 3, 1)
+    values= {'L2': np.linspace(10, 12, 50), 'A3': np.linspace(3, 0.5, 50), 'rl0': np.linspace(0.9, 0.8, 50)}
+    tubes, refl = tube.trajectory_tables(values, 50)
+    for f in (0, 17, 49):
+        tube.L2, tube.A3, tube.rl0 = values['L2'][f], values['A3'][f], values['rl0'][f]
+        tube.build()
+        assert np.allclose(tubes[f], np.array(tube.tubes, dtype=float), rtol=1e-12, atol=1e-12)
+        assert np.allclose(refl[f], [[r, p] for kind, ports, r, p in tube.junctions], rtol=1e-12, atol=1e-12)
+
+
+def test_presets_as_baseline_kernels():
+    # process() of the presets on the network kernel is same as the per sample kernels they replaced,
+    # with attenuation in the loop and parameters changed after construction (build() takes them in)
+    yg= np.random.default_rng(1).standard_normal(3000)
+    tube= Class_T_ThreeTube(9.0, 8.0, 5.6, 1.0, 7.0, 3.0, rg0=0.9, rl0=0.85)
+    tube.att_norm= 0.999
+    tube.L3= 6.3
+    tube.A3= 2.0
+    ref= baseline_T(tube, yg)
+    assert np.max(np.abs(tube.process(yg) - ref)) < 1e-14 * np.max(np.abs(ref))
+    tube= Class_1loop_FourTube(4.0, 10, 11, 1.0, 1, 3, 3, 1, sampling_rate=96000)
+    tube.att_loop= 0.998
+    tube.rl0= 0.8
+    tube.A4= 1.5
+    ref= baseline_1loop(tube, yg)
+    assert np.max(np.abs(tube.process(yg) - ref)) < 1e-14 * np.max(np.abs(ref))
+
+
+def test_lfilter_engine_impulse_response():
+    # impulse response of the equivalent IIR filter is same as the one of the stepping kernel,
+    # for integer and lagrange delay, with and without wall loss
+    x= np.zeros(4000)
+    x[0]= 1.0
+    for tube in (Class_T_ThreeTube(9.0, 8.0, 5.6, 1.0, 7.0, 3.0), Class_1loop_FourTube(4.0, 10, 11, 1.0, 1, 3, 3, 1)):
+        for delay in ('integer', 'lagrange'):
+            for wall in (0.0, 0.02):
+                tube.delay= delay
+                tube.wall_loss= wall
+                h= tube.process(x)
+                assert np.max(np.abs(tube.process(x, engine='lfilter') - h)) < 1e-11 * np.max(np.abs(h))
+
+
+def test_blocks_as_one_shot():
+    # a stream fed in blocks of any size is same as process() of the whole signal, and get_state()
+    # and set_state() restore the stream to render a block again
+    x= np.random.default_rng(3).standard_normal(6000)
+    for tube in (Class_T_ThreeTube(9.0, 8.0, 5.6, 1.0, 7.0, 3.0), Class_1loop_FourTube(4.0, 10, 11, 1.0, 1, 3, 3, 1)):
+        y= tube.process(x)
+        for block in (1, 7, 256, 1000, 5000):
+            tube.reset()
+            yb= np.concatenate([tube.process_block(x[n:n+block]) for n in range(0, len(x), block)])
+            assert np.max(np.abs(yb - y)) < 1e-14 * np.max(np.abs(y))
+        tube.reset()
+        tube.process_block(x[:2500])
+        state= tube.get_state()
+        y1= tube.process_block(x[2500:4000])
+        tube.process_block(x[4000:])
+        tube.set_state(state)
+        out= np.zeros(1500)
+        assert tube.process_block(x[2500:4000], out) is out
+        assert np.array_equal(out, y1)
+        assert np.max(np.abs(y1 - y[2500:4000])) < 1e-14 * np.max(np.abs(y))
+
+
+def test_process_block_allocates_nothing():
+    # after the first block, the loop engine reuses its read offsets and work buffers: the peak of
+    # traced memory is only numpy's small temporary objects, and does not grow with the number of blocks
+    x= np.random.default_rng(5).standard_normal(256 * 41)
+    out= np.zeros(256)
+    for tube in (Class_T_ThreeTube(9.0, 8.0, 5.6, 1.0, 7.0, 3.0, sampling_rate=192000, delay='lagrange'),
+                 Class_1loop_FourTube(4.0, 10, 11, 1.0, 1, 3, 3, 1)):
+        tube.reset()
+        tube.process_block(x[:256], out)
+        peaks= []
+        tracemalloc.start()
+        for nblock in (1, 40):
+            tracemalloc.reset_peak()
+            m0= tracemalloc.get_traced_memory()[0]
+            for n in range(1, nblock + 1):
+                tube.process_block(x[n*256:(n+1)*256], out)
+            peaks.append(tracemalloc.get_traced_memory()[1] - m0)
+        tracemalloc.stop()
+        assert peaks[1] < 8192
+        assert peaks[1] < peaks[0] + 1024
+
+
+def test_impulse_response_tol_and_render_fft():
+    # impulse_response() is cut where the energy of the rest is just under tol of the total,
+    # and render_fft() is same as process() within the amplitude of that rest, whatever block
+    x= np.random.default_rng(7).standard_normal(20000)
+    for tube in (Class_T_ThreeTube(9.0, 8.0, 5.6, 1.0, 7.0, 3.0), Class_1loop_FourTube(4.0, 10, 11, 1.0, 1, 3, 3, 1)):
+        y= tube.process(x)
+        for tol in (1e-6, 1e-9, 1e-12):
+            h= tube.impulse_response(tol=tol)
+            hl= tube.impulse_response(length=4 * len(h))
+            assert np.array_equal(hl[:len(h)], h)
+            total= np.dot(hl, hl)
+            assert np.dot(hl[len(h):], hl[len(h):]) <= tol * total
+            assert np.dot(hl[len(h)-1:], hl[len(h)-1:]) > tol * (1.0 - tol) * total
+            assert np.max(np.abs(tube.render_fft(x, tol=tol) - y)) < 4.0 * np.sqrt(tol) * np.max(np.abs(y))
+        for block in (64, 1000, 4096):
+            assert np.max(np.abs(tube.render_fft(x, block=block, tol=1e-14) - y)) < 1e-6 * np.max(np.abs(y))
+        assert np.array_equal(tube.process(x, engine='fft'), tube.render_fft(x))
+
+
+def test_wall_and_radiation_losses():
+    # with wall loss and lip radiation, process() is same as its IIR filter and its spectrum is same as
+    # response() of the exact length (lagrange delay), and the poles of formants() are at the peaks of
+    # response() with the -3 dB widths as bandwidths
+    x= np.random.default_rng(8).standard_normal(8000)
+    for tube in (Class_T_ThreeTube(9.0, 8.0, 5.6, 1.0, 7.0, 3.0, sampling_rate=192000, delay='lagrange'),
+                 Class_1loop_FourTube(4.0, 10, 11, 1.0, 1, 3, 3, 1, sampling_rate=192000, delay='lagrange')):
+        tube.wall_loss= 0.02
+        tube.lip_radiation= 0.5
+        y= tube.process(x)
+        assert np.max(np.abs(tube.process(x, engine='lfilter') - y)) < 1e-9 * np.max(np.abs(y))
+        n= 1 << 17
+        f= np.arange(n // 2 + 1) * tube.sr / n
+        sel= (f >= 100) & (f <= 5000)
+        H= 20 * np.log10(np.abs(np.fft.rfft(tube.impulse_response(length=n))))
+        assert np.max(np.abs(H[sel] - tube.response(f[sel]))) < 0.05
+    tube= Class_T_ThreeTube(9.0, 8.0, 5.6, 1.0, 7.0, 3.0)
+    f= np.arange(100, 5000, 0.1)
+    bands0= tube.formants(100, 5000)[1]
+    tube.wall_loss= 0.02
+    tube.lip_radiation= 0.5
+    freqs, bands = tube.formants(100, 5000)
+    peaks, widths = peaks_3db(f, tube.response(f))
+    assert len(peaks) == len(freqs)
+    assert np.all(np.abs(freqs - peaks) < 0.005 * peaks)
+    assert np.all(np.abs(bands - widths) < 0.05 * widths)
+    assert np.all(bands > bands0)
+
+
+def test_lfilter_engine_dtype():
+    # lfilter engine renders in dtype of the model, as the loop engine
+    x= np.random.default_rng(4).standard_normal(8000) * 0.1
+    for tube in (Class_T_ThreeTube(9.0, 8.0, 5.6, 1.0, 7.0, 3.0, dtype=np.float32),
+                 Class_1loop_FourTube(4.0, 10, 11, 1.0, 1, 3, 3, 1, dtype=np.float32)):
+        y= tube.process(x, engine='lfilter')
+        assert y.dtype == np.float32
+        assert tube.process(x).dtype == np.float32
+        tube.dtype= np.dtype(np.float64)
+        ref= tube.process(x, engine='lfilter')
+        assert ref.dtype == np.float64
+        assert np.max(np.abs(y - ref)) < 1e-5 * np.max(np.abs(ref))
@@ -0,0 +1,76 @@
+#coding:utf-8
+
+#
+# Tests of the local synthesis service, run by python -m pytest
+#
+
+
+import asyncio
+import pytest
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from tube_service import Class_Tube_Service, call, batch_key, encode_array, decode_array
+from T_three_tube import Class_T_ThreeTube
+
+
+# Check version
+#  Python 3.10.4, 64bit on Win32 (Windows 10)
+#  numpy 1.21.6
+#  scipy 1.8.0
+
+
+def test_batch_key():
+    # renders of integer delay without losses and of same length share a key, others do not
+    req= {'model': 'T', 'params': {}, 'input': [0.0] * 100}
+    key= batch_key('/render', req)
+    assert key == batch_key('/render', dict(req, params={'L1': 8.0}))
+    assert key[-2:] == ('batch', 100)
+    assert key != batch_key('/render', dict(req, input=[0.0] * 101))
+    assert key != batch_key('/render', dict(req, dtype='float32'))
+    assert batch_key('/render', dict(req, delay='lagrange'))[-1] == 'single'
+    assert batch_key('/render', dict(req, wall_loss=0.02))[-1] == 'single'
+    assert batch_key('/response', req) == ('/response', 'T', 48000, 'float64')
+
+
+@pytest.mark.parametrize('max_workers', [0, 1])
+def test_service_round_trip(max_workers):
+    # concurrent renders are coalesced into batches and return the output of process(), a bad request
+    # of a batch is an error of its own only, and responses are same as response()
+    rng= np.random.default_rng(11)
+    x= decode_array(encode_array(rng.standard_normal(2000) * 0.1))  # as float32 on the wire
+    x2= decode_array(encode_array(rng.standard_normal(1000) * 0.1))
+    params= [{'L1': 9.0, 'L2': 7.0 + 0.25 * i, 'L3': 5.6, 'A1': 1.0, 'A2': 7.0, 'A3': 3.0} for i in range(8)]
+    renders= [(p, x) for p in params] + [(p, x2) for p in params[:2]]  # a batch of each length
+    reqs= [{'model': 'T', 'params': p, 'input_b64': encode_array(xi)} for p, xi in renders]
+    reqs.append({'model': 'T', 'params': dict(params[0], L9=1.0), 'input_b64': encode_array(x2)})
+    responses= [{'model': 'T', 'params': p, 'freqs': [300.0, 700.0, 1500.0]} for p in params[:2]]
+    service= Class_Tube_Service(port=0, max_workers=max_workers, window=0.2)
+
+    async def run():
+        await service.start()
+        try:
+            loop= asyncio.get_running_loop()
+            with ThreadPoolExecutor(len(reqs) + len(responses)) as clients:
+                jobs= [loop.run_in_executor(clients, call, '/render', r, service.host, service.port) for r in reqs]
+                jobs+= [loop.run_in_executor(clients, call, '/response', r, service.host, service.port) for r in responses]
+                results= await asyncio.gather(*jobs, return_exceptions=True)
+                stats= await loop.run_in_executor(clients, call, '/stats', None, service.host, service.port)
+                unknown= await asyncio.gather(loop.run_in_executor(clients, call, '/render', {'model': 'X', 'input': [0.0]},
+                                                                   service.host, service.port), return_exceptions=True)
+        finally:
+            await service.close()
+        return results, stats, unknown[0]
+
+    results, stats, unknown = asyncio.run(run())
+    for (p, xi), result in zip(renders, results):
+        y= Class_T_ThreeTube(**p).process(xi)
+        assert result['samples'] == len(xi)
+        assert np.max(np.abs(result['output'] - y)) < 1e-6 * np.max(np.abs(y))
+    bad= results[len(renders)]
+    assert isinstance(bad, RuntimeError) and str(bad).startswith('400')
+    for p, result in zip(params, results[len(reqs):]):
+        assert np.allclose(result['amp'], Class_T_ThreeTube(**p).response(np.array([300.0, 700.0, 1500.0])), atol=1e-9)
+    assert stats['paths']['/render']['count'] == len(reqs)
+    assert stats['mean_batch'] >= 3.0  # 3 batches: renders of each length, and responses
+    assert stats['errors'] == 1
+    assert isinstance(unknown, RuntimeError) and 'unknown model' in str(unknown)
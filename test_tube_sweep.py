@@ -0,0 +1,30 @@
+#coding:utf-8
+
+#
+# Tests of parameter sweep cache, run by python -m pytest
+#
+
+
+import numpy as np
+from tube_sweep import Class_Tube_Sweep
+from T_three_tube import Class_T_ThreeTube
+
+
+# Check version
+#  Python 3.10.4, 64bit on Win32 (Windows 10)
+#  numpy 1.21.6
+
+
+def test_key_of_resolved_parameters(tmp_path, monkeypatch):
+    # a default given or left out is same point, a changed default of the class is a new point
+    sweep= Class_Tube_Sweep(Class_T_ThreeTube, cache_dir=str(tmp_path), L1=9.0, L2=8.0, L3=5.6, A1=1.0, A2=7.0)
+    key= sweep.key(sweep.params_of({'A3': 3.0}))
+    assert sweep.key(sweep.params_of({'A3': 3.0, 'rl0': 0.9, 'sampling_rate': 48000})) == key
+    sweep.run([{'A3': 3.0}], max_workers=0, progress=False)
+    defaults= list(Class_T_ThreeTube.__init__.__defaults__)
+    defaults[1]= 0.8  # rl0
+    monkeypatch.setattr(Class_T_ThreeTube.__init__, '__defaults__', tuple(defaults))
+    assert sweep.key(sweep.params_of({'A3': 3.0})) != key
+    assert sweep.load({'A3': 3.0}) is None
+    r= sweep.run([{'A3': 3.0}], max_workers=0, progress=False)[0]
+    assert np.allclose(r['amp'], Class_T_ThreeTube(9.0, 8.0, 5.6, 1.0, 7.0, 3.0, rl0=0.8).response(r['freqs']))
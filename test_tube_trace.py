@@ -0,0 +1,64 @@
+#coding:utf-8
+
+#
+# Tests of Class_Tube_Trace, run by python -m pytest
+#
+
+
+import pytest
+import numpy as np
+from tube_trace import Class_Tube_Trace
+from oneloop_four_tube import Class_1loop_FourTube
+from T_three_tube import Class_T_ThreeTube
+
+
+# Check version
+#  Python 3.10.4, 64bit on Win32 (Windows 10)
+#  numpy 1.21.6
+
+
+def test_traced_as_untraced():
+    # output of process() with trace is bit for bit the output without, whatever decimation, as rows
+    # of the log are at whole steps of the kernel,
+    # and a stable model has no alarm and no power lost at the junctions of tubes
+    x= np.random.default_rng(12).standard_normal(5000) * 0.05
+    for tube in (Class_T_ThreeTube(9.0, 8.0, 5.6, 1.0, 7.0, 3.0),
+                 Class_T_ThreeTube(9.0, 8.0, 5.6, 1.0, 7.0, 3.0, sampling_rate=96000, delay='lagrange'),
+                 Class_1loop_FourTube(4.0, 10, 11, 1.0, 1, 3, 3, 1)):
+        for wall_loss, lip_radiation in ((0.0, 0.0), (0.02, 0.5)):
+            tube.wall_loss= wall_loss
+            tube.lip_radiation= lip_radiation
+            y= tube.process(x)
+            for decimation in (1, 64, 1000):
+                trace= Class_Tube_Trace(decimation=decimation)
+                assert np.array_equal(tube.process(x, trace=trace), y)
+                B= tube.compiled['off'].shape[0]  # steps of the kernel at once
+                assert np.all(trace.step[:-1] % B == 0)
+                assert np.all(np.diff(trace.step[:-1]) >= decimation) and trace.step[0] >= min(decimation, len(x))
+                assert trace.step[-1] == len(x)
+                summary= trace.summary()
+                assert summary['alarm_step'] == -1
+                assert summary['max_junction_imbalance'] < 1e-9 * summary['max_peak_wave'] ** 2
+
+
+def test_divergence_alarm():
+    # gain in the tubes and no loss at the ends diverges: the alarm is recorded with the output untouched,
+    # stops the output, or raises
+    x= np.random.default_rng(13).standard_normal(48000) * 0.05
+    tube= Class_1loop_FourTube(4.0, 10, 11, 1.0, 1, 3, 3, 1, rg0=1.0, rl0=-1.0)
+    tube.att_loop= 1.0
+    tube.att_norm= 1.002
+    y= tube.process(x)
+    trace= Class_Tube_Trace(decimation=480)
+    assert np.array_equal(tube.process(x, trace=trace), y)
+    step= trace.alarm_step
+    assert 0 < step < len(x)
+    assert 'peak of waves' in trace.alarm_reason
+    assert trace.step[-1] == len(x)
+    assert trace.peak_wave[trace.step == step][0] > 1e3 * np.max(np.abs(x[:step]))
+    trace= Class_Tube_Trace(decimation=480, on_alarm='stop')
+    ys= tube.process(x, trace=trace)
+    assert trace.alarm_step == step and trace.step[-1] == step
+    assert np.array_equal(ys[:step], y[:step]) and not np.any(ys[step:])
+    with pytest.raises(FloatingPointError):
+        tube.process(x, trace=Class_Tube_Trace(decimation=480, on_alarm='raise'))
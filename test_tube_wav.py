@@ -0,0 +1,57 @@
+#coding:utf-8
+
+#
+# Tests of streaming WAV rendering, run by python -m pytest
+#
+
+
+import wave
+import pytest
+from scipy.io import wavfile
+from tube_wav import Class_Wav_Writer, render_wav
+from T_three_tube import Class_T_ThreeTube
+
+
+# Check version
+#  Python 3.10.4, 64bit on Win32 (Windows 10)
+#  numpy 1.21.6
+#  scipy 1.8.0
+
+
+def test_render_empty_input(tmp_path):
+    # an input of no samples, int16 and 24 bit PCM, is written as a valid WAV file of no samples,
+    # and its sampling rate is still checked
+    tube= Class_T_ThreeTube(9.0, 8.0, 5.6, 1.0, 7.0, 3.0)
+    in16= str(tmp_path / 'empty16.wav')
+    Class_Wav_Writer(in16, tube.sr).close()
+    in24= str(tmp_path / 'empty24.wav')
+    with wave.open(in24, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(3)
+        w.setframerate(tube.sr)
+    for in_path in (in16, in24):
+        for sample_format in ('int16', 'float32'):
+            out_path= str(tmp_path / ('out_' + sample_format + '.wav'))
+            info= render_wav(tube, in_path, out_path, sample_format=sample_format)
+            assert info == {'samples': 0, 'clipped': 0, 'peak': 0.}
+            sr, data = wavfile.read(out_path)
+            assert sr == tube.sr and len(data) == 0
+    tube= Class_T_ThreeTube(9.0, 8.0, 5.6, 1.0, 7.0, 3.0, sampling_rate=44100)
+    with pytest.raises(ValueError):
+        render_wav(tube, in16, str(tmp_path / 'out.wav'))
+
+
+def test_writer_size_limit(tmp_path):
+    # a chunk that makes the file over 4 GiB is refused before writing, and the file is still valid
+    path= str(tmp_path / 'limit.wav')
+    for sample_format, width in (('int16', 2), ('float32', 4)):
+        writer= Class_Wav_Writer(path, 48000, sample_format)
+        writer.write([0.5, -0.5])
+        writer.num_of_sample= (0xFFFFFFFF - 36) // width - 1  # as if written until the limit
+        writer.write([0.])
+        with pytest.raises(ValueError):
+            writer.write([0.])
+        writer.num_of_sample= 3
+        writer.close()
+        sr, data = wavfile.read(path)
+        assert sr == 48000 and len(data) == 3
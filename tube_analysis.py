@@ -0,0 +1,181 @@
+#coding:utf-8
+
+#
+# Analysis of tube models without plot
+#
+# Same comparison as Class_Tube_Check of tube_check_T.py and tube_check_1loop.py, computed
+# frequency response to white noise input frequency response using FFT analysis, but
+# results are returned as a dict per tube, and many tubes are analysed in one call.
+# matplotlib is imported only when plot() is called.
+# method='welch' measures the response by H1 estimation, output over input cross spectrum
+# averaged over overlapping segments, that are streamed out of the tube as rendered.
+#
+
+
+import os
+import sys
+import numpy as np
+from scipy import signal
+
+
+# Check version
+#  Python 3.10.4, 64bit on Win32 (Windows 10)
+#  numpy 1.21.6
+#  scipy 1.8.0
+
+
+def get_peaks(freq, amp1, min_high=0.4):
+    # index of peaks of amp1 [dB], higher than min_high of maximum
+    peaks, _ = signal.find_peaks(amp1, height= min_high * max(amp1), width= 1)
+    return peaks
+
+
+def fft_ana(yin, sampling_rate, N_sample=4096*4):
+    # spectrum [dB] of N_sample at center of yin with hanning window, and its frequency
+    N_sample_half= int(N_sample/2)
+    x=yin[ int(len(yin)/2 - N_sample_half) : int(len(yin)/2 + N_sample_half) ]
+    yf= np.log10(np.abs(np.fft.rfft( x *  signal.windows.hann(N_sample)))) * 20  # unit dB
+    y_freq= np.fft.rfftfreq(N_sample, 1 / sampling_rate)
+    return y_freq, yf
+
+
+def measure_h1(tube, length=1, nperseg=4096, sinpuku=0.01, seed=0, warmup=None):
+    # measured response [dB] of tube to white noise of length [second] by Welch H1 estimation:
+    #   H1 = sum of conj(X) Y / sum of |X|^2 over hanning windowed segments of 50% overlap
+    # Noise is made and rendered one hop at a time by process_block(), so memory is one segment
+    # whatever length is.  warmup [sample] is rendered before and not used, default nperseg.
+    # return frequency, H1 [dB] and number of segments
+    rng= np.random.default_rng(seed)
+    hop= nperseg // 2
+    w= signal.windows.hann(nperseg, sym=False)
+    tube.reset()
+    if warmup is None:
+        warmup= nperseg
+    tube.process_block(rng.standard_normal(warmup) * sinpuku)
+    xb= np.zeros(nperseg, dtype=tube.dtype)
+    yb= np.zeros(nperseg, dtype=tube.dtype)
+    Sxx= np.zeros(nperseg // 2 + 1)
+    Sxy= np.zeros(nperseg // 2 + 1, dtype=complex)
+    y= np.zeros(hop, dtype=tube.dtype)
+    nseg= 0
+    for n in range(hop, int(tube.sr * length) + 1, hop):
+        x= rng.standard_normal(hop, dtype=tube.dtype) * sinpuku
+        tube.process_block(x, out=y)
+        xb[:-hop]= xb[hop:]
+        xb[-hop:]= x
+        yb[:-hop]= yb[hop:]
+        yb[-hop:]= y
+        if n >= nperseg:
+            X= np.fft.rfft(w * xb)
+            Y= np.fft.rfft(w * yb)
+            Sxx += X.real ** 2 + X.imag ** 2
+            Sxy += np.conj(X) * Y
+            nseg += 1
+    return np.fft.rfftfreq(nperseg, 1 / tube.sr), np.log10(np.abs(Sxy / Sxx)) * 20, nseg
+
+
+def h1_error(tube, y_freq, yf, freq_low=100, freq_high=6000):
+    # accuracy check of measured response yf [dB] against fone of tube, in the band [dB]
+    sel= (y_freq >= freq_low) & (y_freq <= freq_high)
+    diff= yf[sel] - tube.response(y_freq[sel])
+    return {'rms': float(np.sqrt(np.mean(diff ** 2))), 'max': float(np.max(np.abs(diff)))}
+
+
+def error_metrics(freq, amp1, y_freq, yf):
+    # difference of measured spectrum yf to computed response amp1 in the band of freq [dB].
+    # Level of white noise is not known to the response, so the median difference is
+    # the offset, and rms and max are of the difference from the offset.
+    sel= (y_freq >= freq[0]) & (y_freq <= freq[-1])
+    diff= yf[sel] - np.interp(y_freq[sel], freq, amp1)
+    offset= np.median(diff)
+    return {'offset': float(offset), 'rms': float(np.sqrt(np.mean((diff - offset) ** 2))),
+            'max': float(np.max(np.abs(diff - offset)))}
+
+
+def analyze(tubes, freq_low=100, freq_high=6000, resolution=1, length=1, sinpuku=0.01, N_sample=4096*4,
+            seed=0, batch=False, method='fft'):
+    # analyse a tube or a list of tubes, return a dict or a list of dicts of
+    #   freq, amp1: computed response [dB],  peaks: index of its peaks,  formants, bandwidths [Hz],
+    #   y_freq, yf: spectrum [dB] of output to white noise,  error: error_metrics()
+    # white noise of length [second] and amplitude sinpuku is same for all tubes of same sampling rate.
+    # batch: render all tubes at once by Class_Tube_Batch, all tubes must be of integer delay, no wall
+    #        loss and radiation filter, and same sampling rate, else ValueError
+    # method='welch': yf is measure_h1() of segments of N_sample, and error is h1_error()
+    single= not isinstance(tubes, (list, tuple))
+    if single:
+        tubes= [tubes]
+    freq=np.linspace(freq_low, freq_high,int((freq_high - freq_low)/resolution + 1 ) )
+    if method == 'welch':
+        results=[]
+        for tube in tubes:
+            amp1= tube.response(freq)
+            formants, bandwidths = tube.formants(freq_low, freq_high)
+            y_freq, yf, nseg = measure_h1(tube, length, N_sample, sinpuku, seed)
+            results.append({'num_of_tube': tube.num_of_tube, 'sr': tube.sr, 'freq': freq, 'amp1': amp1,
+                            'peaks': get_peaks(freq, amp1), 'formants': formants, 'bandwidths': bandwidths,
+                            'y_freq': y_freq, 'yf': yf, 'error': h1_error(tube, y_freq, yf, freq_low, freq_high)})
+        return results[0] if single else results
+    noise= {}
+    for tube in tubes:
+        if tube.sr not in noise:
+            noise[tube.sr]= np.random.default_rng(seed).standard_normal(int(tube.sr * length), dtype=tube.dtype) * sinpuku
+    if batch:
+        from tube_batch import Class_Tube_Batch
+        youts= Class_Tube_Batch(tubes, dtype=tubes[0].dtype).process(noise[tubes[0].sr])
+    else:
+        youts= [tube.process(noise[tube.sr]) for tube in tubes]
+    results=[]
+    for tube, yout in zip(tubes, youts):
+        amp1= tube.response(freq)
+        formants, bandwidths = tube.formants(freq_low, freq_high)
+        y_freq, yf = fft_ana(yout, tube.sr, N_sample)
+        results.append({'num_of_tube': tube.num_of_tube, 'sr': tube.sr, 'freq': freq, 'amp1': amp1,
+                        'peaks': get_peaks(freq, amp1), 'formants': formants, 'bandwidths': bandwidths,
+                        'y_freq': y_freq, 'yf': yf, 'error': error_metrics(freq, amp1, y_freq, yf)})
+    return results[0] if single else results
+
+
+def plot(results, path=None):
+    # draw results of analyze(), same figure as Class_Tube_Check
+    # show windows, or save to path, figure number is added to path when more than one
+    from matplotlib import pyplot as plt
+    if isinstance(results, dict):
+        results= [results]
+    for i, r in enumerate(results):
+        fig = plt.figure()
+        plt.plot(r['freq'], r['amp1'],'r')
+        plt.plot(r['freq'][r['peaks']], r['amp1'][r['peaks']], "x")
+        sel= (r['y_freq'] > r['freq'][0]) & (r['y_freq'] < r['freq'][-1])
+        plt.plot(r['y_freq'][sel], r['yf'][sel],'b')
+        plt.title('frequency response ' + str(r['num_of_tube']) + ' : red computed vs blue white noise input')
+        plt.xlabel('Hz')
+        plt.ylabel('dB')
+        plt.grid(which='both', axis='both')
+        fig.tight_layout()
+        if path is not None:
+            root, ext = os.path.splitext(path)
+            fig.savefig(path if len(results) == 1 else root + '_' + str(i) + ext)
+            plt.close(fig)
+    if path is None:
+        plt.show()
+
+
+
+
+if __name__ == '__main__':
+
+    # T three tube model /a/ with /o/ branch and simple two tube (A3=0), analysed in one call
+    # plot only when --plot is given
+    from T_three_tube import Class_T_ThreeTube
+    tubes= [Class_T_ThreeTube(9.0, 8.0, 5.6, 1.0, 7.0, A3, sampling_rate=48000*4) for A3 in [3.0, 0.0]]
+    results= analyze(tubes)
+    for r in results:
+        print('peaks', r['freq'][r['peaks']])
+        print('formants', np.round(r['formants'], 1))
+        print('error [dB]', {k: round(v, 2) for k, v in r['error'].items()})
+    # Welch H1 of 0.5 second against fone, at 48KHz with fractional delay
+    tubes= [Class_T_ThreeTube(9.0, 8.0, 5.6, 1.0, 7.0, A3, sampling_rate=48000, delay='lagrange') for A3 in [3.0, 0.0]]
+    for r in analyze(tubes, length=0.5, N_sample=4096, method='welch'):
+        print('welch error [dB]', {k: round(v, 2) for k, v in r['error'].items()})
+    if '--plot' in sys.argv:
+        plot(results)
@@ -0,0 +1,125 @@
+#coding:utf-8
+
+#
+# Batch rendering of many tube configurations at once
+#
+# All configurations are advanced together, one set of vector operations per time step
+# over the batch axis.  Each configuration is given by the scattering form of its tube
+# model (see scattering() of Class_T_ThreeTube or Class_1loop_FourTube), the delay lines
+# of every configuration and wave share one circular buffer padded to the longest delay.
+# The delays are rounded to integer samples, so only tubes of delay='integer' are accepted.
+#
+
+
+import numpy as np
+from tube_lti import sample_delays
+
+
+# Check version
+#  Python 3.10.4, 64bit on Win32 (Windows 10)
+#  numpy 1.21.6
+
+
+class Class_Tube_Batch(object):
+    def __init__(self, tubes, dtype=np.float64):
+        # tubes is a list of tube model instances, sampling rate must be same
+        # dtype: float type of delay lines and output, np.float32 halves memory
+        self.tubes= list(tubes)
+        self.dtype= np.dtype(dtype)
+        self.sr= self.tubes[0].sr
+        if any(tube.sr != self.sr for tube in self.tubes):
+            raise ValueError('all tubes must have same sampling_rate')
+
+        self.num_of_batch= len(self.tubes)
+        if any(x is not None for tube in self.tubes for x in tube.losses()):
+            raise ValueError('tubes with wall loss or radiation filter are not supported')
+        if any(tube.delay != 'integer' for tube in self.tubes):
+            raise ValueError('tubes with delay other than integer are not supported')
+        descs= [tube.scattering() for tube in self.tubes]
+        K= max(len(d[1]) for d in descs)  # number of waves, padded to the largest model
+        B= self.num_of_batch
+        self.S= np.zeros((B, K, K))
+        self.e= np.zeros((B, K))
+        self.c= np.zeros((B, K))
+        self.D= np.ones((B, K), dtype=int)  # padded waves have 1 sample delay and no connection
+        self.g= np.zeros((B, K))
+        for i, (S, e, c, tau, att) in enumerate(descs):
+            k= len(e)
+            D= sample_delays(tau, self.sr)
+            self.S[i, :k, :k]= S
+            self.e[i, :k]= e
+            self.c[i, :k]= c
+            self.D[i, :k]= D
+            self.g[i, :k]= att ** D  # attenuation applied at the read tap
+        self.S= self.S.astype(self.dtype)
+        self.e= self.e.astype(self.dtype)
+        self.c= self.c.astype(self.dtype)
+        self.g= self.g.astype(self.dtype)
+        self.P= int(self.D.max())  # length of circular buffer
+
+    @classmethod
+    def from_params(cls, tube_class, dtype=np.float64, **params):
+        # make a batch from arrays of parameters, broadcast each other
+        #   e.g. from_params(Class_1loop_FourTube, L1=4.0, L2=10, L3=np.linspace(10,12,100), ...)
+        # dtype is given to the batch and to every tube
+        keys= list(params.keys())
+        values= np.broadcast_arrays(*[np.asarray(params[k]) for k in keys])
+        tubes= []
+        for i in range(values[0].size):
+            kw= {k: v.flat[i].item() for k, v in zip(keys, values)}
+            tubes.append(tube_class(dtype=dtype, **kw))
+        return cls(tubes, dtype=dtype)
+
+    def process(self, yg, out=None):
+        # process all configurations: yg is input, one signal for all or 2-D array (batch, time)
+        # return y2tm as 2-D array (batch, time)
+        B, K = self.e.shape
+        P= self.P
+        yg= np.asarray(yg, dtype=self.dtype)
+        N= yg.shape[-1]
+        if yg.ndim == 1:
+            yg= np.broadcast_to(yg, (B, N))
+        if out is None:
+            out= np.zeros((B, N), dtype=self.dtype)
+        yt= np.ascontiguousarray(yg.T)  # (time, batch)
+
+        buf= np.zeros(P * B * K, dtype=self.dtype)  # circular buffer (P, B, K), flattened
+        base= np.arange(B * K).reshape(B, K)
+        idx= np.zeros((B, K), dtype=int)
+        r= np.zeros((B, K), dtype=self.dtype)
+        w= np.zeros((B, K, 1), dtype=self.dtype)
+        for tc0 in range(N):
+            # read index of each wave: written D steps ago
+            np.subtract(tc0, self.D, out=idx)
+            np.mod(idx, P, out=idx)
+            idx *= B * K
+            idx += base
+            np.take(buf, idx, out=r)
+            r *= self.g
+            # scattering at all junctions of all configurations
+            np.matmul(self.S, r[:, :, None], out=w)
+            out[:, tc0]= np.einsum('bk,bk->b', self.c, r)
+            w[:, :, 0] += self.e * yt[tc0][:, None]
+            j= (tc0 % P) * B * K
+            buf[j: j + B * K]= w.reshape(-1)
+        return out
+
+
+
+
+if __name__ == '__main__':
+
+    # a_ratio sweep of 1loop four tube model example
+    from oneloop_four_tube import Class_1loop_FourTube
+    L1=4.0
+    L4=1.0
+    L2=10
+    A1=1
+    A2=3
+    A4= A1
+    a_ratio=np.linspace(1.0, 2.0, 11)
+    l_ratio=1.2
+    batch= Class_Tube_Batch.from_params(Class_1loop_FourTube, L1=L1, L2=L2, L3=L2*l_ratio, L4=L4,
+                                        A1=A1, A2=A2, A3=A2*a_ratio, A4=A4, sampling_rate=48000)
+    yout= batch.process(np.random.randn(4800) * 0.01)
+    print('output shape', yout.shape)
@@ -0,0 +1,145 @@
+#coding:utf-8
+
+#
+# Benchmark of the tube engines
+#
+# Times process() of T three tube and one-loop four tube models, frequency response
+# fone/H0 and batch rendering, across tube lengths, sampling rates, signal lengths and
+# batch sizes.  Reports samples per second, real time factor and peak memory, saves them
+# as JSON, and compares with a baseline JSON: a case slower than threshold times the
+# baseline is a regression, and exit code is 1.
+#
+#   python tube_benchmark.py --output bench.json
+#   python tube_benchmark.py --baseline bench.json --threshold 1.2
+#
+
+
+import sys
+import json
+import time
+import platform
+import argparse
+import tracemalloc
+import numpy as np
+import scipy
+
+from T_three_tube import Class_T_ThreeTube
+from oneloop_four_tube import Class_1loop_FourTube
+from tube_batch import Class_Tube_Batch
+
+
+# Check version
+#  Python 3.10.4, 64bit on Win32 (Windows 10)
+#  numpy 1.21.6
+#  scipy 1.8.0
+
+
+def make_tube(model, scale=1.0, sampling_rate=48000, dtype=np.float64):
+    # /a/ with /o/ side branch of the examples, all tube lengths are multiplied by scale
+    if model == 'T':
+        tube= Class_T_ThreeTube(9.0 * scale, 8.0 * scale, 5.6 * scale, 1.0, 7.0, 3.0, sampling_rate=sampling_rate,
+                                dtype=dtype)
+    else:
+        tube= Class_1loop_FourTube(4.0 * scale, 10.0 * scale, 12.0 * scale, 1.0 * scale, 1.0, 3.0, 6.0, 1.0,
+                                   sampling_rate=sampling_rate, dtype=dtype)
+    tube.cache= None  # measure computing, not cache
+    return tube
+
+
+def measure(func, repeat=3):
+    # best time of repeat runs [second], and peak memory of one more run under tracemalloc [byte]
+    func()  # warm up
+    times=[]
+    for i in range(repeat):
+        t0= time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    func()
+    peak= tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(times), peak
+
+
+def get_cases(quick=False):
+    # list of (name, function, number of samples, sampling rate), sampling rate None if not audio
+    cases=[]
+    lengths= [0.1] if quick else [0.1, 1.0]
+    for model in ['T', '1loop']:
+        for sr in [48000, 96000, 192000]:
+            for scale in [0.5, 1.0]:
+                for length in lengths:
+                    tube= make_tube(model, scale, sr)
+                    x= np.random.randn(int(sr * length)) * 0.01
+                    name= 'process/%s/sr%d/scale%.1f/%.1fs' % (model, sr, scale, length)
+                    cases.append((name, lambda tube=tube, x=x: tube.process(x), len(x), sr))
+        # same as the case of longest signal at 48KHz, by float32
+        tube= make_tube(model, 1.0, 48000, np.float32)
+        x= np.random.randn(int(48000 * lengths[-1])).astype(np.float32) * 0.01
+        name= 'process/%s/sr48000/scale1.0/%.1fs/float32' % (model, lengths[-1])
+        cases.append((name, lambda tube=tube, x=x: tube.process(x), len(x), 48000))
+        tube= make_tube(model)
+        xw= np.linspace(100, 6000, 5901) * 2.0 * np.pi
+        cases.append(('fone/%s/5901' % model, lambda tube=tube, xw=xw: tube.fone(xw), len(xw), None))
+        cases.append(('H0/%s/256' % model, lambda tube=tube: tube.H0(), 257, None))
+    for n in ([1, 16] if quick else [1, 16, 64]):
+        batch= Class_Tube_Batch([make_tube('1loop', 1.0 + 0.01 * i) for i in range(n)])
+        x= np.random.randn(4800) * 0.01
+        cases.append(('batch/1loop/%d/0.1s' % n, lambda batch=batch, x=x: batch.process(x), len(x) * n, 48000))
+    batch= Class_Tube_Batch(batch.tubes, dtype=np.float32)
+    cases.append(('batch/1loop/%d/0.1s/float32' % n, lambda batch=batch, x=x: batch.process(x), len(x) * n, 48000))
+    return cases
+
+
+def run(quick=False, repeat=3, select=None):
+    # run all cases, select is a part of the case name to run only them
+    results={}
+    for name, func, samples, sr in get_cases(quick):
+        if select is not None and select not in name:
+            continue
+        sec, peak = measure(func, repeat)
+        results[name]= {'seconds': sec, 'samples_per_second': samples / sec,
+                        'realtime_factor': (samples / sr) / sec if sr else None, 'peak_bytes': peak}
+        print('%-44s %10.4f sec %12.0f samples/sec %8s x realtime %8.1f KB peak' %
+              (name, sec, samples / sec, '%.1f' % results[name]['realtime_factor'] if sr else '-', peak / 1024))
+    return {'platform': platform.platform(), 'python': platform.python_version(),
+            'numpy': np.__version__, 'scipy': scipy.__version__, 'cases': results}
+
+
+def compare(report, baseline, threshold=1.2):
+    # list of cases slower than threshold times the baseline
+    slow=[]
+    for name, r in report['cases'].items():
+        b= baseline['cases'].get(name)
+        if b is None:
+            continue
+        ratio= r['seconds'] / b['seconds']
+        print('%-44s %6.2f x baseline %s' % (name, ratio, 'SLOW' if ratio > threshold else ''))
+        if ratio > threshold:
+            slow.append(name)
+    return slow
+
+
+
+
+if __name__ == '__main__':
+
+    parser= argparse.ArgumentParser(description='benchmark of the tube engines')
+    parser.add_argument('--output', default=None, help='save results as JSON')
+    parser.add_argument('--baseline', default=None, help='compare with results JSON of before')
+    parser.add_argument('--threshold', type=float, default=1.2, help='slowdown ratio to baseline that is a regression')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--quick', action='store_true', help='short signals and less batch sizes')
+    parser.add_argument('--select', default=None, help='run only cases of which name includes this')
+    args= parser.parse_args()
+
+    report= run(args.quick, args.repeat, args.select)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            slow= compare(report, json.load(f), args.threshold)
+        if slow:
+            print('regression', len(slow), 'cases')
+            sys.exit(1)
@@ -0,0 +1,116 @@
+#coding:utf-8
+
+#
+# LRU cache of tube model results, bounded by size in bytes
+#
+# Tube models look up their compiled coefficients and frequency responses here by a key of
+# their quantized parameters, so a model made again with same parameters, as in a slider
+# driven tool, gets them without computing.  shared_cache is the one used by default.
+#
+
+
+import sys
+import hashlib
+from collections import OrderedDict
+import numpy as np
+
+
+# Check version
+#  Python 3.10.4, 64bit on Win32 (Windows 10)
+#  numpy 1.21.6
+
+
+ENTRY_BYTES= 128  # bookkeeping of one entry: node of OrderedDict, (value, size) tuple and size
+
+
+def sizeof(value):
+    # approximate size in bytes of numpy arrays, sparse matrices, keys and containers of them,
+    # object headers included.  Shared objects, as interned strings, are counted every time.
+    if isinstance(value, np.ndarray):
+        return sys.getsizeof(value) + (value.nbytes if value.base is not None else 0)  # a view does not count its data
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sizeof(k) + sizeof(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(sizeof(v) for v in value)
+    if hasattr(value, 'indptr'):  # scipy sparse matrix
+        return sys.getsizeof(value) + value.data.nbytes + value.indices.nbytes + value.indptr.nbytes
+    return sys.getsizeof(value)
+
+
+_grids=[]  # recent arrays of grid_key() and their digest
+
+
+def grid_key(x):
+    # digest of an array as a frequency grid, an array equal to a recent one is not hashed again
+    for g, d in _grids:
+        if g.shape == x.shape and np.array_equal(g, x):
+            return d
+    d= hashlib.sha1(np.ascontiguousarray(x).tobytes()).hexdigest() + str(x.shape)
+    _grids.insert(0, (x.copy(), d))
+    del _grids[8:]
+    return d
+
+
+class Class_LRU_Cache(object):
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        # max_bytes: total size of entries kept (keys and values), least recently used ones are removed above it
+        self.max_bytes= max_bytes
+        self.data= OrderedDict()  # key: (value, size)
+        self.nbytes= 0
+        self.hits= 0
+        self.misses= 0
+
+    def get(self, key):
+        # value of key, None if not in cache
+        item= self.data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        self.data.move_to_end(key)
+        self.hits += 1
+        return item[0]
+
+    def put(self, key, value):
+        # keep value of key, a value larger than max_bytes is not kept
+        # size of an entry is its key, its value and ENTRY_BYTES
+        size= sizeof(key) + sizeof(value) + ENTRY_BYTES
+        if key in self.data:
+            self.nbytes -= self.data.pop(key)[1]
+        if size > self.max_bytes:
+            return
+        self.data[key]= (value, size)
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            self.nbytes -= self.data.popitem(last=False)[1][1]
+
+    def clear(self,):
+        # remove all values and reset counters
+        self.data.clear()
+        self.nbytes= 0
+        self.hits= 0
+        self.misses= 0
+
+    def stats(self,):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.data), 'bytes': self.nbytes,
+                'max_bytes': self.max_bytes}
+
+
+shared_cache= Class_LRU_Cache()
+
+
+
+
+if __name__ == '__main__':
+
+    # same parameters again, as a slider that comes back
+    import time
+    from T_three_tube import Class_T_ThreeTube
+    freqs= np.linspace(100, 6000, 5901)
+    for n in range(3):
+        for A3 in [1.0, 2.0, 3.0]:
+            t0= time.perf_counter()
+            tube= Class_T_ThreeTube(9.0, 8.0, 5.6, 1.0, 7.0, A3)
+            amp= tube.response(freqs)
+            t1= time.perf_counter()
+            print('A3', A3, 'time [usec]', round((t1 - t0) * 1e6, 1))
+    print(tube.cache.stats())
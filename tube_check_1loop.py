@@ -1,7 +1,7 @@
 #coding:utf-8
 
 # Tube model check:
-# draw white noise input frequency response using FFT analysis.
+# Comparison computed frequency response to white noise input frequency response using FFT analysis.
 #
 
 import os
@@ -18,9 +18,10 @@ from scipy.io.wavfile import write as wavwrite
 
 
 class Class_Tube_Check(object):
-    def __init__(self, tube):
-        #
+    def __init__(self, tube, adaptive=False):
+        # adaptive: computed response on the non-uniform grid of response_adaptive() instead of resolution
         self.tube= tube
+        self.adaptive= adaptive
         self.sr= tube.sr
         #
         self.freq_low=100
@@ -28,9 +29,8 @@ class Class_Tube_Check(object):
         self.resolution=1
         self.f_list=np.linspace(self.freq_low, self.freq_high,int((self.freq_high - self.freq_low)/self.resolution + 1 ) )
         #
-        if 0:
-            self.H1_linear()
-            self.get_peaks()
+        self.H1_linear()
+        self.get_peaks()
         #
         self.make_white_noise(sinpuku=0.01, length=1)
         self.yout=self.tube.process(self.xin)
@@ -42,8 +42,12 @@ class Class_Tube_Check(object):
             self.save_wav(self.yout,'test_'+ str(self.tube.num_of_tube) +'tubu_yout.wav')
         
     def H1_linear(self,):
-        self.f_amp=self.tube.fone(self.f_list * 2.0 * np.pi)
-        self.amp1=np.log10(self.f_amp) * 20
+        if self.adaptive:
+            self.amp1, self.f_list = self.tube.response_adaptive(self.freq_low, self.freq_high)
+            self.f_amp=np.power(10.0, self.amp1 / 20)
+        else:
+            self.f_amp=self.tube.fone(self.f_list * 2.0 * np.pi)
+            self.amp1=np.log10(self.f_amp) * 20
         self.freq=self.f_list
         
     def get_peaks(self,):
@@ -52,19 +56,23 @@ class Class_Tube_Check(object):
         MIN_WIDTH= 1 # 最小の周辺幅
         self.peaks, _ = signal.find_peaks(self.amp1, height= MIN_HIGH * max(self.amp1),width= MIN_WIDTH) #, distance= MIN_DIS * n , width= MIN_WIDTH * n)
         print('peaks', self.freq[self.peaks])
+        # resonance frequencies and bandwidths from poles, sub-Hz accurate
+        formants, bands = self.tube.formants(self.freq_low, self.freq_high)
+        print('formants', np.round(formants, 1))
+        print('bandwidths', np.round(bands, 1))
  
     def draw(self,):
         # draw
         fig = plt.figure()
         
-        #plt.plot(self.freq, self.amp1,'r')
-        #plt.plot(self.freq[self.peaks], self.amp1[self.peaks], "x")
+        plt.plot(self.freq, self.amp1,'r')
+        plt.plot(self.freq[self.peaks], self.amp1[self.peaks], "x")
         
         if 1:
             id0=np.where( self.y_freq > self.f_list[0])[0][0]
             id1=np.where( self.y_freq > self.f_list[-1])[0][0]
             plt.plot(self.y_freq[id0:id1], self.yf[id0:id1],'b')
-            plt.title('frequency response ' + str(self.tube.num_of_tube) + ' : blue white noise input')
+            plt.title('frequency response ' + str(self.tube.num_of_tube) + ' : red computed vs blue white noise input')
         else:
             plt.title('frequency response')
         
@@ -18,9 +18,10 @@ from scipy.io.wavfile import write as wavwrite
 
 
 class Class_Tube_Check(object):
-    def __init__(self, tube):
-        #
+    def __init__(self, tube, adaptive=False):
+        # adaptive: computed response on the non-uniform grid of response_adaptive() instead of resolution
         self.tube= tube
+        self.adaptive= adaptive
         self.sr= tube.sr
         #
         self.freq_low=100
@@ -41,8 +42,12 @@ class Class_Tube_Check(object):
             self.save_wav(self.yout,'test_'+ str(self.tube.num_of_tube) +'tubu_yout.wav')
         
     def H1_linear(self,):
-        self.f_amp=self.tube.fone(self.f_list * 2.0 * np.pi)
-        self.amp1=np.log10(self.f_amp) * 20
+        if self.adaptive:
+            self.amp1, self.f_list = self.tube.response_adaptive(self.freq_low, self.freq_high)
+            self.f_amp=np.power(10.0, self.amp1 / 20)
+        else:
+            self.f_amp=self.tube.fone(self.f_list * 2.0 * np.pi)
+            self.amp1=np.log10(self.f_amp) * 20
         self.freq=self.f_list
         
     def get_peaks(self,):
@@ -51,6 +56,10 @@ class Class_Tube_Check(object):
         MIN_WIDTH= 1 # 最小の周辺幅
         self.peaks, _ = signal.find_peaks(self.amp1, height= MIN_HIGH * max(self.amp1),width= MIN_WIDTH) #, distance= MIN_DIS * n , width= MIN_WIDTH * n)
         print('peaks', self.freq[self.peaks])
+        # resonance frequencies and bandwidths from poles, sub-Hz accurate
+        formants, bands = self.tube.formants(self.freq_low, self.freq_high)
+        print('formants', np.round(formants, 1))
+        print('bandwidths', np.round(bands, 1))
  
     def draw(self,):
         # draw
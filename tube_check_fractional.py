@@ -0,0 +1,96 @@
+#coding:utf-8
+
+# Fractional delay check:
+# Comparison formant error and render time of integer delay at 4x oversampling and Lagrange
+# fractional delay at the native sampling rate, to the formants of the exact tube length.
+#
+
+import time
+import numpy as np
+from scipy import signal
+
+# Check version
+#  Python 3.10.4, 64bit on Win32 (Windows 10)
+#  numpy 1.21.6
+#  scipy 1.8.0
+
+
+class Class_Fractional_Check(object):
+    def __init__(self, make_tube, sampling_rate=48000, oversample=4, length=1):
+        # make_tube(sampling_rate, delay) returns a tube model instance
+        self.make_tube= make_tube
+        self.sr= sampling_rate
+        self.oversample= oversample
+        #
+        self.freq_low=100
+        self.freq_high=6000
+        self.resolution=0.1
+        self.f_list=np.linspace(self.freq_low, self.freq_high,int((self.freq_high - self.freq_low)/self.resolution + 1 ) )
+        #
+        self.xin=np.random.randn(self.sr * length ) * 0.01
+        # formants of exact tube length
+        self.ref= self.get_peaks(self.make_tube(self.sr, 'integer').response(self.f_list))
+        print('exact     peaks', np.round(self.ref, 1))
+        self.check('integer', 1)
+        self.check('integer', self.oversample)
+        self.check('lagrange', 1)
+
+    def get_peaks(self, amp1):
+        MIN_HIGH= 0.4   # minimum height of peak
+        peaks, _ = signal.find_peaks(amp1, height= MIN_HIGH * max(amp1))
+        return self.f_list[peaks]
+
+    def check(self, delay, over):
+        # formants of the filter that process() renders, and time of process() of input
+        # the oversampled path renders upsampled input and resamples the output to sampling_rate
+        tube= self.make_tube(self.sr * over, delay)
+        b, a = tube.to_filter()
+        _, h = signal.freqz(b, a, worN=self.f_list, fs=tube.sr)
+        peaks= self.get_peaks(np.log10(np.abs(h)) * 20)
+        err= np.array([np.min(np.abs(peaks - f)) for f in self.ref])
+        t0= time.perf_counter()
+        if over > 1:
+            y= tube.process(signal.resample_poly(self.xin, over, 1))
+            y= signal.resample_poly(y, 1, over)
+        else:
+            y= tube.process(self.xin)
+        t1= time.perf_counter()
+        print(delay.ljust(8), 'x' + str(over), 'formant error [Hz]', np.round(err, 1),
+              'max', np.round(np.max(err), 1), ' render time [sec]', round(t1 - t0, 3))
+
+
+if __name__ == '__main__':
+
+    # Length & Area value, from problems 3.8 in "Digital Processing of Speech Signals" by L.R.Rabiner and R.W.Schafer
+    #
+    # /a/
+    L1_a=9.0    # set list of 1st tube's length by unit is [cm]
+    A1_a=1.0    # set list of 1st tube's area by unit is [cm^2]
+    L2_a=8.0    # set list of 2nd tube's length by unit is [cm]
+    A2_a=7.0    # set list of 2nd tube's area by unit is [cm^2]
+
+    # /u/
+    L1_u=10.0   # set list of 1st tube's length by unit is [cm]
+    A1_u=7.0    # set list of 1st tube's area by unit is [cm^2]
+    L2_u=7.0    # set list of 2nd tube's length by unit is [cm]
+    A2_u=3.0    # set list of 2nd tube's area by unit is [cm^2]
+
+    # /o/: L3,A3 is  extend factor to /a/ connecting as /u/
+    L3_o= L2_a * (L2_u / L1_u)     # set list of 3rd tube's length by unit is [cm]
+    A3_o= A2_a * (A2_u / A1_u)     # set list of 3rd tube's area by unit is [cm^2]
+
+    #
+    from T_three_tube import *
+    from oneloop_four_tube import *
+
+    # T three tube model example
+    print('T three tube')
+    Class_Fractional_Check(lambda sr, delay: Class_T_ThreeTube(L1_a, L2_a, L3_o, A1_a, A2_a, A3_o, sampling_rate=sr, delay=delay))
+
+    # one-loop four tube model example
+    print('one-loop four tube')
+    Class_Fractional_Check(lambda sr, delay: Class_1loop_FourTube(L1_a, L2_a, L3_o, 1.0, A1_a, A2_a, A3_o, A1_a, sampling_rate=sr, delay=delay))
+
+
+
+
@@ -0,0 +1,337 @@
+#coding:utf-8
+
+#
+# Inverse fitting: tube lengths and areas of a tube model from target formants
+#
+# Many candidate parameter sets are evaluated at once.  Their scattering forms are made in one
+# pass (scattering_batch() of Class_TubeNetwork) from the tube table of each set, that is an
+# affine function of the parameters, as L1, A1, ... of the presets go straight into the tubes.
+# The poles are found on a coarse grid and refined by batched Newton's method (resonances() of
+# tube_lti.py), and after each step of the fitting they are tracked from the poles before.
+# The gradient of a pole p to the parameters is analytic, by perturbation of the singular
+# M = I - S Dz at the pole:
+#     dp/dx = - u^T (dM/dx) w / u^T (dM/ds) w
+# where w and u are the right and left null vectors of M.
+# Levenberg-Marquardt in log of the parameters runs from many starts (Latin hypercube in the
+# bounds) for all target vowels together, and chunks of vowels run on a process pool.
+#
+
+
+import re
+import copy
+import inspect
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from scipy.stats import qmc
+from tube_network import C0, port_waves
+from tube_lti import resonances, loss_filters
+
+
+# Check version
+#  Python 3.10.4, 64bit on Win32 (Windows 10)
+#  numpy 1.21.6
+#  scipy 1.8.0
+
+
+def default_names(tube_class):
+    # length and area parameters of a preset, L1, A1, ... of its constructor
+    return [p for p in inspect.signature(tube_class.__init__).parameters if re.fullmatch('[LA][0-9]+', p)]
+
+
+def default_bounds(name):
+    # bounds of a parameter: length 1 to 20 [cm], area 0.1 to 15 [cm^2]
+    return (1.0, 20.0) if name[0] == 'L' else (0.1, 15.0)
+
+
+def _fit_chunk(fit, targets, theta0, poles0, iters, tol):
+    # fit one chunk of targets, run in a worker process
+    return fit.fit_batch(targets, theta0, poles0, iters, tol)
+
+
+class Class_Tube_Fit(object):
+    def __init__(self, tube, names=None, bounds=None, n_formant=3, freq_low=100, freq_high=5000, resolution=20):
+        # tube: tube model instance, its other parameters (rg0, rl0, wall_loss, ...) are kept as they are
+        # names: parameters to fit, default all lengths and areas.  They must change only lengths and
+        #        areas of the tubes, linearly, as L1, A1, ... of the presets
+        # bounds: dict of (low, high) of each name, default default_bounds()
+        # n_formant: number of formants fitted, F1 ... Fn
+        # poles are searched from freq_low to freq_high [Hz] on a grid of resolution [Hz]
+        self.tube= copy.copy(tube)
+        self.tube.cache= None
+        self.tube.compiled= None
+        self.tube.state= None
+        self.tube.loop_work= None
+        self.tube.ir= None
+        self.names= default_names(type(tube)) if names is None else list(names)
+        bounds= {} if bounds is None else bounds
+        self.bounds= np.array([bounds.get(name, default_bounds(name)) for name in self.names], dtype=float)
+        self.n_formant= n_formant
+        self.freq_low= freq_low
+        self.freq_high= freq_high
+        self.resolution= resolution
+        self.sr= tube.sr
+        # affine map of the parameters to the tube table, by one unit step of each parameter
+        self.theta0= np.array([getattr(tube, name) for name in self.names], dtype=float)
+        self.tubes0, self.refl0 = self.table(self.theta0)
+        self.dtubes= np.zeros((len(self.names),) + self.tubes0.shape)
+        for p in range(len(self.names)):
+            step= np.zeros(len(self.names))
+            step[p]= 1.0
+            tubes1, refl1 = self.table(self.theta0 + step)
+            tubes2, refl2 = self.table(self.theta0 + 2.0 * step)
+            self.dtubes[p]= tubes1 - self.tubes0
+            if (np.any(refl1 != self.refl0) or np.any(self.dtubes[p][:, 2:] != 0)
+                    or not np.allclose(tubes2 - self.tubes0, 2.0 * self.dtubes[p])):
+                raise ValueError(self.names[p] + ' does not change tube lengths and areas linearly')
+
+    def table(self, theta):
+        # tube table (tubes, [L, A, att, wall]) and junction table (junctions, [r, rad]) at parameters theta
+        saved= [getattr(self.tube, name) for name in self.names]
+        for name, v in zip(self.names, theta):
+            setattr(self.tube, name, float(v))
+        self.tube.build()
+        tubes, refl = self.tube.tables()
+        for name, v in zip(self.names, saved):
+            setattr(self.tube, name, v)
+        self.tube.build()
+        return tubes, refl
+
+    def scattering(self, theta):
+        # scattering form of parameter sets theta (N, parameters), see scattering_batch()
+        theta= np.asarray(theta, dtype=float)
+        tubes= self.tubes0 + np.tensordot(theta - self.theta0, self.dtubes, axes=1)
+        refl= np.broadcast_to(self.refl0, (len(theta),) + self.refl0.shape)
+        S, e, c, tau, att, wall, rad = self.tube.scattering_batch(tubes, refl)
+        wall= self.tube.applied_wall(tau, wall)
+        return S, e, c, tau, att, (wall if np.any(wall != 0) else None), (rad if np.any(rad != 0) else None), tubes
+
+    def detect(self, desc, rows=None, chunk=256):
+        # poles (N, n_formant) of each set, the lowest ones from freq_low, nan if less poles
+        # minimums of |det(M)| and peaks of |H| on the grid are refined by Newton's method
+        S, e, c, tau, att, wall, rad, tubes = desc
+        rows= np.arange(len(S)) if rows is None else np.asarray(rows)
+        f= np.arange(0, self.freq_high + 2 * self.resolution, self.resolution)
+        cand=[]
+        f0=[]
+        for i in range(0, len(rows), chunk):
+            r= rows[i:i+chunk]
+            L, F, dL, dF = loss_filters(2.0j * np.pi * f[None, :], self.sr, None if wall is None else wall[r][:, None],
+                                        None if rad is None else rad[r][:, None])
+            Dw= ((att[r] ** (tau[r] * self.sr))[:, None, :] * np.exp(-2.0j * np.pi * f[None, :, None] * tau[r][:, None, :])
+                 * L)
+            M= np.eye(S.shape[-1]) - S[r][:, None] * (Dw * F)[:, :, None, :]
+            logdet= np.linalg.slogdet(M)[1]
+            v= np.linalg.solve(M, np.broadcast_to(e[r][:, None, :], Dw.shape)[..., None])[..., 0]
+            amp= np.abs(np.sum((c[r][:, None, :] + (c[r][:, None, :] - 1.) * (F - 1.)) * Dw * v, axis=-1))
+            m= (((logdet[:, 1:-1] <= logdet[:, :-2]) & (logdet[:, 1:-1] < logdet[:, 2:]))
+                | ((amp[:, 1:-1] >= amp[:, :-2]) & (amp[:, 1:-1] > amp[:, 2:])))
+            n, k = np.nonzero(m)
+            cand.append(r[n])
+            f0.append(f[k + 1])
+        return self.refine(desc, np.concatenate(cand), np.concatenate(f0), len(S))
+
+    def refine(self, desc, cand, f0, N):
+        # Newton's method from f0 [Hz] (complex) for set cand of each start, and the lowest
+        # n_formant poles of each set in (N, n_formant)
+        S, e, c, tau, att, wall, rad, tubes = desc
+        s, done = resonances(S[cand], e[cand], c[cand], tau[cand], att[cand], self.sr, f0, iters=20,
+                             wall=None if wall is None else wall[cand], rad=None if rad is None else rad[cand])
+        freqs= s.imag / (2.0 * np.pi)
+        ok= done & (s.real < 0) & (freqs >= self.freq_low) & (freqs <= self.freq_high)
+        cand, s = cand[ok], s[ok]
+        order= np.lexsort((s.imag, cand))
+        cand, s = cand[order], s[order]
+        same= np.zeros(len(s), dtype=bool)  # same pole from other start
+        same[1:]= (cand[1:] == cand[:-1]) & (np.abs(s[1:] - s[:-1]) <= 1e-6 * np.abs(s[1:]))
+        cand, s = cand[~same], s[~same]
+        rank= np.arange(len(s)) - np.searchsorted(cand, cand)
+        poles= np.full((N, self.n_formant), complex(np.nan, np.nan))
+        sel= rank < self.n_formant
+        poles[cand[sel], rank[sel]]= s[sel]
+        return poles
+
+    def track(self, desc, poles):
+        # poles of changed parameter sets, from their poles before.  Sets that lose a pole are searched again
+        valid= ~np.isnan(poles)
+        cand= np.nonzero(valid)[0]
+        # a start exactly on a pole of same parameters makes M singular, it is moved a little
+        new= self.refine(desc, cand, poles[valid] * (1.0 + 1e-7) / (2.0j * np.pi), len(poles))
+        lost= np.flatnonzero(np.any(np.isnan(new) & valid, axis=1))
+        if len(lost):
+            new[lost]= self.detect(desc, lost)[lost]
+        return new
+
+    def gradient(self, desc, poles):
+        # derivative of each pole by each parameter, (N, n_formant, parameters), nan where no pole
+        S, e, c, tau, att, wall, rad, tubes = desc
+        N, n = poles.shape
+        grad= np.full((N, n, len(self.names)), complex(np.nan, np.nan))
+        valid= ~np.isnan(poles)
+        cand= np.nonzero(valid)[0]
+        if len(cand) == 0:
+            return grad
+        s= poles[valid]
+        s= s + 1e-9 * np.abs(s)  # off the pole a little, so that M is not exactly singular
+        Sa, ta = S[cand], tau[cand]
+        L, F, dL, dF = loss_filters(s, self.sr, None if wall is None else wall[cand], None if rad is None else rad[cand])
+        g= att[cand] ** (ta * self.sr)
+        E= g * np.exp(-1.0 * s[:, None] * ta)
+        Dz= E * L
+        G= Dz * F
+        dGs= E * (dL - ta * L) * F + Dz * dF
+        dGt= G * (self.sr * np.log(att[cand]) - s[:, None])  # by tau
+        M= np.eye(S.shape[-1]) - Sa * G[:, None, :]
+        w= np.linalg.solve(M, np.ones(G.shape, dtype=complex)[..., None])[..., 0]
+        u= np.linalg.solve(np.swapaxes(M, -1, -2), np.ones(G.shape, dtype=complex)[..., None])[..., 0]
+        w /= np.max(np.abs(w), axis=1, keepdims=True)
+        u /= np.max(np.abs(u), axis=1, keepdims=True)
+        Su= np.einsum('nj,njk->nk', u, Sa)  # u^T S
+        den= -1.0 * np.sum(Su * dGs * w, axis=1)     # u^T dM/ds w
+        dtau= Su * dGt * w / den[:, None]            # dp/dtau of each wave
+        dA= np.einsum('nj,nmjk,nk->nm', u, self.junction_derivative(tubes[cand]), G * w) / den[:, None]
+        dL= (dtau[:, 0::2] + dtau[:, 1::2]) / C0     # dp/dL of each tube
+        grad[valid]= dL @ self.dtubes[:, :, 0].T + dA @ self.dtubes[:, :, 1].T
+        return grad
+
+    def junction_derivative(self, tubes):
+        # derivative of S by the area of each tube, (N, tubes, K, K)
+        N, T = tubes.shape[:2]
+        dS= np.zeros((N, T, 2 * T, 2 * T))
+        for kind, ports, r, p in self.tube.junctions:
+            if kind != 'junction':
+                continue
+            waves= port_waves(ports)
+            A= tubes[:, [i for i, end in ports], 1]
+            sumA= np.sum(A, axis=1)
+            for k, (ik, ok) in enumerate(waves):
+                for j, (ij, oj) in enumerate(waves):
+                    for q, (m, end) in enumerate(ports):
+                        # S[ok, ij] = 2 A[k] / sum(A) - delta(k,j)
+                        dS[:, m, ok, ij] += 2.0 * ((1.0 if q == k else 0.0) * sumA - A[:, k]) / sumA ** 2
+        return dS
+
+    def formants(self, theta):
+        # formants and bandwidths [Hz] of parameter sets theta (N, parameters), (N, n_formant) each
+        poles= self.detect(self.scattering(np.atleast_2d(theta)))
+        return poles.imag / (2.0 * np.pi), -1.0 * poles.real / np.pi
+
+    def starts(self, n, seed=0):
+        # n start parameter sets, Latin hypercube in log of the bounds
+        u= qmc.LatinHypercube(d=len(self.names), seed=seed).random(n)
+        lo, hi = np.log(self.bounds).T
+        return np.exp(lo + u * (hi - lo))
+
+    def fit_batch(self, targets, theta0, poles0, iters=50, tol=1e-4, check=10):
+        # Levenberg-Marquardt of all starts theta0 (starts, parameters) with their poles poles0 for all targets,
+        # residual is log(formant / target), nan target is not used.  return best of the starts per target
+        # poles are searched on the grid when a start is fitted, every check steps and at the end
+        targets= np.asarray(targets, dtype=float)
+        M, n = targets.shape
+        Ns= len(theta0)
+        logt= np.log(np.where(np.isnan(targets), 1.0, targets))
+        weight= (~np.isnan(targets)).astype(float)
+        logt= np.repeat(logt, Ns, axis=0)
+        weight= np.repeat(weight, Ns, axis=0)
+        lo, hi = np.log(self.bounds).T
+        x= np.tile(np.log(theta0), (M, 1))  # log of parameters
+        poles= np.tile(poles0, (M, 1))
+        N, P = x.shape
+
+        def evaluate(rows, x, poles, search=False):
+            # residual, cost and jacobian by log of parameters
+            # poles are tracked from poles, or searched on the grid if search is True
+            theta= np.exp(x)
+            desc= self.scattering(theta)
+            poles= self.detect(desc) if search else self.track(desc, poles)
+            freqs= poles.imag / (2.0 * np.pi)
+            r= (np.log(np.where(np.isnan(freqs), 1.0, freqs)) - logt[rows]) * weight[rows]
+            cost= np.sum(r ** 2, axis=1)
+            cost[np.any(np.isnan(freqs) & (weight[rows] > 0), axis=1)]= np.inf
+            J= (self.gradient(desc, poles).imag / (2.0 * np.pi)) * theta[:, None, :] / freqs[..., None]
+            J= np.where(np.isfinite(J), J, 0.0) * weight[rows][..., None]
+            return poles, r, cost, J
+
+        rows= np.arange(N)
+        poles, r, cost, J = evaluate(rows, x, poles)
+        fitted= cost <= n * tol ** 2  # by poles searched on the grid
+        lam= np.full(N, 1e-2)
+        active= np.isfinite(cost) & ~fitted
+        for it in range(iters):
+            a= np.flatnonzero(active)
+            if len(a) == 0:
+                break
+            JtJ= np.einsum('nip,niq->npq', J[a], J[a])
+            step= np.linalg.solve(JtJ + lam[a][:, None, None] * np.eye(P), -1.0 * np.einsum('nip,ni->np', J[a], r[a])[..., None])[..., 0]
+            xa= np.clip(x[a] + step, lo, hi)
+            pa, ra, ca, Ja = evaluate(a, xa, poles[a])
+            ok= ca < cost[a]
+            b= a[ok]
+            x[b], poles[b], r[b], cost[b], J[b] = xa[ok], pa[ok], ra[ok], ca[ok], Ja[ok]
+            lam[b]= np.maximum(lam[b] * 0.3, 1e-6)  # J^T J is of rank n_formant only
+            lam[a[~ok]] *= 10.0
+            # a tracked pole may not be one of the lowest any more, poles are searched again
+            # when a start is fitted and every check steps
+            if it % check == check - 1:
+                a= np.flatnonzero(active)
+            else:
+                a= np.flatnonzero(active & (cost <= n * tol ** 2))
+            if len(a):
+                poles[a], r[a], cost[a], J[a] = evaluate(a, x[a], None, search=True)
+                fitted[a]= cost[a] <= n * tol ** 2
+            active&= ~fitted & np.isfinite(cost) & (lam < 1e8)
+            active&= ~np.repeat(np.any(fitted.reshape(M, Ns), axis=1), Ns)  # other starts of a fitted target
+        # best start of each target, of the fitted ones or of all searched again
+        cost= np.where(np.repeat(np.any(fitted.reshape(M, Ns), axis=1), Ns) & ~fitted, np.inf, cost)
+        a= np.flatnonzero(np.repeat(~np.any(fitted.reshape(M, Ns), axis=1), Ns) & np.isfinite(cost))
+        if len(a):
+            poles[a], r[a], cost[a], J[a] = evaluate(a, x[a], None, search=True)
+        best= np.argmin(cost.reshape(M, Ns), axis=1) + np.arange(M) * Ns
+        w= weight[best]
+        return {'params': np.exp(x[best]), 'formants': poles[best].imag / (2.0 * np.pi),
+                'bandwidths': -1.0 * poles[best].real / np.pi,
+                'error': np.sqrt(cost[best] / np.maximum(w.sum(axis=1), 1))}
+
+    def fit(self, targets, starts=16, iters=50, tol=1e-4, chunk=256, max_workers=0, seed=0):
+        # fit parameters to targets (M, n_formant) [Hz], one row per vowel token, nan for a missing formant
+        # starts: number of start points per target, iters: steps of Levenberg-Marquardt
+        # tol: relative formant error to stop at.  chunk: targets fitted together
+        # max_workers: number of worker processes, 0 is no pool (fit in this process)
+        # return dict of names, params (M, parameters), formants and bandwidths (M, n_formant) [Hz]
+        # and error: rms of log(formant / target)
+        targets= np.atleast_2d(np.asarray(targets, dtype=float))
+        theta0= self.starts(starts, seed)
+        poles0= self.detect(self.scattering(theta0))
+        keep= ~np.any(np.isnan(poles0), axis=1)  # a start with less poles than n_formant is not used
+        theta0, poles0 = theta0[keep], poles0[keep]
+        parts= [targets[i:i+chunk] for i in range(0, len(targets), chunk)]
+        if max_workers == 0:
+            results= [self.fit_batch(part, theta0, poles0, iters, tol) for part in parts]
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers) as pool:
+                results= list(pool.map(_fit_chunk, [self] * len(parts), parts, [theta0] * len(parts),
+                                       [poles0] * len(parts), [iters] * len(parts), [tol] * len(parts)))
+        out= {k: np.concatenate([r[k] for r in results]) for k in results[0]}
+        out['names']= self.names
+        return out
+
+
+
+
+if __name__ == '__main__':
+
+    # formants of random T three tube models are fitted back, and F1-F3 of /a/ /i/ /u/ of a male speaker
+    import time
+    from T_three_tube import Class_T_ThreeTube
+    tube= Class_T_ThreeTube(9.0, 8.0, 5.6, 1.0, 7.0, 3.0, sampling_rate=48000)
+    fit= Class_Tube_Fit(tube)
+    theta= fit.starts(200, seed=1)
+    targets= fit.formants(theta)[0]
+    targets= targets[~np.any(np.isnan(targets), axis=1)]
+    t0= time.perf_counter()
+    result= fit.fit(targets)
+    t1= time.perf_counter()
+    err= np.abs(result['formants'] / targets - 1.0)
+    print(len(targets), 'vowels', round(t1 - t0, 2), 'sec,', 'fitted within 0.1%:', np.mean(np.max(err, axis=1) < 1e-3))
+    result= fit.fit([[730, 1090, 2440], [270, 2290, 3010], [300, 870, 2240]])
+    for name, p, f in zip(['/a/', '/i/', '/u/'], result['params'], result['formants']):
+        print(name, dict(zip(result['names'], np.round(p, 2).tolist())), 'formants', np.round(f, 1))
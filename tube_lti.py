@@ -0,0 +1,221 @@
+#coding:utf-8
+
+#
+# LTI helpers for the tube models
+#
+# A tube model is described by its scattering form:
+#   w = S @ r + e * yg    wave written into each delay line
+#   y2tm = c @ r          output
+# where r is the wave read out of each delay line, after a delay of D samples
+# and an attenuation att ** D.  With integer delays this is a rational
+# transfer function in z.  A fractional delay is read by Lagrange interpolation,
+# a short FIR filter over the taps D ... D+order, so it stays rational in z.
+# Frequency dependent losses are short FIR filters too, folded into the read taps:
+#   wall loss of a tube   a z + (1 - 2a) + a z^-1, gain 1 - 2a (1 - cos wT), no phase
+#                         (the delay is read one sample shorter for it)
+#   radiation at the lips F = (1 - p/2) + p/2 z^-1 on the reflection -rl0 F,
+#                         and output 1 + rl0 F, so high frequencies are less reflected
+# where a is wall and p is rad of the wave.
+#
+
+
+import numpy as np
+from scipy import signal
+
+
+# Check version
+#  Python 3.10.4, 64bit on Win32 (Windows 10)
+#  numpy 1.21.6
+#  scipy 1.8.0
+
+
+def sample_delays(tau, sampling_rate):
+    # delay of each wave by unit is [sample], same rounding as process()
+    # a tube shorter than half a sample still delays one sample
+    return np.maximum(np.round(np.asarray(tau) * sampling_rate).astype(int), 1)
+
+
+def lagrange_delays(tau, sampling_rate, order=3):
+    # fractional delay of each wave by Lagrange interpolation of the given order
+    # the wave is read as sum over i of h[:, i] * x[t - D - i], return (D, h)
+    # D is chosen so that the delay is in the middle of the taps, but not less than one sample
+    d=np.maximum(np.asarray(tau) * sampling_rate, 1.0)
+    D=np.maximum(np.floor(d).astype(int) - (order - 1) // 2, 1)
+    x=d - D  # delay measured from the first tap
+    h=np.ones((len(d), order + 1))
+    for i in range(order + 1):
+        for j in range(order + 1):
+            if j != i:
+                h[:, i] *= (x - j) / (i - j)
+    return D, h
+
+
+def convolve_taps(h, g):
+    # convolution of taps h (..., n) and taps g (..., m) along the last axis, row by row
+    n= h.shape[-1]
+    m= g.shape[-1]
+    out= np.zeros(np.broadcast_shapes(h.shape[:-1], g.shape[:-1]) + (n + m - 1,))
+    for i in range(m):
+        out[..., i:i+n] += h * g[..., i:i+1]
+    return out
+
+
+def wall_taps(wall):
+    # taps of the wall loss filter of each wave, centred at the second tap
+    wall= np.asarray(wall, dtype=float)
+    return np.stack([wall, 1. - 2. * wall, wall], axis=-1)
+
+
+def radiation_taps(c, rad):
+    # taps of the scattering from each wave and of the output with the radiation filter F of rad,
+    # return (taps times S, taps of c), (..., 2) each.  rad is zero except the waves coming into the lips
+    rad= np.asarray(rad, dtype=float)
+    hs= np.stack([1. - rad / 2., rad / 2.], axis=-1)
+    c= np.asarray(c, dtype=float)
+    hc= np.stack([c - (c - 1.) * rad / 2., (c - 1.) * rad / 2.], axis=-1)
+    return hs, hc
+
+
+def loss_filters(s, sampling_rate, wall=None, rad=None):
+    # gain of the wall loss filter L and of the radiation filter F of each wave at s [1/second],
+    # and their derivatives by s.  return (L, F, dL, dF), 1 and 0 when wall or rad is None
+    s= np.asarray(s)[..., None]
+    z1= np.exp(-1.0 * s / sampling_rate)  # z^-1
+    L, F, dL, dF = 1., 1., 0., 0.
+    if wall is not None:
+        wall= np.asarray(wall)
+        L= 1. - 2. * wall + wall * (1. / z1 + z1)
+        dL= wall * (1. / z1 - z1) / sampling_rate
+    if rad is not None:
+        rad= np.asarray(rad)
+        F= 1. - rad / 2. + rad / 2. * z1
+        dF= -1. * rad / 2. * z1 / sampling_rate
+    return L, F, dL, dF
+
+
+def transfer_function(S, e, c, D, att, h=None, hc=None):
+    # get (b, a) coefficients in ascending powers of z^-1
+    # h is the read filter of each wave, taps at D ... D+ntap-1 with the attenuation included,
+    # default is one tap att ** D.  hc is the read filter of the output, with c included,
+    # default is c * h
+    # det(I - S Dz) and its adjugate are polynomials in z^-1 of order sum(D) at most,
+    # so they are exactly recovered from their values on sum(D)+1 points of the unit circle.
+    D=np.asarray(D, dtype=int)
+    if h is None:
+        h=(np.asarray(att) ** D)[:, None]
+    ntap=h.shape[1]
+    n=int(D.sum()) + len(D) * (ntap - 1)
+    nfft=1 << int(np.ceil(np.log2(n + 1)))
+    if hc is None:
+        hc=np.asarray(c)[:, None] * h
+    Dz=np.zeros((nfft, len(D)), dtype=complex)
+    Dc=np.zeros((nfft, len(D)), dtype=complex)
+    for i in range(ntap):
+        z=np.exp(-2.0j * np.pi * np.outer(np.arange(nfft), D + i) / nfft)
+        Dz += h[:, i] * z
+        Dc += hc[:, i] * z
+    M=np.eye(len(D)) - S * Dz[:, None, :]
+    den=np.linalg.det(M)
+    v=np.linalg.solve(M, np.broadcast_to(e, Dz.shape)[..., None])[..., 0]
+    num=den * np.sum(Dc * v, axis=-1)
+    a=np.fft.ifft(den).real[:n+1]
+    b=np.fft.ifft(num).real[:n+1]
+    # clean up round-off in the coefficients that are zero
+    a[np.abs(a) < 1e-12 * np.max(np.abs(a))]=0.
+    b[np.abs(b) < 1e-12 * np.max(np.abs(b))]=0.
+    return b, a
+
+
+def ba_to_sos(b, a):
+    # second-order sections of (b, a), the leading pure delay of b is kept as extra sections
+    d=int(np.argmax(b != 0))
+    z=np.roots(b[d:])
+    p=np.roots(a)
+    sos=signal.zpk2sos(z, p, b[d] / a[0])
+    delay=[[0., 0., 1., 1., 0., 0.]] * (d // 2) + [[0., 1., 0., 1., 0., 0.]] * (d % 2)
+    if delay:
+        sos=np.vstack([sos, delay])
+    return sos
+
+
+def frequency_response(S, e, c, tau, att, sampling_rate, xw, wall=None, rad=None):
+    # complex frequency response at angular frequency xw [rad/second], scalar or array
+    # solve the junction scattering equations (I - S Dz) w = e for all frequencies at once,
+    # the delays are the exact delay time tau, not rounded to sample
+    # xw may be complex, xw = s / j gives the transfer function at s of the Laplace domain
+    # wall and rad of each wave are the loss filters, see loss_filters()
+    xw=np.asarray(xw)
+    if xw.dtype.kind != 'c':
+        xw=xw.astype(float)
+    Dz=np.asarray(att) ** (np.asarray(tau) * sampling_rate) * np.exp(-1.0j * np.multiply.outer(xw, tau))
+    if wall is None and rad is None:
+        M=np.eye(len(tau)) - S * Dz[..., None, :]
+        v=np.linalg.solve(M, np.broadcast_to(e, Dz.shape)[..., None])[..., 0]
+        return np.sum(c * Dz * v, axis=-1)
+    L, F, dL, dF = loss_filters(1.0j * xw, sampling_rate, wall, rad)
+    Dz=Dz * L
+    M=np.eye(len(tau)) - S * (Dz * F)[..., None, :]
+    v=np.linalg.solve(M, np.broadcast_to(e, Dz.shape)[..., None])[..., 0]
+    return np.sum((c + (c - 1.) * (F - 1.)) * Dz * v, axis=-1)
+
+
+def solve_batch(M, b):
+    # solve M x = b of a batch of matrices (n, K, K), return x and flags of the matrices that are
+    # exactly singular.  x of a singular or not finite matrix is nan, instead of an error for all
+    singular=np.zeros(len(M), dtype=bool)
+    try:
+        return np.linalg.solve(M, b), singular
+    except np.linalg.LinAlgError:
+        b=np.broadcast_to(b, M.shape[:-1] + b.shape[-1:])
+        x=np.full(b.shape, np.nan, dtype=np.result_type(M, b))
+        finite=np.all(np.isfinite(M), axis=(-2, -1))
+        singular[finite]=np.linalg.slogdet(M[finite])[0] == 0  # same LU as solve
+        ok=finite & ~singular
+        x[ok]=np.linalg.solve(M[ok], b[ok])
+        return x, singular
+
+
+def resonances(S, e, c, tau, att, sampling_rate, f0, iters=50, tol=1e-12, wall=None, rad=None):
+    # poles s [1/second] of the transfer function H(s) near frequencies f0 [Hz], all at once
+    # by Newton's method on 1/H, of which the zeros are the poles of H, so that a root of
+    # det(I - S Dz) that is cancelled in H is not taken.  Dz(s) = att ** (tau * sampling_rate) * exp(-s tau),
+    # times the loss filters of wall and rad.  The step is H / H', and H' is got from
+    # dv/ds = (I - S Dz)^-1 S Dz' v.
+    # f0 may be complex, as a pole got before / (2j pi).  S of shape (n, K, K) is a batch of models,
+    # one per start f0 (n,), then e, c, tau, att and wall, rad if given are (n, K) too.
+    # return the poles and flags if converged
+    batched=np.ndim(S) == 3
+    tau=np.asarray(tau)
+    g=np.asarray(att) ** (tau * sampling_rate)
+    s=2.0j * np.pi * np.asarray(f0, dtype=complex)
+    done=np.zeros(s.shape, dtype=bool)
+    failed=np.zeros(s.shape, dtype=bool)  # diverged
+    S0, e0, c0, tau0, g0, wall0, rad0 = S, e, c, tau, g, wall, rad
+    for _ in range(iters):
+        a=np.flatnonzero(~done & ~failed)
+        if len(a) == 0:
+            break
+        if batched:
+            S, e, c, tau, g = S0[a], e0[a], c0[a], tau0[a], g0[a]
+            wall=None if wall0 is None else wall0[a]
+            rad=None if rad0 is None else rad0[a]
+        L, F, dL, dF = loss_filters(s[a], sampling_rate, wall, rad)
+        with np.errstate(over='ignore', invalid='ignore'):  # diverged start, failed below
+            E=g * np.exp(-1.0 * s[a][:, None] * tau)
+        Dz=E * L  # read wave
+        dDz=E * (dL - tau * L)
+        G=Dz * F  # read wave into the scattering
+        dG=dDz * F + Dz * dF
+        cf=c + (c - 1.) * (F - 1.)
+        M=np.eye(tau.shape[-1]) - S * G[:, None, :]
+        v, singular=solve_batch(M, np.broadcast_to(e, Dz.shape)[..., None])
+        v=v[..., 0]
+        dv=solve_batch(M, (S @ (dG * v)[..., None]))[0][..., 0]
+        H=np.sum(cf * Dz * v, axis=-1)
+        dH=np.sum((c - 1.) * dF * Dz * v + cf * (dDz * v + Dz * dv), axis=-1)
+        with np.errstate(invalid='ignore'):
+            step=np.where(singular, 0., H / dH)  # exactly on a pole
+        s[a] += step
+        done[a]=np.abs(step) < tol * np.abs(s[a])
+        failed[a]=~np.isfinite(s[a])
+    return s, done
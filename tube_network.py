@@ -0,0 +1,812 @@
+#coding:utf-8
+
+#
+# Tube Network: general tube model of any junction topology
+#
+# A network is a graph of tubes (length, area, attenuation per step) connected at
+# junctions.  A junction joins any number of tube ends, or terminates one tube end at
+# the glottis (input), the lips (output) or a closed end.
+#
+# Every tube carries two waves, forward (from end 0 to end 1) and backward (from end 1 to
+# end 0), so the wave of tube i is 2*i (forward) and 2*i+1 (backward).
+# At a junction of tubes with areas A, the wave going out into tube k is
+#     sum over j of ( 2 * A[k] / sum(A) - delta(k,j) ) * wave coming in from tube j
+# which is the same reflection coefficient as r12, r21, r31 of the T three tube model.
+#
+# The delay of a tube is rounded to integer samples (delay='integer'), or is read with
+# Lagrange interpolation (delay='lagrange') so that the tube length is kept to sub-sample
+# precision without oversampling.
+#
+# Frequency dependent losses are optional short FIR filters folded into the read taps of
+# the waves, so the stepping kernel and its cost per sample are not changed: a wall loss
+# filter per tube (wall of add_tube) and a radiation filter at the lips (rad of add_lip),
+# see tube_lti.py.  fone() and formants() include the same filters.
+#
+
+
+import time
+import hashlib
+import numpy as np
+from scipy import signal
+from scipy import sparse
+from scipy import interpolate
+from tube_cache import shared_cache, grid_key
+from tube_lti import sample_delays, lagrange_delays, transfer_function, ba_to_sos, frequency_response, resonances
+from tube_lti import convolve_taps, wall_taps, radiation_taps, loss_filters
+
+
+# Check version
+#  Python 3.10.4, 64bit on Win32 (Windows 10)
+#  numpy 1.21.6
+#  scipy 1.8.0
+
+
+C0=35000.0  # speed of sound in air, round 35000 cm/second
+SPARSE_MIN_WAVES=256  # use sparse update matrix when number of waves is larger than this
+
+
+def port_waves(ports):
+    # (incoming, outgoing) wave at each port (tube index, end) of a junction:
+    # the forward wave 2*i comes in at end 1 and goes out at end 0, the backward wave 2*i+1 reverse
+    return [(2*i, 2*i+1) if end == 1 else (2*i+1, 2*i) for i, end in ports]
+
+
+def junction_scattering(A):
+    # scattering of a junction of tubes with areas A (..., ports): [..., k, j] from the wave coming in
+    # from port j to the wave going out into port k, 2 * A[k] / sum(A) - delta(k,j)
+    A= np.asarray(A, dtype=float)
+    return 2.0 * A[..., :, None] / np.sum(A, axis=-1)[..., None, None] - np.eye(A.shape[-1])
+
+
+class Class_TubeNetwork(object):
+    def __init__(self, sampling_rate=48000, delay='integer', dtype=np.float64):
+        self.sr= sampling_rate
+        self.delay= delay  # 'integer' or 'lagrange', how the delay lines are read
+        self.dtype= np.dtype(dtype)  # float type of delay lines and output, np.float32 halves memory
+        self.lagrange_order= 3
+        self.tubes=[]      # list of [length, area, att, wall]
+        self.junctions=[]  # list of [kind, ports, reflection coefficient, rad]
+        self.num_of_tube= 0
+        self.state=None    # delay lines of block processing, see process_block()
+        self.compiled=None
+        self.loop_work=None  # work buffers of process_loop(), see loop_buffers()
+        self.ir=None       # (key, impulse response) of the last impulse_response()
+        self.cache= shared_cache  # cache of compiled coefficients and responses, None is not used
+        self.cache_quantum= 1e-9  # model parameters are rounded by this in the key of cache
+
+    def clear(self,):
+        # remove all tubes and junctions
+        self.tubes=[]
+        self.junctions=[]
+        self.num_of_tube= 0
+
+    def add_tube(self, L, A, att=1.0, wall=0.0):
+        # add a tube: L is length [cm], A is area [cm^2], att is attenuation constant per one step
+        # wall: wall loss filter of the tube, gain 1 - 2 * wall * (1 - cos wT) per pass, 0 to 0.25
+        # return tube index
+        if not 0.0 <= wall <= 0.25:
+            raise ValueError('wall must be 0 to 0.25, ' + str(wall))
+        self.tubes.append([L, A, att, wall])
+        self.num_of_tube= len(self.tubes)
+        return len(self.tubes) - 1
+
+    def add_junction(self, ports):
+        # add N-way junction, ports is a list of tube ends (tube index, end), end is 0 or 1
+        self.junctions.append(['junction', list(ports), 0.0, 0.0])
+
+    def add_glottis(self, port, rg0=0.95):
+        # input end: reflection coefficient rg0, input yg is fed with gain (1+rg0)/2
+        self.junctions.append(['glottis', [port], rg0, 0.0])
+
+    def add_lip(self, port, rl0=0.9, rad=0.0):
+        # output end: reflection coefficient -rl0, output is (1+rl0) * incoming wave
+        # rad: radiation filter, reflection is -rl0 at DC and -rl0 * (1 - rad) at Nyquist, 0 to 1
+        if not 0.0 <= rad <= 1.0:
+            raise ValueError('rad must be 0 to 1, ' + str(rad))
+        self.junctions.append(['lip', [port], rl0, rad])
+
+    def add_closed(self, port, rl=-0.97):
+        # closed end: reflection coefficient -rl, beside ideal value of rl is -1
+        self.junctions.append(['closed', [port], rl, 0.0])
+
+    def build(self,):
+        # set up tubes and junctions before compile
+        # presets override this to make the graph from their current model parameters
+        pass
+
+    def model_key(self,):
+        # key of the built model in the cache: tubes and junctions rounded by cache_quantum,
+        # sampling rate and delay
+        q= self.cache_quantum
+        return (type(self).__name__, self.sr, self.delay, self.lagrange_order, self.dtype.str,
+                tuple((round(L / q), round(A / q), round(a / q), round(w / q)) for L, A, a, w in self.tubes),
+                tuple((kind, tuple(ports), round(r / q), round(p / q)) for kind, ports, r, p in self.junctions))
+
+    def compile(self,):
+        # compute scattering coefficients of all junctions and delay tables of stepping kernel
+        self.build()
+        key= None
+        if self.cache is not None:
+            key= (self.model_key(), 'compile')
+            cp= self.cache.get(key)
+            if cp is not None:
+                self.compiled= dict(cp)
+                return self.compiled
+        K= 2 * len(self.tubes)  # number of waves
+        tubes, refl = self.tables()
+        S, e, c, tau, att, wall, rad = (x[0] for x in self.scattering_batch(tubes[None], refl[None]))
+        D= sample_delays(tau, self.sr)
+        Dr, h, wall = self.read_filter(tau, att, wall, self.delay)
+        U, h, hc = self.update_matrix(S, e, c, h, rad)
+        ntap= h.shape[1]
+        P= int(Dr.max()) + ntap - 1  # rows of history that are read again, see process_loop()
+        R= max(1024, 64 * int(Dr.min()))  # rows written before history is moved
+        U= U.astype(self.dtype)
+        off= self.read_offsets(Dr, ntap, int(Dr.min()), K+1)
+        self.compiled={'S': S, 'e': e, 'c': c, 'tau': tau, 'att': att, 'wall': wall, 'rad': rad,
+                       'D': D, 'Dr': Dr, 'h': h, 'hc': hc, 'P': P, 'R': R, 'off': off,
+                       'U': U if K <= SPARSE_MIN_WAVES else None,
+                       'U_sparse': sparse.csr_matrix(U.T) if K > SPARSE_MIN_WAVES else None}
+        if key is not None:
+            self.cache.put(key, dict(self.compiled))
+        return self.compiled
+
+    def read_filter(self, tau, att, wall, delay):
+        # read filter of each wave: (Dr, h, wall), taps at Dr ... Dr+ntap-1, attenuation and wall loss included
+        # the wall loss filter is centred at its second tap, so the delay is read one sample shorter.
+        # A wave shorter than 2 samples has no wall loss filter, wall returned is the one applied.
+        wall= self.applied_wall(tau, wall)
+        lossy= wall != 0
+        t= tau - lossy / self.sr
+        if delay == 'integer':
+            Dr= sample_delays(t, self.sr)
+            h= (att ** sample_delays(tau, self.sr))[:, None]
+        elif delay == 'lagrange':
+            Dr, h = lagrange_delays(t, self.sr, self.lagrange_order)
+            h *= (att ** np.maximum(tau * self.sr, 1.0))[:, None]
+        else:
+            raise ValueError('unknown delay ' + str(delay))
+        if np.any(lossy):
+            g= wall_taps(wall)
+            g[~lossy]= [1., 0., 0.]  # no delay
+            h= convolve_taps(h, g)
+        return Dr, h, wall
+
+    def update_matrix(self, S, e, c, h, rad):
+        # update matrix of stepping kernel: [read taps, yg] @ U = [written waves, y2tm]
+        # every tap of wave k is a row of scattering from wave k, weighted by the read filter h,
+        # and by the radiation filter if rad of wave k is not 0.  Leading axes of all are frames.
+        # return U, read filter of scattering and read filter of output (c included)
+        if np.any(rad != 0):
+            hs, hc = radiation_taps(c, rad)
+            hc= convolve_taps(h, hc)
+            h= convolve_taps(h, hs)
+        else:
+            hc= c[..., None] * h
+        K= S.shape[-1]
+        ntap= h.shape[-1]
+        lead= S.shape[:-2]
+        U= np.zeros(lead + (K*ntap+1, K+1))
+        U[..., :-1, :K]= np.repeat(np.swapaxes(S, -1, -2), ntap, axis=-2) * h.reshape(lead + (-1,))[..., None]
+        U[..., :-1, K]= hc.reshape(lead + (-1,))
+        U[..., -1, :K]= e
+        return U, h, hc
+
+    def applied_wall(self, tau, wall):
+        # wall loss of each wave that is applied by the read filter: none if shorter than 2 samples
+        return np.where(tau * self.sr >= 2.0, wall, 0.0)
+
+    def losses(self,):
+        # wall and rad of each wave for frequency_response(), None if there are no such losses
+        return self.scattering_form()[5:]
+
+    def scattering(self,):
+        # scattering form of the network:
+        #   written wave = S @ read wave + e * yg,  y2tm = c @ read wave
+        return self.scattering_form()[:5]
+
+    def scattering_form(self,):
+        # S, e, c, tau, att of scattering() and wall, rad of losses() of the built model, at once.
+        # The delay tables and update matrix of compile() are not made and nothing is put in cache,
+        # so a response of many model parameters does not fill the cache.
+        self.build()
+        tubes, refl = self.tables()
+        S, e, c, tau, att, wall, rad = (x[0] for x in self.scattering_batch(tubes[None], refl[None]))
+        wall= self.applied_wall(tau, wall)
+        return S, e, c, tau, att, (wall if np.any(wall != 0) else None), (rad if np.any(rad != 0) else None)
+
+    def tables(self,):
+        # tube table (tubes, [L, A, att, wall]) and junction table (junctions, [r, rad]) of the built model,
+        # as scattering_batch() takes them
+        return (np.array(self.tubes, dtype=float).reshape(-1, 4),
+                np.array([[r, p] for kind, ports, r, p in self.junctions], dtype=float).reshape(-1, 2))
+
+    def scattering_batch(self, tubes, refl):
+        # scattering form of many sets of tubes and junction coefficients of this topology, at once
+        # tubes is (N, tubes, [L, A, att, wall]) and refl is (N, junctions, [r, rad]) as self.tubes and
+        # self.junctions.  return S, e, c, tau, att, wall, rad with leading axis N
+        N= tubes.shape[0]
+        K= 2 * tubes.shape[1]
+        S= np.zeros((N, K, K))
+        e= np.zeros((N, K))
+        c= np.zeros((N, K))
+        rad= np.zeros((N, K))
+        for n, (kind, ports, r, p) in enumerate(self.junctions):
+            waves= port_waves(ports)
+            if kind == 'junction':
+                ins= [i for i, o in waves]
+                outs= [o for i, o in waves]
+                S[:, np.array(outs)[:, None], np.array(ins)]= junction_scattering(tubes[:, [i for i, end in ports], 1])
+            elif kind == 'glottis':
+                S[:, waves[0][1], waves[0][0]]= refl[:, n, 0]
+                e[:, waves[0][1]]= ( 1. + refl[:, n, 0] ) / 2.
+            elif kind == 'lip':
+                S[:, waves[0][1], waves[0][0]]= -1. * refl[:, n, 0]
+                c[:, waves[0][0]]= 1. + refl[:, n, 0]
+                rad[:, waves[0][0]]= refl[:, n, 1]
+            elif kind == 'closed':
+                S[:, waves[0][1], waves[0][0]]= -1. * refl[:, n, 0]
+            else:
+                raise ValueError('unknown junction kind ' + str(kind))
+        tau, att, wall = self.wave_table(tubes)
+        return S, e, c, tau, att, wall, rad
+
+    def wave_table(self, tubes):
+        # delay time, attenuation and wall loss of each wave of tube tables (N, tubes, [L, A, att, wall]),
+        # (N, waves) each as scattering_batch(), without the scattering
+        tau= np.repeat(tubes[:, :, 0] / C0, 2, axis=1)
+        att= np.repeat(tubes[:, :, 2], 2, axis=1)
+        wall= np.repeat(tubes[:, :, 3], 2, axis=1)
+        return tau, att, wall
+
+    def check_junctions(self,):
+        # check if sum of the scattering coefficients from each incoming wave at each junction is 1
+        S= self.compile()['S']
+        for n, (kind, ports, r, p) in enumerate(self.junctions):
+            if kind == 'junction':
+                ins= [i for i, o in port_waves(ports)]
+                outs= [o for i, o in port_waves(ports)]
+                print('junction', n, np.sum(S[np.ix_(outs, ins)], axis=0))
+
+    def to_filter(self, output='ba'):
+        # get equivalent IIR filter of process(), as (b, a) or second-order sections 'sos'
+        cp= self.compile()
+        b, a = transfer_function(cp['S'], cp['e'], cp['c'], cp['Dr'], cp['att'], cp['h'], cp['hc'])
+        if output == 'sos':
+            return ba_to_sos(b, a)
+        return b, a
+
+    def fone(self, xw):
+        # calculate frequecny response at xw [rad/second], one point or array
+        return self.response(np.asarray(xw) / (2.0 * np.pi), db=False)[()]
+
+    def response(self, freqs, out=None, db=True):
+        # calculate frequecny response at freqs [Hz], all points in one pass
+        # out is a preallocated output buffer, same shape as freqs, dB value if db is True
+        # the response is kept in cache by model parameters and freqs, but not when out is given:
+        # that is the path of a caller that evaluates many models into one buffer, without allocation
+        freqs= np.asarray(freqs, dtype=float)
+        key= None
+        if self.cache is not None and out is None:
+            self.build()
+            key= (self.model_key(), 'response', db, grid_key(freqs))
+            val= self.cache.get(key)
+            if val is not None:
+                return val.copy()
+        if out is None:
+            out= np.empty(freqs.shape)
+        self.compute_response(freqs, out, db)
+        if key is not None:
+            self.cache.put(key, out.copy())
+        return out
+
+    def compute_response(self, freqs, out, db=True):
+        # frequecny response at freqs [Hz] into out, without cache
+        # junction scattering equations are solved as a complex linear system per frequency
+        # this is the response of exact tube length, see to_filter() for the one of process()
+        S, e, c, tau, att, wall, rad = self.scattering_form()
+        val= frequency_response(S, e, c, tau, att, self.sr, freqs * 2.0 * np.pi, wall, rad)
+        np.abs(val, out=out)
+        if db:
+            np.log10(out, out=out)
+            out *= 20
+        return out
+
+    def formants(self, freq_low=100, freq_high=6000, resolution=10):
+        # get resonance frequencies [Hz] and their bandwidths [Hz], from freq_low to freq_high
+        # They are the poles of exact tube length: peaks of the response and minimums of
+        # |det(I - S Dz)| on a coarse grid of resolution [Hz] are refined by Newton's method
+        # in the complex plane.
+        S, e, c, tau, att, wall, rad = self.scattering_form()
+        f= np.arange(0, freq_high + 2 * resolution, resolution)
+        L, F, dL, dF = loss_filters(2.0j * np.pi * f, self.sr, wall, rad)
+        Dz= att ** (tau * self.sr) * np.exp(-1.0j * np.multiply.outer(f * 2.0 * np.pi, tau)) * L * F
+        logdet= np.linalg.slogdet(np.eye(len(tau)) - S * Dz[:, None, :])[1]
+        amp= np.abs(frequency_response(S, e, c, tau, att, self.sr, f * 2.0 * np.pi, wall, rad))
+        m0= np.flatnonzero((logdet[1:-1] <= logdet[:-2]) & (logdet[1:-1] < logdet[2:])) + 1
+        m1= np.flatnonzero((amp[1:-1] >= amp[:-2]) & (amp[1:-1] > amp[2:])) + 1
+        s, done = resonances(S, e, c, tau, att, self.sr, f[np.union1d(m0, m1)], wall=wall, rad=rad)
+        s= s[done & (s.imag > 0) & (s.real < 0)]
+        s= s[np.argsort(s.imag)]
+        s= s[np.abs(np.diff(s, prepend=0)) > 1e-6 * np.abs(s)]  # same pole from other start
+        freqs= s.imag / (2.0 * np.pi)
+        bands= -1.0 * s.real / np.pi
+        sel= (freqs >= freq_low) & (freqs <= freq_high)
+        return freqs[sel], bands[sel]
+
+    def response_adaptive(self, freq_low=100, freq_high=6000, tol=0.005, initial=64, max_points=4096, min_df=1e-3):
+        # frequecny response [dB] on a non-uniform grid from freq_low to freq_high, that is refined until
+        # cubic spline interpolation between the points, CubicSpline(freqs, amp) of scipy.interpolate,
+        # is within tol [dB].  return amp, freqs as H0()
+        # The grid starts from initial intervals and the peaks of resonances: the poles near the local
+        # maxima of the coarse grid are found by resonances(), and the peak frequency and points at
+        # 0.25 ... 4 times the half bandwidth on both sides are added.  Then every interval whose
+        # midpoint is off the spline of the points by more than tol is halved, all intervals of one pass
+        # at once, until max_points or intervals of min_df [Hz].  The result is kept in cache.
+        # With the default tol, the spline is closer to the response than linear interpolation of a
+        # 1 Hz grid, by 10 to 20 times less points for the presets.  Linear interpolation between the
+        # points, as a plot, is within about 0.1 dB.
+        key= None
+        if self.cache is not None:
+            self.build()
+            key= (self.model_key(), 'response_adaptive', freq_low, freq_high, tol, initial, max_points, min_df)
+            val= self.cache.get(key)
+            if val is not None:
+                return val[0].copy(), val[1].copy()
+        f= np.linspace(freq_low, freq_high, initial + 1)
+        a= self.compute_response(f, np.empty(f.shape))
+        m= np.flatnonzero((a[1:-1] >= a[:-2]) & (a[1:-1] > a[2:])) + 1
+        if len(m):
+            S, e, c, tau, att, wall, rad = self.scattering_form()
+            p, done = resonances(S, e, c, tau, att, self.sr, f[m], iters=20, wall=wall, rad=rad)
+            p= p[done & (p.imag > 0) & (p.real < 0)]
+            offsets= np.array([0., -0.25, 0.25, -0.5, 0.5, -1., 1., -2., 2., -4., 4.])
+            fp= (p.imag[:, None] - p.real[:, None] * offsets) / (2.0 * np.pi)  # half bandwidth is -real / 2 pi
+            fp= np.setdiff1d(fp[(fp > freq_low) & (fp < freq_high)], f)
+            if len(fp):
+                f= np.concatenate([f, fp])
+                a= np.concatenate([a, self.compute_response(fp, np.empty(fp.shape))])
+                order= np.argsort(f)
+                f, a = f[order], a[order]
+                keep= np.diff(f, prepend=-np.inf) > min_df / 2.  # points of close poles
+                f, a = f[keep], a[keep]
+        active= np.diff(f) > 2. * min_df  # intervals to check
+        while np.any(active) and len(f) < max_points:
+            i= np.flatnonzero(active)
+            fm= (f[i] + f[i+1]) / 2.
+            am= self.compute_response(fm, np.empty(fm.shape))
+            bad= np.abs(am - interpolate.CubicSpline(f, a)(fm)) > tol
+            # midpoints are inserted after their interval, the halves of bad intervals are checked again
+            f= np.insert(f, i + 1, fm)
+            a= np.insert(a, i + 1, am)
+            active= np.zeros(len(f) - 1, dtype=bool)
+            j= i + np.arange(len(i))  # first half of interval i in the new grid
+            active[j[bad]]= True
+            active[j[bad] + 1]= True
+            active &= f[1:] - f[:-1] > 2. * min_df
+        if key is not None:
+            self.cache.put(key, (a.copy(), f.copy()))
+        return a, f
+
+    def H0(self, freq_low=100, freq_high=5000, Band_num=256):
+        # get Log scale frequecny response, from freq_low to freq_high, Band_num points
+        fcl=freq_low * 1.0    # convert to float
+        fch=freq_high * 1.0   # convert to float
+        delta1=np.power(fch/fcl, 1.0 / (Band_num)) # Log Scale
+        bands= fcl * np.power(delta1, np.arange(Band_num+1))
+        return   self.response(bands), bands # = amp value, freq list
+
+    def process(self, yg, engine='loop', trajectory=None, control=64, trace=None):
+        # process reflection transmission of resonance tube: yg is input, y2tm is output
+        # engine='lfilter' renders through the equivalent IIR filter instead of the stepping kernel
+        # engine='fft' renders by convolution with the impulse response, see render_fft()
+        # trajectory changes model parameters during process, see process_dynamic()
+        # trace is a Class_Tube_Trace that records energy and timing of the stepping kernel,
+        # see process_traced()
+        if trace is not None:
+            if engine != 'loop' or trajectory is not None:
+                raise ValueError('trace is supported by engine loop without trajectory')
+            return self.process_traced(yg, trace)
+        if trajectory is not None:
+            return self.process_dynamic(yg, trajectory, control)
+        if engine == 'lfilter':
+            # coefficients, input and output are of self.dtype, as the delay lines of the loop
+            b, a = self.to_filter()
+            return signal.lfilter(b.astype(self.dtype), a.astype(self.dtype), np.asarray(yg, dtype=self.dtype))
+        if engine == 'fft':
+            return self.render_fft(yg)
+        self.compile()
+        y2tm=np.zeros(len(yg), dtype=self.dtype)
+        self.process_loop(yg, y2tm, self.new_state())
+        return y2tm
+
+    def impulse_response(self, length=None, tol=1e-9, max_length=None):
+        # impulse response of process(), length [sample] or until the energy of the tail
+        # after it is less than tol of total energy.  max_length is a limit, default 60 seconds.
+        # The response is kept and used again while the model parameters are same.
+        cp= self.compile()
+        key= hashlib.sha1(b''.join(np.ascontiguousarray(cp[k]).tobytes() for k in ('S', 'e', 'c', 'Dr', 'h', 'hc'))
+                          + str((self.sr, length, tol)).encode()).hexdigest()
+        if self.ir is not None and self.ir[0] == key:
+            return self.ir[1]
+        state= self.new_state()
+        if length is not None:
+            x= np.zeros(length)
+            x[0]= 1.0
+            h= np.zeros(length, dtype=self.dtype)
+            self.process_loop(x, h, state)
+        else:
+            if max_length is None:
+                max_length= int(self.sr * 60)
+            chunk= 4096
+            x= np.zeros(chunk)
+            x[0]= 1.0
+            parts=[]
+            energy= 0.
+            while True:
+                y= np.zeros(chunk, dtype=self.dtype)
+                self.process_loop(x, y, state)
+                x[0]= 0.
+                parts.append(y)
+                e= float(np.dot(y, y))
+                energy += e
+                if e <= tol * energy or len(parts) * chunk >= max_length:
+                    break
+            h= np.concatenate(parts)[:max_length]
+            tail= np.cumsum((h * h)[::-1])[::-1]  # energy from each sample to the end
+            h= h[:max(1, int(np.count_nonzero(tail > tol * energy)))]
+        self.ir= (key, h)
+        return h
+
+    def render_fft(self, x, block=4096, tol=1e-9):
+        # process by convolution with the impulse response, uniformly partitioned overlap-add:
+        # the response is cut into partitions of block samples, and each block of input
+        # spectrum is multiplied with all partitions (frequency domain delay line).
+        # Input is transformed some blocks at once, so an hour long input is not on memory
+        # as spectrum.  tol is same as impulse_response().
+        h= self.impulse_response(tol=tol)
+        B= block
+        P= -(-len(h) // B)  # number of partitions
+        Hf= np.fft.rfft(np.pad(h, (0, P * B - len(h))).reshape(P, B), n=2*B).astype(np.result_type(self.dtype, np.complex64))
+        N= len(x)
+        J= -(-N // B)       # number of input blocks
+        xp= np.zeros(J * B, dtype=self.dtype)
+        xp[:N]= x
+        y= np.zeros(J * B + B, dtype=self.dtype)
+        C= max(1, (1 << 20) // B)  # blocks transformed at once
+        X= np.zeros((P - 1 + C, B + 1), dtype=Hf.dtype)  # last P-1 input spectra and this chunk
+        for j0 in range(0, J, C):
+            c= min(C, J - j0)
+            X[P-1:P-1+c]= np.fft.rfft(xp[j0*B:(j0+c)*B].reshape(c, B), n=2*B)
+            Y= X[P-1:P-1+c] * Hf[0]
+            for p in range(1, P):
+                Y += X[P-1-p:P-1-p+c] * Hf[p]
+            yb= np.fft.irfft(Y, n=2*B)
+            y[j0*B:(j0+c)*B] += yb[:, :B].reshape(-1)
+            y[j0*B+B:(j0+c)*B+B] += yb[:, B:].reshape(-1)
+            X[:P-1]= X[c:c+P-1]
+        return y[:N]
+
+    def process_dynamic(self, yg, trajectory, control=64):
+        # process with model parameters that change in time, as a diphthong /a/ -> /o/
+        # trajectory is a dict of model parameter name, as 'L3' or 'A3', and its value that is
+        # an array of every sample or breakpoints [(time [second], value), ...] linearly interpolated.
+        # Coefficients are updated every control samples, and the delay lines are read by
+        # Lagrange interpolation, so tube length changes smoothly.  The topology must not change.
+        N= len(yg)
+        F= -(-N // control)  # number of control frames
+        tf= np.arange(F) * control
+        values= {}
+        for name, v in trajectory.items():
+            v= np.asarray(v, dtype=float)
+            if v.ndim == 2:
+                values[name]= np.interp(tf / self.sr, v[:, 0], v[:, 1])
+            else:
+                values[name]= v[tf]
+        tubes, refl = self.trajectory_tables(values, F)
+        self.compile()
+        tau, att, wall = self.wave_table(tubes)
+        K= tau.shape[1]
+        Dr, h, wall = self.read_filter(tau.reshape(-1), att.reshape(-1), wall.reshape(-1), 'lagrange')
+        Dr= Dr.reshape(F, K)
+        h= h.reshape(F, K, -1)
+        # update matrices are made for a chunk of G frames (about 4 MB) when the kernel reaches them,
+        # not for all frames at once.  With many waves, each one is a sparse matrix as in compile().
+        G= max(1, (1 << 22) // (8 * (K * h.shape[-1] + 1) * (K + 1)))
+        many= K > SPARSE_MIN_WAVES
+
+        def frame_matrices(f0, f1):
+            # update matrices of frames f0 ... f1-1, same as compile()
+            S, e, c, tau, att, wall, radw = self.scattering_batch(tubes[f0:f1], refl[f0:f1])
+            U= self.update_matrix(S, e, c, h[f0:f1], radw)[0].astype(self.dtype)
+            return [sparse.csr_matrix(u.T) for u in U] if many else U
+
+        f0, f1 = 0, min(F, G + 1)
+        Uf= frame_matrices(f0, f1)
+        ntap= ((Uf[0].shape[1] if many else Uf.shape[1]) - 1) // K  # radiation filter adds taps
+
+        # stepping kernel of process_loop(), the update matrix and read taps are changed every frame.
+        # Read offsets are made once per distinct delay vector, as a slowly changing length keeps
+        # the same Dr for many frames.  A step runs over the end of a frame into the next one,
+        # if the delays of both allow it, and the rows of each frame are multiplied by its matrix.
+        P= int(Dr.max()) + ntap - 1
+        Bf= Dr.min(axis=1).astype(int)  # steps at once in each frame
+        Bmax= int(Bf.max())
+        buf= np.zeros((P + max(1024, 64 * Bmax), K+1), dtype=self.dtype)
+        H, K1 = buf.shape
+        flat= buf.reshape(-1)
+        tables= {}
+        offs= []
+        for f in range(F):
+            key= Dr[f].tobytes()
+            if key not in tables:
+                tables[key]= self.read_offsets(Dr[f], ntap, Bf[f], K1)
+            offs.append(tables[key])
+        idx= np.zeros((Bmax, K*ntap+1), dtype=int)
+        r= np.zeros(idx.shape, dtype=self.dtype)
+        w= np.zeros((Bmax, K+1), dtype=self.dtype)
+        y2tm= np.zeros(N, dtype=self.dtype)
+        Bf= Bf.tolist()
+        t= P
+        n= 0
+        while n < N:
+            f= n // control
+            m= min(Bf[f], N - n)
+            m1= min(m, (f + 1) * control - n)  # rows of frame f
+            if m1 < m:
+                m= min(m, Bf[f+1], m1 + control)
+            if f + 1 + (m1 < m) > f1:  # next chunk of frames, from this one
+                f0, f1 = f, min(F, f + G + 1)
+                Uf= frame_matrices(f0, f1)
+            if t + m > H:
+                buf[:P]= buf[t-P:t]
+                t= P
+            buf[t:t+m, K]= yg[n:n+m]
+            np.add(offs[f][:m1], t * K1, out=idx[:m1])
+            if m1 < m:
+                np.add(offs[f+1][m1:m], t * K1, out=idx[m1:m])
+            np.take(flat, idx[:m], out=r[:m], mode='clip')
+            if many:
+                w[:m1]= (Uf[f-f0] @ r[:m1].T).T
+                if m1 < m:
+                    w[m1:m]= (Uf[f+1-f0] @ r[m1:m].T).T
+            else:
+                np.matmul(r[:m1], Uf[f-f0], out=w[:m1])
+                if m1 < m:
+                    np.matmul(r[m1:m], Uf[f+1-f0], out=w[m1:m])
+            buf[t:t+m, :K]= w[:m, :K]
+            y2tm[n:n+m]= w[:m, K]
+            t += m
+            n += m
+        return y2tm
+
+    def trajectory_tables(self, values, F):
+        # tube table (F, tubes, [L, A, att, wall]) and junction table (F, junctions, [r, rad]) of the
+        # model parameters values {name: value of each of F frames}.
+        # The presets put the parameters straight into the tubes and junctions, so the tables are an
+        # affine function of them, as in tube_fit.py: the tables are built at the first frame and at
+        # one step of each parameter, and checked at the midpoint of each step and at the last frame.
+        # Otherwise the model is built at every frame.
+        names= list(values)
+        saved= {name: getattr(self, name) for name in names}
+
+        def table(theta):
+            for name, v in zip(names, theta):
+                setattr(self, name, v)
+            self.build()
+            return self.tables()
+
+        try:
+            theta= np.array([values[name] for name in names], dtype=float).reshape(len(names), F).T
+            tubes0, refl0 = table(theta[0])
+            dtubes= np.zeros((len(names),) + tubes0.shape)
+            drefl= np.zeros((len(names),) + refl0.shape)
+            affine= True
+            for p in range(len(names)):
+                fp= int(np.argmax(np.abs(theta[:, p] - theta[0, p])))
+                step= theta[fp, p] - theta[0, p]
+                if step == 0:
+                    continue
+                x= theta[0].copy()
+                x[p]= theta[fp, p]
+                tubes1, refl1 = table(x)
+                x[p]= theta[0, p] + step / 2.
+                tubes2, refl2 = table(x)
+                dtubes[p]= (tubes1 - tubes0) / step
+                drefl[p]= (refl1 - refl0) / step
+                if not (np.allclose(tubes2, (tubes0 + tubes1) / 2.) and np.allclose(refl2, (refl0 + refl1) / 2.)):
+                    affine= False
+                    break
+            if affine:
+                d= theta - theta[0]
+                tubes= tubes0 + np.tensordot(d, dtubes, axes=1)
+                refl= refl0 + np.tensordot(d, drefl, axes=1)
+                tubes2, refl2 = table(theta[-1])
+                affine= np.allclose(tubes[-1], tubes2) and np.allclose(refl[-1], refl2)
+            if not affine:
+                tables= [table(x) for x in theta]
+                tubes= np.array([tb for tb, rf in tables])
+                refl= np.array([rf for tb, rf in tables])
+        finally:
+            for name in names:
+                setattr(self, name, saved[name])
+        return tubes, refl
+
+    def process_traced(self, yg, trace):
+        # stepping kernel run in chunks of trace.decimation samples, one row of trace log after each chunk
+        # A chunk is rounded up to whole steps of the kernel, so that the products are of same rows as
+        # without trace and the output is same bit for bit.
+        t0= time.perf_counter()
+        cp= self.compile()
+        trace.start(len(self.tubes), [kind for kind, ports, r, p in self.junctions])
+        trace.add_time('compile', time.perf_counter() - t0)
+        state= self.new_state()
+        y2tm= np.zeros(len(yg), dtype=self.dtype)
+        B= cp['off'].shape[0]
+        chunk= -(-trace.decimation // B) * B
+        for n in range(0, len(yg), chunk):
+            m= min(chunk, len(yg) - n)
+            self.process_loop(yg[n:n+m], y2tm[n:n+m], state, trace if trace.timing else None)
+            t0= time.perf_counter()
+            energy, balance, peak_wave = self.trace_waves(state)
+            stop= trace.record(n + m, np.max(np.abs(yg[n:n+m])), np.max(np.abs(y2tm[n:n+m])), peak_wave, energy, balance)
+            trace.add_time('trace', time.perf_counter() - t0)
+            if stop:
+                break
+        return y2tm
+
+    def trace_waves(self, state):
+        # energy of the waves in the delay lines of each tube, power balance of each junction at the
+        # last step, and peak of the waves in the delay lines.  See tube_trace.py
+        cp= self.compiled
+        buf= state['buf']
+        t= int(state['t'][0])
+        P= cp['P']
+        D= cp['D']
+        Dr= cp['Dr']
+        h= cp['h']
+        K= len(D)
+        A= np.repeat([tube[1] for tube in self.tubes], 2)  # area of each wave
+        # waves written at steps t-D ... t-1 are in flight
+        hist= buf[t-P:t, :K].astype(float)
+        w2= np.where(np.arange(P)[:, None] >= P - D, hist * hist, 0.)
+        e= np.sum(w2, axis=0) / A
+        energy= e[0::2] + e[1::2]
+        peak_wave= np.sqrt(np.max(w2)) if w2.size else 0.
+        # waves read into the scattering and written at the last step t-1
+        rows= t - 1 - Dr[:, None] - np.arange(h.shape[1])
+        r= np.sum(h * buf[rows, np.arange(K)[:, None]], axis=1)
+        w= buf[t-1, :K].astype(float)
+        balance= np.zeros(len(self.junctions))
+        for n, (kind, ports, rj, p) in enumerate(self.junctions):
+            ins= [i for i, o in port_waves(ports)]
+            outs= [o for i, o in port_waves(ports)]
+            balance[n]= np.sum(r[ins] ** 2 / A[ins]) - np.sum(w[outs] ** 2 / A[outs])
+        return energy, balance, peak_wave
+
+    def process_block(self, x, out=None):
+        # process one block of a stream, delay lines are carried over from the previous block
+        # out is a preallocated output buffer, same length as x
+        if self.state is None:
+            self.reset()
+        if out is None:
+            out=np.zeros(len(x), dtype=self.dtype)
+        self.process_loop(x, out, self.state)
+        return out
+
+    def reset(self,):
+        # clear delay lines of block processing, and take in current model parameters
+        self.compile()
+        self.state=self.new_state()
+
+    def get_state(self,):
+        # get a copy of delay lines and position in them of block processing
+        if self.state is None:
+            self.reset()
+        return {k: v.copy() for k, v in self.state.items()}
+
+    def set_state(self, state):
+        # restore delay lines and position in them got by get_state()
+        if self.state is None:
+            self.reset()
+        for k, v in self.state.items():
+            v[...]= state[k]
+
+    def new_state(self,):
+        # zeroed delay lines and position in them
+        cp= self.compiled
+        return {'buf': np.zeros((cp['P'] + cp['R'], len(cp['D']) + 1), dtype=self.dtype), 't': np.array([cp['P']])}
+
+    def read_offsets(self, Dr, ntap, B, K1):
+        # read index of the taps of all waves and the input, of B steps, relative to row t of the
+        # history buffer of K1 columns: row i is [taps of wave 0, taps of wave 1, ..., yg]
+        K= len(Dr)
+        off= np.zeros((B, K*ntap+1), dtype=int)
+        off[:, :-1]= ((np.arange(B)[:, None, None] - Dr[None, :, None] - np.arange(ntap)) * K1
+                      + np.arange(K)[:, None]).reshape(B, -1)
+        off[:, -1]= np.arange(B) * K1 + K
+        return off
+
+    def loop_buffers(self, shape, K1, dtype):
+        # work buffers of process_loop(): read index and read taps of shape, and written waves and output
+        # of K1 columns.  They are made again only when the shape or dtype changes.
+        work= self.loop_work
+        if work is None or work[1].shape != shape or work[2].shape[1] != K1 or work[1].dtype != dtype:
+            self.loop_work= (np.zeros(shape, dtype=int), np.zeros(shape, dtype=dtype), np.zeros((shape[0], K1), dtype=dtype))
+        return self.loop_work
+
+    def process_loop(self, yg, y2tm, state, timer=None):
+        # stepping kernel
+        # All delay lines are one history buffer buf[P+R, K+1], row t holds the waves written at step t
+        # and the input yg of step t in the last column.  Wave k written at step t is read at
+        # step t+Dr[k] ... t+Dr[k]+ntap-1 through the read filter h[k] (one tap att ** D[k] if integer).
+        # Nothing written at step t is read before step t+min(Dr), so min(Dr) steps are processed
+        # at once: one gather of the read taps and one product with the update matrix U,
+        # that gives the written waves and the output y2tm.
+        # When the buffer is full, the last P rows are moved to the top.
+        # timer is an optional Class_Tube_Trace, the time of each stage is added up by its add_time()
+        # The read offsets are made by compile() and the work buffers are kept, so a call allocates
+        # nothing but with the sparse update matrix, whose product is a new array.
+        cp= self.compiled
+        buf= state['buf']
+        H, K1 = buf.shape
+        K= K1 - 1
+        P= cp['P']
+        off= cp['off']
+        B= off.shape[0]
+        U= cp['U']
+        flat= buf.reshape(-1)
+        idx, r, w = self.loop_buffers(off.shape, K1, buf.dtype)
+        t= int(state['t'][0])
+        clock= time.perf_counter
+        for n in range(0, len(yg), B):
+            m= min(B, len(yg) - n)
+            if timer is not None:
+                t0= clock()
+            if t + B > H:
+                buf[:P]= buf[t-P:t]
+                t= P
+                if timer is not None:
+                    t1= clock()
+                    timer.add_time('move', t1 - t0)
+                    t0= t1
+            buf[t:t+m, K]= yg[n:n+m]
+            np.add(off, t * K1, out=idx)
+            np.take(flat, idx, out=r, mode='clip')  # indices are in range, 'clip' is not buffered
+            if timer is not None:
+                t1= clock()
+            if U is None:
+                w[:m]= (cp['U_sparse'] @ r[:m].T).T
+            else:
+                np.matmul(r[:m], U, out=w[:m])
+            if timer is not None:
+                t2= clock()
+            buf[t:t+m, :K]= w[:m, :K]
+            y2tm[n:n+m]= w[:m, K]
+            t += m
+            if timer is not None:
+                timer.add_time('gather', t1 - t0)
+                timer.add_time('product', t2 - t1)
+                timer.add_time('write', clock() - t2)
+        state['t'][0]= t
+        return y2tm
+
+
+if __name__ == '__main__':
+
+    # T three tube model as a network: tube1 from glottis, tube2 to lips, tube3 closed side branch
+    net= Class_TubeNetwork(sampling_rate=48000)
+    t1= net.add_tube(9.0, 1.0)
+    t2= net.add_tube(8.0, 7.0)
+    t3= net.add_tube(5.6, 3.0)
+    net.add_glottis((t1, 0))
+    net.add_junction([(t1, 1), (t2, 0), (t3, 0)])
+    net.add_lip((t2, 1))
+    net.add_closed((t3, 1))
+    net.check_junctions()
+    print('H0', net.H0()[0][:4])
+    print('formants', net.formants())
+    amp, freqs = net.response_adaptive(100, 6000)
+    print('adaptive grid', len(freqs), 'points, peak', freqs[np.argmax(amp)], 'Hz')
+    net.delay= 'lagrange'
+    print('filter order', len(net.to_filter()[1]) - 1)
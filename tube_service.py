@@ -0,0 +1,410 @@
+#coding:utf-8
+
+#
+# Local synthesis service of the tube models
+#
+# A small HTTP/1.1 server on asyncio, for localhost, that renders audio and computes
+# frequency responses of tube models for other programs.  JSON request body:
+#   POST /render    {"model": "T", "params": {"L1": 9.0, ...}, "sampling_rate": 48000,
+#                    "input": [...] or "input_b64": "..." or "noise": {"length": 0.5, "seed": 0}}
+#                   -> {"samples": N, "output_b64": "..."}, float32 little endian in base64
+#   POST /response  {"model": "T", "params": {...}, "freqs": [...] or {"low": 100, "high": 5000,
+#                    "resolution": 10}}  -> {"freqs": [...], "amp": [...]} in dB
+#   GET  /stats     queue depth, batches and latency percentiles of each path
+# optional keys: "delay", "dtype" ('float64' or 'float32'), "wall_loss", "lip_radiation", "engine"
+#
+# Work is done in a pool of worker processes that are started and warmed (modules imported,
+# one model compiled) before the server accepts connections.  Requests that arrive within
+# a short window and have compatible configuration (same model, sampling rate, dtype,
+# integer delay, no losses, same input length) are coalesced into one Class_Tube_Batch
+# render, other requests of the window are sent to a worker as one job.  Responses are
+# kept in a cache of this process by request, so a repeated one does not reach the pool,
+# and same requests at the same time wait for one result.
+# Where fork is available, the models are imported in this process before the pool is
+# started, so that workers begin with them imported.
+#
+
+
+import sys
+import json
+import time
+import base64
+import asyncio
+import argparse
+import http.client
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+from tube_cache import Class_LRU_Cache
+
+
+# Check version
+#  Python 3.10.4, 64bit on Win32 (Windows 10)
+#  numpy 1.21.6
+#  scipy 1.8.0
+
+
+def encode_array(x):
+    # float32 little endian samples as base64 text
+    return base64.b64encode(np.asarray(x, dtype='<f4').tobytes()).decode('ascii')
+
+
+def decode_array(text):
+    return np.frombuffer(base64.b64decode(text), dtype='<f4').astype(float)
+
+
+def model_classes():
+    # model name of request: tube model class, imported in the worker
+    from T_three_tube import Class_T_ThreeTube
+    from oneloop_four_tube import Class_1loop_FourTube
+    from kelly_lochbaum import Class_KL_AreaTube
+    return {'T': Class_T_ThreeTube, '1loop': Class_1loop_FourTube, 'kl': Class_KL_AreaTube}
+
+
+def make_tube(req):
+    # tube model instance of a request
+    classes= model_classes()
+    if req.get('model') not in classes:
+        raise ValueError('unknown model ' + str(req.get('model')))
+    kw= dict(req.get('params', {}))
+    kw['sampling_rate']= int(req.get('sampling_rate', 48000))
+    kw['dtype']= np.dtype(req.get('dtype', 'float64'))
+    if 'delay' in req:
+        kw['delay']= req['delay']
+    tube= classes[req['model']](**kw)
+    for name in ('wall_loss', 'lip_radiation'):
+        if req.get(name):
+            if not hasattr(tube, name):
+                raise ValueError(name + ' is not supported by model ' + req['model'])
+            setattr(tube, name, float(req[name]))
+    return tube
+
+
+def request_input(req, sampling_rate):
+    # input signal of a render request
+    if 'input_b64' in req:
+        return decode_array(req['input_b64'])
+    if 'input' in req:
+        return np.asarray(req['input'], dtype=float)
+    if 'noise' in req:
+        noise= req['noise']
+        rng= np.random.default_rng(noise.get('seed', 0))
+        return rng.standard_normal(int(sampling_rate * noise.get('length', 1.0))) * noise.get('gain', 0.01)
+    raise ValueError('render request needs input, input_b64 or noise')
+
+
+def request_freqs(req):
+    # frequency points [Hz] of a response request
+    freqs= req.get('freqs', {})
+    if isinstance(freqs, dict):
+        low, high = freqs.get('low', 100), freqs.get('high', 5000)
+        resolution= freqs.get('resolution', 10)
+        return np.linspace(low, high, int((high - low) / resolution + 1))
+    return np.asarray(freqs, dtype=float)
+
+
+def batch_key(path, req):
+    # requests of same key are coalesced into one job of the pool.  Renders of integer delay
+    # without losses and of same input length are rendered by one Class_Tube_Batch
+    key= (path, req.get('model'), int(req.get('sampling_rate', 48000)), req.get('dtype', 'float64'))
+    if path != '/render':
+        return key
+    batchable= (req.get('delay', 'integer') == 'integer' and req.get('engine', 'loop') == 'loop'
+                and not req.get('wall_loss') and not req.get('lip_radiation'))
+    if not batchable:
+        return key + ('single',)
+    if 'input_b64' in req:
+        n= len(req['input_b64']) * 3 // 4
+    elif 'input' in req:
+        n= len(req['input'])
+    else:
+        n= ('noise', req.get('noise', {}).get('length', 1.0))
+    return key + ('batch', n)
+
+
+def _warm(delay):
+    # import the models and compile one in a worker, the delay keeps the worker busy so that
+    # all workers of the pool are started
+    tube= model_classes()['T'](9.0, 8.0, 5.6, 1.0, 7.0, 3.0)
+    tube.process(np.zeros(16))
+    tube.response(np.array([500.0]))
+    time.sleep(delay)
+    return True
+
+
+def _run_job(path, key, reqs):
+    # one job in a worker: a list of requests of same batch key.  return a list of results,
+    # an exception is returned in place of the result of its request
+    results= []
+    if path == '/response':
+        for req in reqs:
+            try:
+                freqs= request_freqs(req)
+                results.append({'freqs': freqs.tolist(), 'amp': make_tube(req).response(freqs).tolist()})
+            except Exception as err:
+                results.append(err)
+        return results
+    if key[-2] == 'batch' and len(reqs) > 1:
+        try:
+            from tube_batch import Class_Tube_Batch
+            tubes= [make_tube(req) for req in reqs]
+            X= np.stack([request_input(req, tubes[0].sr) for req in reqs])
+            Y= Class_Tube_Batch(tubes, dtype=tubes[0].dtype).process(X)
+            return [{'samples': Y.shape[1], 'output_b64': encode_array(y)} for y in Y]
+        except Exception:
+            pass  # one bad request, render one by one so that the others are done
+    for req in reqs:
+        try:
+            tube= make_tube(req)
+            y= tube.process(request_input(req, tube.sr), engine=req.get('engine', 'loop'))
+            results.append({'samples': len(y), 'output_b64': encode_array(y)})
+        except Exception as err:
+            results.append(err)
+    return results
+
+
+class Class_Tube_Service(object):
+    def __init__(self, host='127.0.0.1', port=8765, max_workers=2, window=0.002, max_batch=64,
+                 cache_bytes=64 * 1024 * 1024, history=1000):
+        # max_workers: number of worker processes, 0 is no pool (work in the event loop thread)
+        # window: time [second] to wait for compatible requests after the first one of a batch
+        # max_batch: a batch is sent at once when it has this number of requests
+        # history: number of latest requests of each path kept for the latency percentiles
+        self.host= host
+        self.port= port
+        self.max_workers= max_workers
+        self.window= window
+        self.max_batch= max_batch
+        self.cache= Class_LRU_Cache(cache_bytes)  # response results by request
+        self.history= history
+        self.pool= None
+        self.server= None
+        self.pending= {}  # batch key: list of (request, future) waiting for the window
+        self.computing= {}  # response key: future of the response being computed
+        self.queue_depth= 0  # requests received and not answered yet
+        self.in_flight= 0  # jobs in the pool
+        self.num_of_batch= 0
+        self.num_of_batched= 0
+        self.latency= {}  # path: deque of latency [second]
+        self.count= {}  # path: number of requests
+        self.errors= 0
+        self.cold_start= None  # time [second] to start and warm the pool
+
+    async def start(self,):
+        # start and warm the pool, then the server
+        t0= time.perf_counter()
+        loop= asyncio.get_running_loop()
+        if self.max_workers > 0:
+            context= None
+            if sys.platform.startswith('linux'):
+                model_classes()  # workers are forked with the models imported
+                context= multiprocessing.get_context('fork')
+            self.pool= ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+            await asyncio.gather(*[loop.run_in_executor(self.pool, _warm, 0.05) for _ in range(self.max_workers)])
+        else:
+            _warm(0.)
+        self.server= await asyncio.start_server(self.handle, self.host, self.port)
+        self.port= self.server.sockets[0].getsockname()[1]  # port 0 is any free port
+        self.cold_start= time.perf_counter() - t0
+
+    async def close(self,):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.pool is not None:
+            self.pool.shutdown()
+
+    async def serve_forever(self,):
+        await self.start()
+        print('tube service on http://' + self.host + ':' + str(self.port), 'cold start %.3f sec' % self.cold_start)
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def handle(self, reader, writer):
+        # one connection, requests are served in order while it is kept alive
+        try:
+            while True:
+                line= await reader.readline()
+                if not line:
+                    break
+                method, path, version = line.decode('latin-1').split()[:3]
+                headers= {}
+                while True:
+                    h= await reader.readline()
+                    if h in (b'\r\n', b'\n', b''):
+                        break
+                    k, _, v = h.decode('latin-1').partition(':')
+                    headers[k.strip().lower()]= v.strip()
+                body= await reader.readexactly(int(headers.get('content-length', 0)))
+                status, result = await self.dispatch(method, path, body)
+                data= json.dumps(result).encode('utf-8')
+                keep= headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+                writer.write(('HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n'
+                              'Connection: %s\r\n\r\n' % (status, http.client.responses.get(status, ''), len(data),
+                                                          'keep-alive' if keep else 'close')).encode('latin-1') + data)
+                await writer.drain()
+                if not keep:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass  # client went away or sent a broken request line
+        finally:
+            writer.close()
+
+    async def dispatch(self, method, path, body):
+        # (status, result) of one request
+        if method == 'GET' and path == '/stats':
+            return 200, self.stats()
+        if method != 'POST' or path not in ('/render', '/response'):
+            return 404, {'error': 'unknown ' + method + ' ' + path}
+        t0= time.perf_counter()
+        self.queue_depth += 1
+        try:
+            req= json.loads(body)
+            if path == '/response':
+                key= json.dumps(req, sort_keys=True)
+                result= self.cache.get(key)
+                if result is None and key in self.computing:
+                    result= await asyncio.shield(self.computing[key])
+                elif result is None:
+                    self.computing[key]= asyncio.ensure_future(self.submit(path, req))
+                    try:
+                        result= await asyncio.shield(self.computing[key])
+                        self.cache.put(key, result)
+                    finally:
+                        del self.computing[key]
+            else:
+                result= await self.submit(path, req)
+            status= 200
+        except (ValueError, TypeError, KeyError) as err:
+            status, result = 400, {'error': type(err).__name__ + ': ' + str(err)}
+        except Exception as err:
+            status, result = 500, {'error': type(err).__name__ + ': ' + str(err)}
+        finally:
+            self.queue_depth -= 1
+        if status != 200:
+            self.errors += 1
+        self.count[path]= self.count.get(path, 0) + 1
+        self.latency.setdefault(path, deque(maxlen=self.history)).append(time.perf_counter() - t0)
+        return status, result
+
+    async def submit(self, path, req):
+        # wait for the result of one request, coalesced with others of same batch key
+        loop= asyncio.get_running_loop()
+        key= batch_key(path, req)
+        future= loop.create_future()
+        items= self.pending.setdefault(key, [])
+        items.append((req, future))
+        if len(items) >= self.max_batch:
+            self.flush(path, key)
+        elif len(items) == 1:
+            loop.call_later(self.window, self.flush, path, key)
+        return await future
+
+    def flush(self, path, key):
+        # send the requests waiting of key to the pool as one job
+        items= self.pending.pop(key, None)
+        if not items:
+            return
+        reqs= [req for req, future in items]
+        self.num_of_batch += 1
+        self.num_of_batched += len(items)
+        if self.pool is None:
+            try:
+                self.deliver(items, _run_job(path, key, reqs))
+            except Exception as err:
+                self.deliver(items, [err] * len(items))
+            return
+        self.in_flight += 1
+        job= asyncio.get_running_loop().run_in_executor(self.pool, _run_job, path, key, reqs)
+        job.add_done_callback(lambda job: self.done(items, job))
+
+    def done(self, items, job):
+        self.in_flight -= 1
+        if job.exception() is not None:
+            self.deliver(items, [job.exception()] * len(items))
+        else:
+            self.deliver(items, job.result())
+
+    def deliver(self, items, results):
+        for (req, future), result in zip(items, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def stats(self,):
+        # queue depth, batching and latency percentiles [msec] of each path
+        out= {'queue_depth': self.queue_depth, 'waiting': sum(len(v) for v in self.pending.values()),
+              'in_flight': self.in_flight, 'workers': self.max_workers, 'errors': self.errors,
+              'batches': self.num_of_batch,
+              'mean_batch': self.num_of_batched / self.num_of_batch if self.num_of_batch else 0.,
+              'cold_start_ms': None if self.cold_start is None else self.cold_start * 1000.,
+              'cache': self.cache.stats(), 'paths': {}}
+        for path, lat in self.latency.items():
+            p= np.percentile(np.asarray(lat) * 1000., [50, 90, 99])
+            out['paths'][path]= {'count': self.count[path], 'p50_ms': p[0], 'p90_ms': p[1], 'p99_ms': p[2]}
+        return out
+
+
+def call(path, payload=None, host='127.0.0.1', port=8765, timeout=60.):
+    # blocking client of the service: POST payload as JSON, or GET when payload is None.
+    # return the decoded result, an error status raises RuntimeError
+    conn= http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        if payload is None:
+            conn.request('GET', path)
+        else:
+            conn.request('POST', path, json.dumps(payload), {'Content-Type': 'application/json'})
+        res= conn.getresponse()
+        result= json.loads(res.read())
+    finally:
+        conn.close()
+    if res.status != 200:
+        raise RuntimeError(str(res.status) + ' ' + str(result.get('error')))
+    if 'output_b64' in result:
+        result['output']= decode_array(result.pop('output_b64'))
+    return result
+
+
+
+
+if __name__ == '__main__':
+
+    parser= argparse.ArgumentParser(description='local synthesis service of the tube models')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--window', type=float, default=0.002, help='batching window [second]')
+    parser.add_argument('--demo', action='store_true', help='start, send concurrent requests, print stats and exit')
+    args= parser.parse_args()
+    service= Class_Tube_Service(args.host, 0 if args.demo else args.port, args.workers, args.window)
+    if not args.demo:
+        try:
+            asyncio.run(service.serve_forever())
+        except KeyboardInterrupt:
+            sys.exit(0)
+        sys.exit(0)
+
+    async def demo():
+        # 32 renders of T three tube model /a/ with different L2 sent at once, coalesced into
+        # batches, and 32 responses of 4 different models, most of them from cache
+        await service.start()
+        print('cold start %.3f sec' % service.cold_start)
+        loop= asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(64))  # clients at the same time
+        base= {'model': 'T', 'sampling_rate': 48000}
+        renders= [dict(base, params={'L1': 9.0, 'L2': 7.0 + 0.05 * i, 'L3': 5.6, 'A1': 1.0, 'A2': 7.0, 'A3': 3.0},
+                       noise={'length': 0.25, 'seed': i}) for i in range(32)]
+        responses= [dict(base, params={'L1': 9.0, 'L2': 8.0, 'L3': 5.6 + i % 4, 'A1': 1.0, 'A2': 7.0, 'A3': 3.0},
+                         freqs={'low': 100, 'high': 5000, 'resolution': 10}) for i in range(32)]
+        jobs= [loop.run_in_executor(None, call, '/render', r, args.host, service.port) for r in renders]
+        jobs+= [loop.run_in_executor(None, call, '/response', r, args.host, service.port) for r in responses]
+        results= await asyncio.gather(*jobs)
+        print('render', len(renders), 'x', results[0]['samples'], 'samples, response', len(responses), 'x', len(results[-1]['amp']), 'points')
+        print(json.dumps(await loop.run_in_executor(None, call, '/stats', None, args.host, service.port), indent=1))
+        await service.close()
+
+    asyncio.run(demo())
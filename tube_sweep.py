@@ -0,0 +1,203 @@
+#coding:utf-8
+
+#
+# Parameter sweep of a tube model over a process pool, with results cached on disk
+#
+# Each point of a sweep is a set of model parameters.  Its frequency response, formants
+# and optional rendered audio are stored in one .npz file whose name is a hash of the
+# model class, the parameters with the defaults of the class filled in (sampling_rate
+# included), the model built from them and the analysis options, so a sweep that overlaps
+# an earlier one only computes the new points, and a changed default of the class is not
+# taken from the results of the old one.
+# A result file is written to a temporary name and renamed when complete, so a sweep
+# that is interrupted is resumed by running it again.
+#
+
+
+import os
+import json
+import inspect
+import hashlib
+import itertools
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from scipy.stats import qmc
+
+
+# Check version
+#  Python 3.10.4, 64bit on Win32 (Windows 10)
+#  numpy 1.21.6
+#  scipy 1.8.0
+
+
+def grid_points(**axes):
+    # all combinations of the values of each parameter
+    #   e.g. grid_points(a_ratio=np.linspace(1,2,11), l_ratio=[1.0, 1.2])
+    keys= list(axes.keys())
+    return [dict(zip(keys, v)) for v in itertools.product(*[list(np.ravel(axes[k])) for k in keys])]
+
+
+def random_points(n, seed=None, **bounds):
+    # n points of uniform random values, bounds of each parameter is (low, high)
+    rng= np.random.default_rng(seed)
+    keys= list(bounds.keys())
+    u= rng.random((n, len(keys)))
+    return _scale_points(u, keys, bounds)
+
+
+def lhs_points(n, seed=None, **bounds):
+    # n points of Latin hypercube sample, bounds of each parameter is (low, high)
+    keys= list(bounds.keys())
+    u= qmc.LatinHypercube(d=len(keys), seed=seed).random(n)
+    return _scale_points(u, keys, bounds)
+
+
+def _scale_points(u, keys, bounds):
+    low= np.array([bounds[k][0] for k in keys], dtype=float)
+    high= np.array([bounds[k][1] for k in keys], dtype=float)
+    v= low + u * (high - low)
+    return [dict(zip(keys, row)) for row in v.tolist()]
+
+
+def _run_point(tube_class, params, options):
+    # compute one point, run in a worker process
+    tube= tube_class(**params)
+    freq_low, freq_high, resolution = options['freqs']
+    if resolution is None:
+        amp, freqs = tube.response_adaptive(freq_low, freq_high)
+    else:
+        freqs= np.linspace(freq_low, freq_high, int((freq_high - freq_low) / resolution + 1))
+        amp= tube.response(freqs)
+    result= {'freqs': freqs, 'amp': amp}
+    result['formants'], result['bandwidths'] = tube.formants(freqs[0], freqs[-1])
+    if options['audio_length'] > 0:
+        rng= np.random.default_rng(options['seed'])
+        xin= rng.standard_normal(int(tube.sr * options['audio_length'])) * 0.01
+        result['audio']= tube.process(xin)
+    return result
+
+
+class Class_Tube_Sweep(object):
+    def __init__(self, tube_class, cache_dir='sweep_cache', freq_low=100, freq_high=6000, resolution=1,
+                 audio_length=0, seed=0, derive=None, **fixed):
+        # tube_class: tube model class, fixed: parameters same for all points, e.g. L1=4.0, sampling_rate=48000
+        # resolution: step [Hz] of the response, None is the non-uniform grid of response_adaptive()
+        # audio_length: length [second] of white noise rendered per point, 0 is no audio
+        # derive: function that makes model parameters from the parameters of a point,
+        #         e.g. A3 from a_ratio, it runs in this process
+        self.tube_class= tube_class
+        self.cache_dir= cache_dir
+        self.fixed= fixed
+        self.derive= derive
+        self.options= {'freqs': [freq_low, freq_high, resolution], 'audio_length': audio_length, 'seed': seed}
+
+    def params_of(self, point):
+        # all parameters of one point, fixed ones and the ones of the point
+        params= dict(self.fixed)
+        params.update(point)
+        if self.derive is not None:
+            params= self.derive(params)
+        return {k: (v.item() if hasattr(v, 'item') else v) for k, v in params.items()}
+
+    def resolved(self, params):
+        # parameters of the constructor with the defaults of tube_class filled in, and key of the
+        # model built from them (defaults set in the constructor, as rl3, are in it)
+        bound= inspect.signature(self.tube_class.__init__).bind(None, **params)
+        bound.apply_defaults()
+        args= dict(list(bound.arguments.items())[1:])
+        tube= self.tube_class(**params)
+        tube.build()
+        return args, tube.model_key()
+
+    def key(self, params):
+        # content address of a point: hash of model class, resolved parameters, model and analysis options
+        args, model = self.resolved(params)
+        desc= {'class': self.tube_class.__module__ + '.' + self.tube_class.__name__,
+               'params': args, 'model': model, 'options': self.options}
+        return hashlib.sha1(json.dumps(desc, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.npz')
+
+    def load(self, point):
+        # result of one point from cache, None if not computed yet
+        p= self.path(self.key(self.params_of(point)))
+        if not os.path.isfile(p):
+            return None
+        with np.load(p) as f:
+            return {k: f[k] for k in f.files}
+
+    def save(self, key, result):
+        p= self.path(key)
+        os.makedirs(os.path.dirname(p), exist_ok=True)
+        tmp= p + '.tmp' + str(os.getpid())
+        with open(tmp, 'wb') as f:
+            np.savez(f, **result)
+        os.replace(tmp, p)  # complete file appears at once
+
+    def run(self, points, max_workers=None, progress=True):
+        # compute all points which are not in cache, and return results of all points in order
+        # max_workers: number of worker processes, 0 is no pool (compute in this process)
+        todo= {}
+        for point in points:
+            params= self.params_of(point)
+            key= self.key(params)
+            if key not in todo and not os.path.isfile(self.path(key)):
+                todo[key]= params
+        n_all= len(points)
+        if progress:
+            print('sweep', n_all, 'points,', n_all - len(todo), 'in cache,', len(todo), 'to compute')
+        done= 0
+        if max_workers == 0:
+            for key, params in todo.items():
+                self.save(key, _run_point(self.tube_class, params, self.options))
+                done += 1
+                if progress:
+                    print('sweep', done, '/', len(todo))
+        elif todo:
+            with ProcessPoolExecutor(max_workers=max_workers) as pool:
+                jobs= {pool.submit(_run_point, self.tube_class, params, self.options): key for key, params in todo.items()}
+                for job in as_completed(jobs):
+                    self.save(jobs[job], job.result())
+                    done += 1
+                    if progress:
+                        print('sweep', done, '/', len(todo))
+        return [self.load(point) for point in points]
+
+    def table(self, points, results, n_formant=4):
+        # formant table of a sweep: array (points, n_formant), nan if less formants
+        F= np.full((len(points), n_formant), np.nan)
+        for i, r in enumerate(results):
+            f= r['formants'][:n_formant]
+            F[i, :len(f)]= f
+        return F
+
+
+
+
+if __name__ == '__main__':
+
+    # a_ratio and l_ratio sweep of 1loop four tube model example
+    from oneloop_four_tube import Class_1loop_FourTube
+    L1=4.0
+    L4=1.0
+    L2=10
+    A1=1
+    A2=3
+    A4= A1
+
+    def derive(params):
+        # tube3 is given by ratio to tube2
+        params= dict(params)
+        params['L3']= params['L2'] * params.pop('l_ratio')
+        params['A3']= params['A2'] * params.pop('a_ratio')
+        return params
+
+    sweep= Class_Tube_Sweep(Class_1loop_FourTube, derive=derive, L1=L1, L2=L2, L4=L4, A1=A1, A2=A2, A4=A4, sampling_rate=48000)
+    points= grid_points(l_ratio=[1.0, 1.2], a_ratio=np.linspace(1.0, 2.0, 5))
+    results= sweep.run(points)
+    print(sweep.table(points, results))
+    # Latin hypercube sample of same space, only new points are computed
+    points= lhs_points(10, seed=1, l_ratio=(1.0, 1.2), a_ratio=(1.0, 2.0))
+    results= sweep.run(points)
+    print(sweep.table(points, results))
@@ -0,0 +1,159 @@
+#coding:utf-8
+
+#
+# Trace of the stepping kernel: wave energy, junction power balance, peaks and timing
+#
+# Given to process(yg, trace=...) of a tube model, the stepping kernel is run in chunks of
+# decimation samples, rounded up to whole steps of the kernel, and after each chunk one row is
+# appended to the log:
+#   step         samples processed
+#   peak_out     peak of output y2tm in the chunk
+#   peak_wave    peak of the waves in the delay lines
+#   energy       energy of the waves in the delay lines of each tube, sum of wave ** 2 / A
+#                of the samples in flight, forward and backward (waves are volume velocity,
+#                so the power of a wave is wave ** 2 / A up to rho c)
+#   balance      power coming into each junction minus power going out at the last step.
+#                It is 0 at a junction of tubes, the injected power at the glottis with sign
+#                minus, and the power radiated at the lips.
+# The log is one float array grown by doubling, not lists.
+# A divergence alarm is set when the waves are not finite or the peak of the waves exceeds
+# limit times the peak of the input so far.
+# Time of each stage of the kernel (compile, move of the buffer, gather of the read taps,
+# product with the update matrix, write of the waves, trace itself) is added up too.
+# Without trace, process() runs the kernel as it is, nothing is added per sample, and the
+# output with trace is same bit for bit.
+#
+
+
+import numpy as np
+
+
+# Check version
+#  Python 3.10.4, 64bit on Win32 (Windows 10)
+#  numpy 1.21.6
+
+
+STAGES= ('compile', 'move', 'gather', 'product', 'write', 'trace')
+
+
+class Class_Tube_Trace(object):
+    def __init__(self, decimation=64, limit=1e3, on_alarm='record', timing=True, capacity=1024):
+        # decimation: samples between rows of the log, rounded up to whole steps of the kernel
+        # limit: alarm when peak of the waves > limit * peak of the input so far
+        # on_alarm: 'record' keeps processing, 'stop' ends processing (rest of output is 0),
+        #           'raise' raises FloatingPointError
+        # timing: add up time of the stages of the kernel, it costs a few clocks per block
+        if on_alarm not in ('record', 'stop', 'raise'):
+            raise ValueError('unknown on_alarm ' + str(on_alarm))
+        self.decimation= int(decimation)
+        self.limit= limit
+        self.on_alarm= on_alarm
+        self.timing= timing
+        self.capacity= capacity
+        self.num_of_tube= 0
+        self.num_of_junction= 0
+        self.junction_kinds= []
+        self.reset()
+
+    def reset(self,):
+        # clear the log, alarm and stage times
+        self.log= np.zeros((self.capacity, 4 + self.num_of_tube + self.num_of_junction))
+        self.n= 0
+        self.peak_in= 0.
+        self.alarm_step= -1  # first step of alarm, -1 is no alarm
+        self.alarm_reason= ''
+        self.stage_time= np.zeros(len(STAGES))
+        self.stage_count= np.zeros(len(STAGES), dtype=np.int64)
+
+    def start(self, num_of_tube, junction_kinds):
+        # log columns of a model: step, peak_out, peak_wave, total energy, energy of each tube,
+        # balance of each junction
+        self.num_of_tube= num_of_tube
+        self.junction_kinds= list(junction_kinds)
+        self.num_of_junction= len(self.junction_kinds)
+        self.reset()
+
+    def add_time(self, stage, seconds):
+        i= STAGES.index(stage)
+        self.stage_time[i] += seconds
+        self.stage_count[i] += 1
+
+    def record(self, step, peak_in, peak_out, peak_wave, energy, balance):
+        # append one row, and check divergence.  return True if processing should stop
+        if self.n == len(self.log):
+            self.log= np.concatenate([self.log, np.zeros_like(self.log)])
+        row= self.log[self.n]
+        row[0]= step
+        row[1]= peak_out
+        row[2]= peak_wave
+        row[3]= np.sum(energy)
+        row[4:4+self.num_of_tube]= energy
+        row[4+self.num_of_tube:]= balance
+        self.n += 1
+        self.peak_in= max(self.peak_in, peak_in)
+        if self.alarm_step < 0:
+            if not np.all(np.isfinite(row)):
+                self.alarm_reason= 'not finite'
+            elif peak_wave > self.limit * self.peak_in and self.peak_in > 0.:
+                self.alarm_reason= 'peak of waves %.3g is over %g times peak of input %.3g' % (peak_wave, self.limit, self.peak_in)
+            if self.alarm_reason:
+                self.alarm_step= int(step)
+                if self.on_alarm == 'raise':
+                    raise FloatingPointError('tube diverged at step ' + str(step) + ': ' + self.alarm_reason)
+        return self.alarm_step >= 0 and self.on_alarm == 'stop'
+
+    @property
+    def step(self,):
+        return self.log[:self.n, 0].astype(np.int64)
+
+    @property
+    def peak_out(self,):
+        return self.log[:self.n, 1]
+
+    @property
+    def peak_wave(self,):
+        return self.log[:self.n, 2]
+
+    @property
+    def total_energy(self,):
+        return self.log[:self.n, 3]
+
+    @property
+    def energy(self,):
+        return self.log[:self.n, 4:4+self.num_of_tube]
+
+    @property
+    def balance(self,):
+        return self.log[:self.n, 4+self.num_of_tube:]
+
+    def summary(self,):
+        # short summary of the trace as a dict
+        return {'rows': self.n, 'steps': int(self.log[self.n-1, 0]) if self.n else 0,
+                'max_energy': float(np.max(self.total_energy)) if self.n else 0.,
+                'max_peak_wave': float(np.max(self.peak_wave)) if self.n else 0.,
+                'max_junction_imbalance': float(np.max(np.abs(self.balance[:, np.array(self.junction_kinds) == 'junction']),
+                                                       initial=0.)) if self.n else 0.,
+                'alarm_step': self.alarm_step, 'alarm_reason': self.alarm_reason,
+                'stage_ms': {s: float(self.stage_time[i] * 1000.) for i, s in enumerate(STAGES) if self.stage_count[i]}}
+
+    def save(self, path):
+        # save the log as .npz
+        np.savez(path, log=self.log[:self.n], junction_kinds=np.array(self.junction_kinds),
+                 stage_time=self.stage_time, stage_count=self.stage_count)
+
+
+
+
+if __name__ == '__main__':
+
+    # one-loop four tube model with loop attenuation 0.998 and 1.0, and one with gain in the
+    # tubes (att_norm > 1) and no loss at the ends that diverges
+    from oneloop_four_tube import Class_1loop_FourTube
+    xin= np.random.default_rng(0).standard_normal(48000) * 0.05
+    for att_loop, att_norm, rg0, rl0 in [(0.998, 1.0, 0.95, 0.9), (1.0, 1.0, 0.95, 0.9), (1.0, 1.002, 1.0, -1.0)]:
+        tube= Class_1loop_FourTube(4.0, 10, 11, 1.0, 1, 3, 3, 1, rg0=rg0, rl0=rl0)
+        tube.att_loop= att_loop
+        tube.att_norm= att_norm
+        trace= Class_Tube_Trace(decimation=480, on_alarm='stop')
+        tube.process(xin, trace=trace)
+        print('att_loop', att_loop, 'att_norm', att_norm, trace.summary())
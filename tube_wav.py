@@ -0,0 +1,151 @@
+#coding:utf-8
+
+#
+# Streaming WAV file rendering through a tube model
+#
+# Input WAV file is read in chunks, memory-mapped when scipy can map it, or by wave module
+# for other PCM formats.  Each chunk is processed by process_block() with the delay lines
+# carried over, and written to the output WAV file at once, as int16 with clipping and
+# dither, or as float32.  Memory is a few chunks whatever the length of the file.
+# RIFF sizes are 32 bit, so a file is at most 4 GiB, about 12 hours of int16 at 48 kHz.
+#
+
+
+import os
+import wave
+import struct
+import numpy as np
+from scipy.io import wavfile
+
+
+# Check version
+#  Python 3.10.4, 64bit on Win32 (Windows 10)
+#  numpy 1.21.6
+#  scipy 1.8.0
+
+
+class Class_Wav_Writer(object):
+    def __init__(self, path, sampling_rate, sample_format='int16', dither=True, seed=0):
+        # mono WAV file written chunk by chunk, sample_format is 'int16' or 'float32'
+        # dither: add triangular dither of 1 LSB before rounding to int16
+        if sample_format not in ('int16', 'float32'):
+            raise ValueError('unknown sample_format ' + str(sample_format))
+        self.sample_format= sample_format
+        self.width= 2 if sample_format == 'int16' else 4  # bytes per sample
+        self.dither= dither
+        self.rng= np.random.default_rng(seed)
+        self.sr= sampling_rate
+        self.num_of_sample= 0
+        self.num_of_clip= 0
+        self.f= open(path, 'wb')
+        self.write_header()
+
+    def write_header(self,):
+        # RIFF header, sizes are written again by close()
+        tag= 1 if self.sample_format == 'int16' else 3
+        width= self.width
+        size= self.num_of_sample * width
+        self.f.write(b'RIFF' + struct.pack('<I', 36 + size) + b'WAVE')
+        self.f.write(b'fmt ' + struct.pack('<IHHIIHH', 16, tag, 1, self.sr, self.sr * width, width, width * 8))
+        self.f.write(b'data' + struct.pack('<I', size))
+
+    def write(self, x):
+        # write float samples, full scale is 1.0
+        # the chunk is refused before any byte is written, when RIFF size of 32 bit would overflow
+        if 36 + (self.num_of_sample + len(x)) * self.width > 0xFFFFFFFF:
+            raise ValueError('WAV file over 4 GiB: ' + str(self.num_of_sample + len(x)) + ' samples of ' + self.sample_format)
+        if self.sample_format == 'int16':
+            y= np.asarray(x, dtype=float) * 32768.
+            if self.dither:
+                y += self.rng.random(len(y)) - self.rng.random(len(y))
+            y= np.round(y)
+            self.num_of_clip += int(np.count_nonzero((y > 32767.) | (y < -32768.)))
+            self.f.write(np.clip(y, -32768., 32767.).astype('<i2').tobytes())
+        else:
+            self.f.write(np.asarray(x, dtype='<f4').tobytes())
+        self.num_of_sample += len(x)
+
+    def close(self,):
+        self.f.seek(0)
+        self.write_header()
+        self.f.close()
+
+
+def read_wav_chunks(path, chunk=65536):
+    # generator of (sampling rate, float chunk) of WAV file, channels are averaged to mono
+    # a file of no samples is one empty chunk, so its sampling rate is given too
+    try:
+        sr, data = wavfile.read(path, mmap=True)
+    except ValueError:
+        data= None
+    if data is not None:
+        scale= {'int16': 32768., 'int32': 2147483648., 'uint8': 128.}.get(data.dtype.name, 1.0)
+        shift= 128. if data.dtype.name == 'uint8' else 0.
+        for n in range(0, max(len(data), 1), chunk):
+            x= (np.asarray(data[n:n+chunk], dtype=float) - shift) / scale
+            yield sr, (x.mean(axis=1) if x.ndim == 2 else x)
+        return
+    # PCM that is not mapped, as 24 bit
+    with wave.open(path, 'rb') as w:
+        sr= w.getframerate()
+        width= w.getsampwidth()
+        channels= w.getnchannels()
+        n= 0
+        while True:
+            b= w.readframes(chunk)
+            if not b and n:
+                break
+            n += 1
+            u= np.frombuffer(b, dtype=np.uint8).reshape(-1, width)
+            v= np.zeros((len(u), 4), dtype=np.uint8)
+            v[:, 4-width:]= u  # little endian sample at upper bytes of int32
+            x= v.view('<i4')[:, 0] / 2147483648.
+            if width == 1:
+                x= (u[:, 0] - 128.) / 128.
+            yield sr, x.reshape(-1, channels).mean(axis=1)
+
+
+def render_wav(tube, in_path, out_path, chunk=65536, sample_format='int16', gain=1.0, dither=True):
+    # render input WAV file through tube into output WAV file, chunk by chunk
+    # sampling rate of input must be same as tube.  return number of samples, clipped samples and peak
+    # an input of no samples is written as a WAV file of no samples
+    tube.reset()
+    writer= None
+    y= np.zeros(chunk, dtype=tube.dtype)
+    peak= 0.
+    try:
+        for sr, x in read_wav_chunks(in_path, chunk):
+            if sr != tube.sr:
+                raise ValueError('sampling rate of ' + in_path + ' is ' + str(sr) + ', tube is ' + str(tube.sr))
+            if writer is None:
+                writer= Class_Wav_Writer(out_path, tube.sr, sample_format, dither)
+            out= y[:len(x)]
+            tube.process_block(x, out=out)
+            out *= gain
+            peak= max(peak, float(np.max(np.abs(out), initial=0.)))
+            writer.write(out)
+    finally:
+        if writer is not None:
+            writer.close()
+    return {'samples': writer.num_of_sample, 'clipped': writer.num_of_clip, 'peak': peak}
+
+
+
+
+if __name__ == '__main__':
+
+    # 10 seconds white noise file made chunk by chunk, and rendered through T three tube model /a/
+    from T_three_tube import Class_T_ThreeTube
+    wav_dir='wav_white_noise_in_out'
+    if not os.path.isdir(wav_dir):
+        os.makedirs(wav_dir)
+    tube= Class_T_ThreeTube(9.0, 8.0, 5.6, 1.0, 7.0, 3.0, sampling_rate=48000)
+    in_path= os.path.join(wav_dir, 'noise_10sec.wav')
+    writer= Class_Wav_Writer(in_path, tube.sr, 'int16')
+    rng= np.random.default_rng(0)
+    for n in range(10):
+        writer.write(rng.standard_normal(tube.sr) * 0.01)
+    writer.close()
+    out_path= os.path.join(wav_dir, 'noise_10sec_3tube_yout.wav')
+    print(render_wav(tube, in_path, out_path, sample_format='float32'))
+    print('save ', out_path)